@@ -0,0 +1,150 @@
+# admission.py
+# Admission control for LLM calls: bounded concurrency and a fair, bounded wait queue
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from functools import lru_cache
+
+from config import get_settings
+from metrics import Counter, Gauge, Histogram
+
+QUEUE_WAIT_SECONDS = Histogram("llm_queue_wait_seconds", "Time chat requests waited for an LLM slot")
+IN_FLIGHT = Gauge("llm_in_flight", "LLM calls currently running")
+QUEUE_DEPTH = Gauge("llm_queue_depth", "Chat requests waiting for an LLM slot")
+REJECTED = Counter("llm_admission_rejected_total", "Chat requests rejected by admission control", ("reason",))
+
+
+class AdmissionRejected(Exception):
+    """Raised instead of queueing; maps to an HTTP status with a Retry-After hint"""
+    def __init__(self, status_code: int, detail: str, retry_after: int):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    At most `max_in_flight` holders at a time. Others wait in per-user FIFO
+    queues served round-robin, so one user (or anonymous id) flooding the
+    queue only delays their own requests. Rejects immediately when the user
+    already has `max_queue_per_user` waiting (429) or the whole queue holds
+    `max_queue` (503), and gives up after `queue_timeout` seconds (503).
+    """
+    def __init__(self, max_in_flight: int, max_queue: int, max_queue_per_user: int, queue_timeout: float):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.max_queue_per_user = max_queue_per_user
+        self.queue_timeout = queue_timeout
+        self._in_flight = 0
+        self._queued = 0
+        self._queues = OrderedDict()  # user -> deque of waiter futures, in round-robin order
+        # Moving average of how long a slot is held, for Retry-After estimates
+        self._avg_hold = 1.0
+
+    def retry_after(self) -> int:
+        """Seconds until the current queue should have drained"""
+        waves = (self._queued + 1) / max(self.max_in_flight, 1)
+        return max(1, math.ceil(waves * self._avg_hold))
+
+    def _reject(self, status_code: int, reason: str, detail: str):
+        REJECTED.inc(reason=reason)
+        raise AdmissionRejected(status_code, detail, self.retry_after())
+
+    def _update_gauges(self):
+        IN_FLIGHT.set(self._in_flight)
+        QUEUE_DEPTH.set(self._queued)
+
+    async def acquire(self, user: str):
+        if self._in_flight < self.max_in_flight and not self._queued:
+            self._in_flight += 1
+            self._update_gauges()
+            QUEUE_WAIT_SECONDS.observe(0.0)
+            return
+
+        user_queue = self._queues.get(user)
+        if user_queue is not None and len(user_queue) >= self.max_queue_per_user:
+            self._reject(429, "user_queue_full", "Too many pending requests, please wait for the current answer")
+        if self._queued >= self.max_queue:
+            self._reject(503, "queue_full", "The assistant is busy, please retry shortly")
+
+        waiter = asyncio.get_running_loop().create_future()
+        if user_queue is None:
+            user_queue = self._queues[user] = deque()
+        user_queue.append(waiter)
+        self._queued += 1
+        self._update_gauges()
+
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # Granted a slot just as we gave up: hand it to the next waiter
+                self.release()
+            else:
+                self._remove(user, waiter)
+            if isinstance(e, asyncio.TimeoutError):
+                self._reject(503, "queue_timeout", "The assistant is busy, please retry shortly")
+            raise
+        finally:
+            QUEUE_WAIT_SECONDS.observe(time.perf_counter() - start)
+
+    def _remove(self, user: str, waiter):
+        user_queue = self._queues.get(user)
+        if user_queue is None or waiter not in user_queue:
+            return
+        user_queue.remove(waiter)
+        self._queued -= 1
+        if not user_queue:
+            del self._queues[user]
+        self._update_gauges()
+
+    def release(self, held_seconds: float = None):
+        if held_seconds is not None:
+            self._avg_hold = 0.9 * self._avg_hold + 0.1 * held_seconds
+        self._in_flight -= 1
+        while self._in_flight < self.max_in_flight and self._queued:
+            # Next user in round-robin order; they go to the back if they have more waiting
+            user, user_queue = next(iter(self._queues.items()))
+            waiter = user_queue.popleft()
+            self._queued -= 1
+            if user_queue:
+                self._queues.move_to_end(user)
+            else:
+                del self._queues[user]
+            if waiter.done():  # cancelled while queued
+                continue
+            waiter.set_result(None)
+            self._in_flight += 1
+        self._update_gauges()
+
+    @asynccontextmanager
+    async def slot(self, user: str):
+        await self.acquire(user)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(time.perf_counter() - start)
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self._in_flight,
+            "queued": self._queued,
+            "queued_users": len(self._queues),
+            "avg_hold_seconds": self._avg_hold,
+        }
+
+
+@lru_cache()
+def get_admission_controller() -> AdmissionController:
+    settings = get_settings()
+    return AdmissionController(
+        settings.llm_max_in_flight,
+        settings.llm_queue_max,
+        settings.llm_queue_max_per_user,
+        settings.llm_queue_timeout_seconds,
+    )
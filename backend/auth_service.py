@@ -1,12 +1,21 @@
 from datetime import datetime, timedelta
+from functools import lru_cache
+import hashlib
+import logging
+import time
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from pydantic import BaseModel
+from pymongo.errors import DuplicateKeyError
 import uuid
+from cache_services import TTLLRUCache
 from config import get_settings
+from jobs import get_job_queue
+from password_hashing import crypt_context, get_password_hasher
+from session_services import get_async_session_service, get_session_service
 
+logger = logging.getLogger(__name__)
 settings = get_settings()
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = crypt_context(settings.password_bcrypt_rounds)
 
 class UserCreate(BaseModel):
     email: str
@@ -18,9 +27,24 @@ class UserLogin(BaseModel):
     password: str
 
 class AuthService:
-    def __init__(self, session_service, user_collection):
+    """
+    Registration, login and JWTs. The async variants (aregister_user,
+    alogin_user) hash on the PasswordHasher pool and run Mongo calls with
+    `run` (AsyncChatSessionService.run), so they never block the event loop.
+
+    Verified token payloads (keyed by the token's SHA-256) and user profiles
+    are cached briefly, so per-page auth checks skip both the JWT signature
+    check and the users lookup.
+    """
+    def __init__(self, session_service, user_collection, hasher=None, run=None, jobs=None):
         self.session_service = session_service
         self.users = user_collection
+        self.hasher = hasher or get_password_hasher()
+        self.run = run
+        # JobQueue for guest session migration; done inline without one
+        self.jobs = jobs
+        self.token_cache = TTLLRUCache(settings.auth_token_cache_max_entries, settings.auth_token_cache_ttl_seconds)
+        self.profile_cache = TTLLRUCache(settings.user_profile_cache_max_entries, settings.user_profile_cache_ttl_seconds)
     
     def hash_password(self, password: str) -> str:
         return pwd_context.hash(password)
@@ -39,45 +63,111 @@ class AuthService:
         return jwt.encode(payload, settings.jwt_secret_key, algorithm=settings.jwt_algorithm)
     
     def verify_token(self, token: str) -> dict:
+        key = hashlib.sha256(token.encode()).hexdigest()
+        payload = self.token_cache.get(key)
+        if payload is not None:
+            # Cached entries never outlive the token, but check in case the clock moved
+            return payload if payload["exp"] > time.time() else None
         try:
             payload = jwt.decode(token, settings.jwt_secret_key, algorithms=[settings.jwt_algorithm])
-            return payload
         except JWTError:
             return None
+        ttl = min(settings.auth_token_cache_ttl_seconds, payload["exp"] - time.time())
+        if ttl > 0:
+            self.token_cache.set(key, payload, ttl)
+        return payload
     
-    def register_user(self, user_data: UserCreate, anonymous_user_id: str = None) -> dict:
-        # Check if email already exists
-        if self.users.find_one({"email": user_data.email}):
-            raise ValueError("Email already registered")
-        
-        # Create new user
-        user_id = str(uuid.uuid4())
-        user_doc = {
-            "user_id": user_id,
+    def _cache_profile(self, user_doc: dict) -> dict:
+        profile = {"user_id": user_doc["user_id"], "email": user_doc["email"], "name": user_doc["name"]}
+        self.profile_cache.set(user_doc["user_id"], profile)
+        return profile
+    
+    async def aget_user_profile(self, user_id: str) -> dict:
+        """user_id, email and name of a registered user, or None"""
+        profile = self.profile_cache.get(user_id)
+        if profile is None:
+            user = await self.run(
+                self.users.find_one, {"user_id": user_id}, {"_id": 0, "user_id": 1, "email": 1, "name": 1}
+            )
+            if not user:
+                return None
+            profile = self._cache_profile(user)
+        return profile
+    
+    def cache_stats(self) -> dict:
+        return {"tokens": self.token_cache.stats(), "profiles": self.profile_cache.stats()}
+    
+    def _new_user_doc(self, user_data: UserCreate, password_hash: str) -> dict:
+        return {
+            "user_id": str(uuid.uuid4()),
             "email": user_data.email,
             "name": user_data.name,
-            "password_hash": self.hash_password(user_data.password),
+            "password_hash": password_hash,
             "user_type": "registered",
             "created_at": datetime.utcnow(),
             "last_active": datetime.utcnow()
         }
+    
+    def _login_update(self, new_hash: str = None) -> dict:
+        """Last-active bump, plus the upgraded hash when the work factor changed"""
+        fields = {"last_active": datetime.utcnow()}
+        if new_hash:
+            fields["password_hash"] = new_hash
+        return {"$set": fields}
+    
+    def _user_result(self, user_doc: dict) -> dict:
+        return {
+            "user_id": user_doc["user_id"],
+            "email": user_doc["email"],
+            "name": user_doc["name"],
+            "token": self.create_jwt_token(user_doc["user_id"], user_doc["email"]),
+            "user_type": "registered"
+        }
+    
+    def _insert_user(self, user_doc: dict):
+        try:
+            self.users.insert_one(user_doc)
+        except DuplicateKeyError:
+            # Lost a race with a concurrent registration (unique index on email)
+            raise ValueError("Email already registered")
+        self._cache_profile(user_doc)
+    
+    def register_user(self, user_data: UserCreate, anonymous_user_id: str = None) -> dict:
+        # Check if email already exists
+        if self.users.find_one({"email": user_data.email}):
+            raise ValueError("Email already registered")
         
-        self.users.insert_one(user_doc)
+        # Create new user
+        user_doc = self._new_user_doc(user_data, self.hash_password(user_data.password))
+        self._insert_user(user_doc)
         
         # Migrate anonymous sessions if provided
         if anonymous_user_id:
-            self.migrate_anonymous_sessions(anonymous_user_id, user_id)
+            self.migrate_anonymous_sessions(anonymous_user_id, user_doc["user_id"])
         
-        # Create JWT token
-        token = self.create_jwt_token(user_id, user_data.email)
+        return self._user_result(user_doc)
+    
+    async def aregister_user(self, user_data: UserCreate, anonymous_user_id: str = None) -> dict:
+        if await self.run(self.users.find_one, {"email": user_data.email}, {"_id": 1}):
+            raise ValueError("Email already registered")
         
-        return {
-            "user_id": user_id,
-            "email": user_data.email,
-            "name": user_data.name,
-            "token": token,
-            "user_type": "registered"
-        }
+        user_doc = self._new_user_doc(user_data, await self.hasher.hash(user_data.password))
+        await self.run(self._insert_user, user_doc)
+        
+        if anonymous_user_id and self.jobs is not None:
+            # The guest's visible (active) sessions move now, so the first
+            # session list after sign-up already shows them; the job moves
+            # the replaced ones
+            await self.run(self.session_service.reassign_sessions, anonymous_user_id, user_doc["user_id"], True)
+            await self.jobs.enqueue(
+                "migrate_sessions",
+                {"from_user_id": anonymous_user_id, "to_user_id": user_doc["user_id"]},
+                dedupe_key=f"migrate_sessions:{anonymous_user_id}",
+            )
+        elif anonymous_user_id:
+            await self.run(self.migrate_anonymous_sessions, anonymous_user_id, user_doc["user_id"])
+        
+        return self._user_result(user_doc)
     
     def login_user(self, login_data: UserLogin) -> dict:
         # Find user by email
@@ -85,28 +175,35 @@ class AuthService:
         if not user or not self.verify_password(login_data.password, user["password_hash"]):
             raise ValueError("Invalid email or password")
         
-        # Update last active
-        self.users.update_one(
-            {"user_id": user["user_id"]},
-            {"$set": {"last_active": datetime.utcnow()}}
-        )
+        # Update last active (and upgrade the hash if the work factor changed)
+        new_hash = self.hash_password(login_data.password) if pwd_context.needs_update(user["password_hash"]) else None
+        self.users.update_one({"user_id": user["user_id"]}, self._login_update(new_hash))
+        self._cache_profile(user)
         
-        # Create JWT token
-        token = self.create_jwt_token(user["user_id"], user["email"])
+        return self._user_result(user)
+    
+    async def alogin_user(self, login_data: UserLogin) -> dict:
+        user = await self.run(self.users.find_one, {"email": login_data.email})
+        if not user:
+            raise ValueError("Invalid email or password")
+        ok, new_hash = await self.hasher.verify_and_rehash(login_data.password, user["password_hash"])
+        if not ok:
+            raise ValueError("Invalid email or password")
         
-        return {
-            "user_id": user["user_id"],
-            "email": user["email"],
-            "name": user["name"],
-            "token": token,
-            "user_type": "registered"
-        }
+        await self.run(self.users.update_one, {"user_id": user["user_id"]}, self._login_update(new_hash))
+        self._cache_profile(user)
+        
+        return self._user_result(user)
     
     def migrate_anonymous_sessions(self, anonymous_user_id: str, new_user_id: str):
         """Transfer anonymous user's sessions to registered user"""
-        # Update sessions
-        self.session_service.sessions.update_many(
-            {"user_id": anonymous_user_id},
-            {"$set": {"user_id": new_user_id}}
-        )
-        print(f"Migrated sessions from {anonymous_user_id} to {new_user_id}")
\ No newline at end of file
+        # Update sessions (and the cached session lists of both users)
+        self.session_service.reassign_sessions(anonymous_user_id, new_user_id)
+        logger.info(f"Migrated sessions from {anonymous_user_id} to {new_user_id}")
+
+
+@lru_cache()
+def get_auth_service():
+    """Singleton AuthService sharing the session service's Mongo client and pool"""
+    session_service = get_session_service()
+    return AuthService(session_service, session_service.users, run=get_async_session_service().run, jobs=get_job_queue())
@@ -0,0 +1,23 @@
+# benchmarks/app.py
+# The offline benchmark app as an importable ASGI app, so it can be served
+# by several gunicorn workers (see benchmarks/scaling.py). Takes the
+# benchmark's options from BENCH_ARGS. With --mongo-uri the workers share a
+# real mongod; without it each worker has its own mongomock database, so a
+# client must stay on one keep-alive connection (as the benchmark's do):
+#
+#   BENCH_ARGS="--mongo-uri mongodb://localhost:27017" gunicorn -c gunicorn.conf.py benchmarks.app:app
+#   BENCH_ARGS="--corpus-size 300" gunicorn -c gunicorn.conf.py benchmarks.app:app
+import os
+import shlex
+import tempfile
+from pathlib import Path
+
+from benchmarks.run import build_app, build_index, configure_environment, parse_args
+
+args = parse_args(shlex.split(os.environ.get("BENCH_ARGS", "")))
+workdir = Path(os.environ.get("BENCH_WORKDIR") or tempfile.mkdtemp(prefix="bench-"))
+configure_environment(args, workdir)
+# Imported once in the gunicorn master (preload_app): the index is built
+# before the fork, the services by each worker's warm-up
+build_index(args)
+app = build_app(args)
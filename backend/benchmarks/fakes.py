@@ -0,0 +1,124 @@
+# benchmarks/fakes.py
+# Deterministic offline stand-ins for Gemini and Pinecone inference
+import asyncio
+import time
+import zlib
+from typing import Any, AsyncIterator, Iterator, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from text_utils import tokenize
+
+TOPICS = ["account", "password", "card", "transfer", "refund", "statement", "loan", "savings", "fees", "mobile app"]
+ACTIONS = ["create", "close", "reset", "update", "verify", "cancel", "dispute", "link", "download", "activate"]
+
+QUESTIONS = [
+    "How do I create a new account?",
+    "How do I add money to my account?",
+    "How can I reset my password?",
+    "What are the fees for an international transfer?",
+    "How do I dispute a card transaction?",
+    "Where can I download my statement?",
+    "How long does a refund take?",
+    "How do I activate the mobile app?",
+]
+
+
+def build_corpus(size: int) -> List[str]:
+    """Synthetic help-center chunks covering every topic/action pair"""
+    corpus = []
+    for i in range(size):
+        topic = TOPICS[i % len(TOPICS)]
+        action = ACTIONS[(i // len(TOPICS)) % len(ACTIONS)]
+        corpus.append(
+            f"Article {i}: To {action} your {topic}, open Settings, choose {topic.title()} and "
+            f"select {action.title()}. Reference code E-{1000 + i}. If the {topic} cannot be "
+            f"{action}d online, contact support with your customer number."
+        )
+    return corpus
+
+
+class FakeEmbeddings(Embeddings):
+    """
+    Bag-of-words hashing embeddings: every token maps to a fixed random vector,
+    so texts sharing words are similar. `latency` simulates the API round-trip.
+    """
+    def __init__(self, dim: int = 256, latency: float = 0.0):
+        self.dim = dim
+        self.latency = latency
+        self._token_vectors = {}
+
+    def _token_vector(self, token: str) -> np.ndarray:
+        vector = self._token_vectors.get(token)
+        if vector is None:
+            rng = np.random.default_rng(zlib.crc32(token.encode("utf-8")))
+            vector = self._token_vectors[token] = rng.standard_normal(self.dim).astype(np.float32)
+        return vector
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for token in tokenize(text):
+            vector += self._token_vector(token)
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if self.latency:
+            time.sleep(self.latency)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        if self.latency:
+            time.sleep(self.latency)
+        return self._embed(text)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return [self._embed(text) for text in texts]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._embed(text)
+
+
+class FakeChatModel(BaseChatModel):
+    """Chat model answering with `answer_tokens` tokens after configurable delays"""
+    first_token_latency: float = 0.2
+    token_latency: float = 0.01
+    answer_tokens: int = 50
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _tokens(self, messages: List[BaseMessage]) -> List[str]:
+        question = " ".join(tokenize(str(messages[-1].content))[:8])
+        return [f"Answer to {question}:"] + [f" word{i}" for i in range(self.answer_tokens - 1)]
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        time.sleep(self.first_token_latency + self.token_latency * self.answer_tokens)
+        content = "".join(self._tokens(messages))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self.first_token_latency + self.token_latency * self.answer_tokens)
+        content = "".join(self._tokens(messages))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self.first_token_latency)
+        for token in self._tokens(messages):
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+            time.sleep(self.token_latency)
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self.first_token_latency)
+        for token in self._tokens(messages):
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+            await asyncio.sleep(self.token_latency)
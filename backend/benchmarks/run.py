@@ -0,0 +1,325 @@
+# benchmarks/run.py
+# Offline load test: drives the FastAPI app in-process with fake LLM/embeddings,
+# a local vector store and mongomock (or a local mongod), then reports
+# p50/p95/p99 latency and throughput per endpoint.
+#
+#   python -m benchmarks.run --users 50 --turns 3
+#   python -m benchmarks.run --users 200 --stream --mongo-uri mongodb://localhost:27017
+#   python -m benchmarks.run --url http://localhost:8000   # against a running server
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline load test of the chat API")
+    parser.add_argument("--users", type=int, default=50, help="virtual users")
+    parser.add_argument("--concurrency", type=int, default=50, help="users running at the same time")
+    parser.add_argument("--turns", type=int, default=3, help="chat turns per user")
+    parser.add_argument("--stream", action="store_true", help="use the SSE endpoint")
+    parser.add_argument("--registered-ratio", type=float, default=0.2, help="share of users that register/login")
+    parser.add_argument("--unique-prompts", action="store_true", help="make every prompt unique (defeats the semantic cache)")
+    parser.add_argument("--corpus-size", type=int, default=2000, help="synthetic chunks in the local vector store")
+    parser.add_argument("--llm-first-token-ms", type=float, default=300)
+    parser.add_argument("--llm-token-ms", type=float, default=10)
+    parser.add_argument("--llm-tokens", type=int, default=60)
+    parser.add_argument("--embedding-ms", type=float, default=30)
+    parser.add_argument("--mongo-uri", help="use a real mongod instead of mongomock")
+    parser.add_argument("--url", help="benchmark a running server instead of the in-process app")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", type=Path, help="also write the results to this file")
+    return parser.parse_args(argv)
+
+
+def configure_environment(args, workdir: Path):
+    """Settings are read from the environment on first import, so set them up front"""
+    os.environ.setdefault("GOOGLE_API_KEY", "offline")
+    os.environ.setdefault("PINECONE_API_KEY", "offline")
+    os.environ["MONGODB_URI"] = args.mongo_uri or "mongodb://localhost:27017"
+    os.environ["VECTOR_STORE_BACKEND"] = "local"
+    os.environ["LOCAL_INDEX_PATH"] = str(workdir / "local_index")
+    os.environ["CACHE_BACKEND"] = "memory"
+
+
+def build_index(args):
+    """Local vector store over a synthetic corpus, at LOCAL_INDEX_PATH"""
+    from benchmarks.fakes import FakeEmbeddings, build_corpus
+    from local_vector_store import LocalVectorStore
+
+    corpus = build_corpus(args.corpus_size)
+    store = LocalVectorStore(os.environ["LOCAL_INDEX_PATH"], embedding=FakeEmbeddings())
+    store.add_texts(corpus, ids=[f"chunk_{i}" for i in range(len(corpus))])
+
+
+def build_app(args):
+    """
+    Import the app and swap its service factories for offline ones. The
+    services are built by the app's warm-up, so under gunicorn each worker
+    builds its own after the fork.
+    """
+    from benchmarks.fakes import FakeChatModel, FakeEmbeddings
+    from prompts import RETRIEVAL_QA_CHAT_PROMPT
+    from rag_services import RAGService
+    from auth_service import AuthService
+    from session_services import AsyncChatSessionService, ChatSessionService
+    from jobs import JobQueue, register_session_jobs
+    import main
+
+    settings = main.settings
+
+    # lru_cache keeps cache_info(), which the metrics collectors rely on
+    @lru_cache()
+    def get_session_service():
+        if args.mongo_uri:
+            return ChatSessionService()  # MONGODB_URI and pool sizes from settings
+        import mongomock
+        return ChatSessionService(client=mongomock.MongoClient())
+
+    @lru_cache()
+    def get_async_session_service():
+        return AsyncChatSessionService(
+            get_session_service(),
+            settings.mongo_executor_workers,
+            write_behind=settings.message_write_behind_enabled,
+            flush_interval=settings.message_write_behind_interval_ms / 1000,
+            max_batch=settings.message_write_behind_max_batch,
+            max_pending=settings.message_write_behind_max_pending,
+        )
+
+    @lru_cache()
+    def get_job_queue():
+        session_service = get_session_service()
+        queue = JobQueue(session_service.db.jobs, get_async_session_service().run,
+                         workers=settings.jobs_workers, poll_interval=settings.jobs_poll_seconds)
+        register_session_jobs(queue, session_service)
+        return queue
+
+    @lru_cache()
+    def get_auth_service():
+        session_service = get_session_service()
+        return AuthService(session_service, session_service.users, run=get_async_session_service().run,
+                           jobs=get_job_queue())
+
+    @lru_cache()
+    def get_rag_service():
+        llm = FakeChatModel(
+            first_token_latency=args.llm_first_token_ms / 1000,
+            token_latency=args.llm_token_ms / 1000,
+            answer_tokens=args.llm_tokens,
+        )
+        embeddings = FakeEmbeddings(latency=args.embedding_ms / 1000)
+        return RAGService(llm=llm, embeddings=embeddings, prompt=RETRIEVAL_QA_CHAT_PROMPT)
+
+    main.get_session_service = get_session_service
+    main.get_async_session_service = get_async_session_service
+    main.get_job_queue = get_job_queue
+    main.get_auth_service = get_auth_service
+    main.get_rag_service = get_rag_service
+    return main.app
+
+
+def reset_database(mongo_uri: str):
+    from pymongo import MongoClient
+    client = MongoClient(mongo_uri)
+    client.drop_database("chatbot_db")
+    client.close()
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+
+    def add(self, name: str, seconds: float, ok: bool = True):
+        self.latencies.setdefault(name, []).append(seconds)
+        if not ok:
+            self.errors[name] = self.errors.get(name, 0) + 1
+
+    async def timed(self, name: str, request):
+        start = time.perf_counter()
+        try:
+            response = await request
+        except Exception:
+            self.add(name, time.perf_counter() - start, ok=False)
+            raise
+        self.add(name, time.perf_counter() - start, ok=response.status_code < 400)
+        return response
+
+    def report(self, wall_seconds: float) -> dict:
+        results = {}
+        for name, samples in sorted(self.latencies.items()):
+            values = np.asarray(samples) * 1000
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            results[name] = {
+                "count": len(values),
+                "errors": self.errors.get(name, 0),
+                "p50_ms": round(float(p50), 1),
+                "p95_ms": round(float(p95), 1),
+                "p99_ms": round(float(p99), 1),
+                "max_ms": round(float(values.max()), 1),
+                "throughput_rps": round(len(values) / wall_seconds, 2),
+            }
+        return results
+
+
+async def chat_turn(client, recorder: Recorder, session_id: str, prompt: str, stream: bool, first_token: bool):
+    payload = {"prompt": prompt, "session_id": session_id}
+    if not stream:
+        await recorder.timed("POST /api/chat/prompt", client.post("/api/chat/prompt", json=payload))
+        return
+
+    start = time.perf_counter()
+    first_token_seconds = None
+    ok = False
+    async with client.stream("POST", "/api/chat/prompt/stream", json=payload) as response:
+        async for line in response.aiter_lines():
+            if first_token_seconds is None and line.startswith("data:"):
+                first_token_seconds = time.perf_counter() - start
+            if line.startswith("event: done"):
+                ok = True
+            elif line.startswith("event: error"):
+                break
+        ok = ok and response.status_code < 400
+    recorder.add("POST /api/chat/prompt/stream", time.perf_counter() - start, ok)
+    if first_token and first_token_seconds is not None:
+        recorder.add("POST /api/chat/prompt/stream (first token)", first_token_seconds, ok)
+
+
+async def virtual_user(client, recorder: Recorder, args, index: int, rng: random.Random):
+    from benchmarks.fakes import QUESTIONS
+
+    registered = rng.random() < args.registered_ratio
+    user_id = f"anon_{uuid.uuid4().hex}"
+    credentials = None
+    if registered:
+        credentials = {"email": f"user{index}-{uuid.uuid4().hex[:8]}@bench.local", "password": "bench-password", "name": f"User {index}"}
+        response = await recorder.timed(
+            "POST /api/auth/register",
+            client.post("/api/auth/register", json=credentials, params={"anonymous_user_id": user_id}),
+        )
+        if response.status_code < 400:
+            user_id = response.json()["user_id"]
+            await recorder.timed("GET /api/auth/me", client.get("/api/auth/me"))
+
+    response = await recorder.timed("POST /api/sessions", client.post("/api/sessions", json={"user_id": user_id}))
+    session_id = response.json()["session_id"]
+
+    for turn in range(args.turns):
+        prompt = rng.choice(QUESTIONS)
+        if args.unique_prompts:
+            prompt = f"{prompt} (ref {index}-{turn})"
+        # httpx's in-process transport buffers the whole body, so time to
+        # first token is only measured against a real server (--url)
+        await chat_turn(client, recorder, session_id, prompt, args.stream, first_token=bool(args.url))
+        await recorder.timed(
+            "GET /api/chat/messages/{session_id}", client.get(f"/api/chat/messages/{session_id}")
+        )
+
+    await recorder.timed("GET /api/users/{user_id}/sessions", client.get(f"/api/users/{user_id}/sessions"))
+    if credentials:
+        login = {"email": credentials["email"], "password": credentials["password"]}
+        await recorder.timed("POST /api/auth/login", client.post("/api/auth/login", json=login))
+
+
+async def monitor_loop_lag(samples: list, interval: float = 0.01):
+    """How late the event loop wakes a sleeping task; high values mean blocking calls"""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(time.perf_counter() - start - interval)
+
+
+async def run(args, app=None) -> dict:
+    import httpx
+
+    if app is not None:
+        await app.router.startup()
+        transport = httpx.ASGITransport(app=app)
+        base_url = "http://bench"
+    else:
+        transport = None
+        base_url = args.url
+
+    recorder = Recorder()
+    lag_samples = []
+    rng = random.Random(args.seed)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+
+    async def user(index: int):
+        # One client per user so auth cookies stay separate
+        async with semaphore:
+            async with httpx.AsyncClient(transport=transport, base_url=base_url, timeout=120, limits=limits) as client:
+                try:
+                    await virtual_user(client, recorder, args, index, random.Random(rng.random()))
+                except Exception as e:
+                    recorder.add("user flow aborted", 0.0, ok=False)
+                    print(f"user {index}: {e!r}", file=sys.stderr)
+
+    monitor = asyncio.create_task(monitor_loop_lag(lag_samples)) if app is not None else None
+    start = time.perf_counter()
+    await asyncio.gather(*(user(i) for i in range(args.users)))
+    wall_seconds = time.perf_counter() - start
+    if monitor:
+        monitor.cancel()
+        await app.router.shutdown()
+
+    results = {"wall_seconds": round(wall_seconds, 2), "endpoints": recorder.report(wall_seconds)}
+    if lag_samples:
+        lag = np.asarray(lag_samples) * 1000
+        results["event_loop_lag_ms"] = {
+            "p50": round(float(np.percentile(lag, 50)), 2),
+            "p99": round(float(np.percentile(lag, 99)), 2),
+            "max": round(float(lag.max()), 2),
+        }
+    return results
+
+
+def print_results(args, results: dict):
+    mode = "stream" if args.stream else "blocking"
+    print(f"\n{args.users} users x {args.turns} turns ({mode}), concurrency {args.concurrency}, "
+          f"{results['wall_seconds']}s wall time")
+    header = f"{'endpoint':48} {'count':>6} {'err':>4} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9} {'req/s':>8}"
+    print(header)
+    print("-" * len(header))
+    for name, row in results["endpoints"].items():
+        print(f"{name:48} {row['count']:6d} {row['errors']:4d} {row['p50_ms']:9.1f} {row['p95_ms']:9.1f} "
+              f"{row['p99_ms']:9.1f} {row['max_ms']:9.1f} {row['throughput_rps']:8.2f}")
+    lag = results.get("event_loop_lag_ms")
+    if lag:
+        print(f"\nevent loop lag: p50 {lag['p50']} ms, p99 {lag['p99']} ms, max {lag['max']} ms")
+
+
+def main():
+    args = parse_args()
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    app = None
+    with tempfile.TemporaryDirectory() as workdir:
+        if not args.url:
+            configure_environment(args, Path(workdir))
+            if args.mongo_uri:
+                reset_database(args.mongo_uri)
+            build_index(args)
+            app = build_app(args)
+        results = asyncio.run(run(args, app))
+    print_results(args, results)
+    if args.json:
+        args.json.write_text(json.dumps({"args": {k: str(v) for k, v in vars(args).items()}, **results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
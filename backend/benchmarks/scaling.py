@@ -0,0 +1,104 @@
+# benchmarks/scaling.py
+# Throughput vs. worker count: serves benchmarks.app with gunicorn at each
+# --workers value and runs the same load against it (needs gunicorn; pass a
+# shared mongod with --mongo-uri for realistic numbers). Other options are
+# passed to both the server and the load generator.
+#
+#   python -m benchmarks.scaling --workers 1 2 4 8 -- --mongo-uri mongodb://localhost:27017 --users 400 --turns 3
+import argparse
+import asyncio
+import os
+import shlex
+import subprocess
+import sys
+import time
+
+import httpx
+
+from benchmarks.run import BACKEND_DIR, parse_args, reset_database, run
+
+
+def parse_scaling_args():
+    parser = argparse.ArgumentParser(description="Throughput scaling across gunicorn worker counts")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--ready-timeout", type=float, default=120, help="seconds to wait for all workers")
+    parser.add_argument("bench_args", nargs=argparse.REMAINDER, help="benchmark options, after --")
+    args = parser.parse_args()
+    bench_args = [arg for arg in args.bench_args if arg != "--"]
+    return args, bench_args
+
+
+def wait_until_ready(url: str, workers: int, timeout: float):
+    """Until enough consecutive /health/ready answers are 200 that every worker likely warmed up"""
+    deadline = time.monotonic() + timeout
+    streak = 0
+    while streak < 4 * workers:
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Server at {url} not ready after {timeout}s")
+        try:
+            # A new connection each time, so the requests spread over the workers
+            ok = httpx.get(f"{url}/health/ready", timeout=5).status_code == 200
+        except httpx.HTTPError:
+            ok = False
+        streak = streak + 1 if ok else 0
+        if not ok:
+            time.sleep(0.5)
+
+
+def serve(workers: int, port: int, bench_args: list, mongo_uri: str) -> subprocess.Popen:
+    env = {
+        "GOOGLE_API_KEY": "offline",
+        "PINECONE_API_KEY": "offline",
+        **os.environ,
+        "MONGODB_URI": mongo_uri or "mongodb://localhost:27017",
+        "BENCH_ARGS": shlex.join(bench_args),
+        # Per-worker session caches would need a replica set for invalidation
+        "SESSION_CACHE_ENABLED": "false",
+        # Workers accept connections only once their services are built
+        "STARTUP_MODE": "eager",
+    }
+    return subprocess.Popen(
+        ["gunicorn", "-c", "gunicorn.conf.py", "--workers", str(workers),
+         "--bind", f"127.0.0.1:{port}", "benchmarks.app:app"],
+        cwd=BACKEND_DIR,
+        env=env,
+    )
+
+
+def main():
+    args, bench_args = parse_scaling_args()
+    bench = parse_args(bench_args)
+    if not bench.mongo_uri:
+        # Each virtual user keeps one keep-alive connection, so it stays on one
+        # worker; Mongo contention across workers is not part of the picture
+        print("No --mongo-uri: every worker gets its own mongomock database", file=sys.stderr)
+    url = f"http://127.0.0.1:{args.port}"
+    bench.url = url
+
+    rows = []
+    for workers in args.workers:
+        if bench.mongo_uri:
+            reset_database(bench.mongo_uri)
+        server = serve(workers, args.port, bench_args, bench.mongo_uri)
+        try:
+            wait_until_ready(url, workers, args.ready_timeout)
+            results = asyncio.run(run(bench))
+        finally:
+            server.terminate()
+            server.wait()
+        endpoints = results["endpoints"]
+        requests = sum(row["count"] for row in endpoints.values())
+        errors = sum(row["errors"] for row in endpoints.values())
+        chat = endpoints.get("POST /api/chat/prompt/stream" if bench.stream else "POST /api/chat/prompt", {})
+        rows.append((workers, requests / results["wall_seconds"], errors, chat.get("p50_ms"), chat.get("p95_ms")))
+
+    base = rows[0][1] / rows[0][0]
+    print(f"\n{'workers':>7} {'req/s':>9} {'speedup':>8} {'per worker':>10} {'errors':>6} {'chat p50 ms':>11} {'chat p95 ms':>11}")
+    for workers, rps, errors, p50, p95 in rows:
+        print(f"{workers:7d} {rps:9.1f} {rps / rows[0][1]:7.2f}x {rps / workers / base:9.0%} {errors:6d} "
+              f"{p50 or 0:11.1f} {p95 or 0:11.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+# bm25_index.py
+# Local BM25 inverted index and the hybrid (BM25 + vector) retriever
+import argparse
+import asyncio
+import json
+from collections import Counter
+from pathlib import Path
+from typing import Any, List, Tuple
+
+import numpy as np
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from text_utils import tokenize
+
+POSTINGS_FILE = "bm25_postings.npz"
+VOCAB_FILE = "bm25_vocab.json"
+DOCS_FILE = "docs.jsonl"
+
+
+class BM25Index:
+    """
+    Compact BM25 index: the vocabulary maps each term to a slice of two flat
+    postings arrays (doc rows and term frequencies), so scoring a query is a
+    few vectorized scatter-adds, one per query term.
+    """
+    def __init__(self, vocab: dict, offsets: np.ndarray, doc_rows: np.ndarray, term_freqs: np.ndarray,
+                 doc_lengths: np.ndarray, texts: List[str], metadatas: List[dict], ids: List[str],
+                 k1: float = 1.2, b: float = 0.75):
+        self.vocab = vocab
+        self.offsets = offsets
+        self.doc_rows = doc_rows
+        self.term_freqs = term_freqs
+        self.doc_lengths = doc_lengths
+        self.texts = texts
+        self.metadatas = metadatas
+        self.ids = ids
+        self.k1 = k1
+        self.b = b
+
+        count = len(doc_lengths)
+        avg_length = doc_lengths.mean() if count else 1.0
+        # Per-document part of the BM25 denominator, computed once
+        self._length_norm = (k1 * (1 - b + b * doc_lengths / avg_length)).astype(np.float32)
+        doc_freqs = np.diff(offsets)
+        self._idf = np.log(1 + (count - doc_freqs + 0.5) / (doc_freqs + 0.5)).astype(np.float32)
+
+    @property
+    def count(self) -> int:
+        return len(self.doc_lengths)
+
+    @classmethod
+    def build(cls, texts: List[str], metadatas: List[dict] = None, ids: List[str] = None, **kwargs) -> "BM25Index":
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [f"doc_{i}" for i in range(len(texts))]
+        postings = {}
+        doc_lengths = np.zeros(len(texts), dtype=np.float32)
+        for row, text in enumerate(texts):
+            tokens = tokenize(text)
+            doc_lengths[row] = len(tokens)
+            for term, freq in Counter(tokens).items():
+                postings.setdefault(term, []).append((row, freq))
+
+        vocab = {}
+        offsets = [0]
+        doc_rows, term_freqs = [], []
+        for term_id, (term, entries) in enumerate(postings.items()):
+            vocab[term] = term_id
+            doc_rows.extend(row for row, _ in entries)
+            term_freqs.extend(freq for _, freq in entries)
+            offsets.append(len(doc_rows))
+        return cls(
+            vocab,
+            np.asarray(offsets, dtype=np.int64),
+            np.asarray(doc_rows, dtype=np.int32),
+            np.asarray(term_freqs, dtype=np.float32),
+            doc_lengths, list(texts), list(metadatas), list(ids),
+            **kwargs,
+        )
+
+    def save(self, path: str):
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        np.savez(path / POSTINGS_FILE, offsets=self.offsets, doc_rows=self.doc_rows,
+                 term_freqs=self.term_freqs, doc_lengths=self.doc_lengths)
+        (path / VOCAB_FILE).write_text(json.dumps(self.vocab))
+        with open(path / DOCS_FILE, "w", encoding="utf-8") as f:
+            for doc_id, text, metadata in zip(self.ids, self.texts, self.metadatas):
+                f.write(json.dumps({"id": doc_id, "text": text, "metadata": metadata}) + "\n")
+
+    @classmethod
+    def load(cls, path: str, **kwargs) -> "BM25Index":
+        path = Path(path)
+        arrays = np.load(path / POSTINGS_FILE)
+        vocab = json.loads((path / VOCAB_FILE).read_text())
+        texts, metadatas, ids = read_docs(path / DOCS_FILE)
+        return cls(vocab, arrays["offsets"], arrays["doc_rows"], arrays["term_freqs"],
+                   arrays["doc_lengths"], texts, metadatas, ids, **kwargs)
+
+    def search(self, query: str, k: int = 10) -> List[Tuple[int, float]]:
+        """Top-k (row, score) pairs, best first; documents sharing no term are skipped"""
+        scores = np.zeros(self.count, dtype=np.float32)
+        for term in set(tokenize(query)):
+            term_id = self.vocab.get(term)
+            if term_id is None:
+                continue
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            rows = self.doc_rows[start:end]
+            freqs = self.term_freqs[start:end]
+            scores[rows] += self._idf[term_id] * freqs * (self.k1 + 1) / (freqs + self._length_norm[rows])
+
+        matched = np.flatnonzero(scores)
+        if not len(matched):
+            return []
+        k = min(k, len(matched))
+        top = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        top = top[np.argsort(-scores[top])]
+        return [(int(row), float(scores[row])) for row in top]
+
+    def search_documents(self, query: str, k: int = 10) -> List[Document]:
+        return [
+            Document(id=self.ids[row], page_content=self.texts[row], metadata=dict(self.metadatas[row]))
+            for row, _ in self.search(query, k)
+        ]
+
+
+def read_docs(path) -> Tuple[List[str], List[dict], List[str]]:
+    """Read a docs.jsonl file as written by LocalVectorStore / BM25Index"""
+    texts, metadatas, ids = [], [], []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            row = json.loads(line)
+            ids.append(row["id"])
+            texts.append(row["text"])
+            metadatas.append(row["metadata"])
+    return texts, metadatas, ids
+
+
+def reciprocal_rank_fusion(rankings: List[List[Document]], k: int, rrf_k: int = 60) -> List[Document]:
+    """Merge ranked lists by summing 1 / (rrf_k + rank); documents are matched by id, else text"""
+    scores = {}
+    docs = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking):
+            key = doc.id or doc.page_content
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank + 1)
+            docs.setdefault(key, doc)
+    best = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [docs[key] for key in best]
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Runs the vector retriever and the BM25 index concurrently and fuses
+    both rankings with reciprocal-rank fusion.
+    """
+    vector_retriever: BaseRetriever
+    bm25: Any
+    k: int = 4
+    candidates_k: int = 10
+    rrf_k: int = 60
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        vector_docs = self.vector_retriever.invoke(query, config={"callbacks": run_manager.get_child()})
+        lexical_docs = self.bm25.search_documents(query, self.candidates_k)
+        return reciprocal_rank_fusion([vector_docs, lexical_docs], self.k, self.rrf_k)
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        vector_docs, lexical_docs = await asyncio.gather(
+            self.vector_retriever.ainvoke(query, config={"callbacks": run_manager.get_child()}),
+            asyncio.to_thread(self.bm25.search_documents, query, self.candidates_k),
+        )
+        return reciprocal_rank_fusion([vector_docs, lexical_docs], self.k, self.rrf_k)
+
+
+def main():
+    from config import get_settings
+    settings = get_settings()
+
+    parser = argparse.ArgumentParser(description="Manage the local BM25 index")
+    parser.add_argument("--path", default=settings.bm25_index_path)
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="Index the chunk texts of the local vector store")
+    build.add_argument("--source", default=settings.local_index_path,
+                       help="directory holding docs.jsonl (local index or Pinecone snapshot)")
+    search = commands.add_parser("search", help="Run a keyword query")
+    search.add_argument("query")
+    search.add_argument("--k", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        texts, metadatas, ids = read_docs(Path(args.source) / DOCS_FILE)
+        index = BM25Index.build(texts, metadatas, ids)
+        index.save(args.path)
+        print(f"Indexed {index.count} chunks ({len(index.vocab)} terms) into {args.path}")
+    elif args.command == "search":
+        index = BM25Index.load(args.path)
+        for row, score in index.search(args.query, args.k):
+            print(f"{score:8.3f}  {index.ids[row]}  {index.texts[row][:100]!r}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,335 @@
+# cache_services.py
+# In-process caches used by the RAG pipeline
+import asyncio
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, List, Optional
+
+import numpy as np
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+
+from metrics import stage_timer
+
+
+class SemanticCache:
+    """
+    Answer cache keyed by query meaning rather than exact text.
+
+    Query embeddings live in a preallocated, L2-normalized float32 matrix so a
+    lookup is a single matrix-vector product. Each entry also carries the
+    history_key of the chat history it was answered with, and only entries
+    with the same key match. Entries expire after `ttl_seconds` and the least
+    recently used one is evicted once `max_entries` is reached.
+    """
+    def __init__(self, max_entries: int, ttl_seconds: float, threshold: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.threshold = threshold
+        self.hits = 0
+        self.misses = 0
+
+        self._matrix = None  # allocated on first store, once the dimension is known
+        self._valid = np.zeros(max_entries, dtype=bool)
+        self._expires = np.zeros(max_entries)  # monotonic expiry per slot
+        self._histories = np.zeros(max_entries, dtype=np.int64)  # history_key per slot
+        self._entries = OrderedDict()  # slot -> entry dict, oldest first
+        self._free = list(range(max_entries - 1, -1, -1))
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _evict(self, slot: int):
+        del self._entries[slot]
+        self._valid[slot] = False
+        self._free.append(slot)
+
+    def lookup(self, embedding, history: Optional[int] = 0) -> Optional[dict]:
+        """
+        Return the cached response of the most similar fresh query asked with
+        the same history_key, if any; history=None matches any history
+        """
+        query = self._normalize(embedding)
+        with self._lock:
+            # Sweep expired entries first, so a stale best match can't hide a fresh one
+            for slot in np.flatnonzero(self._valid & (self._expires < time.monotonic())):
+                self._evict(int(slot))
+            if not self._entries:
+                self.misses += 1
+                return None
+
+            candidates = self._valid if history is None else self._valid & (self._histories == history)
+            scores = np.where(candidates, self._matrix @ query, -np.inf)
+            slot = int(np.argmax(scores))
+            if not candidates[slot] or scores[slot] < self.threshold:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(slot)
+            self.hits += 1
+            return self._entries[slot]["response"]
+
+    def store(self, embedding, query: str, response: dict, history: int = 0):
+        vector = self._normalize(embedding)
+        with self._lock:
+            if self._matrix is None:
+                self._matrix = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+            if not self._free:
+                self._evict(next(iter(self._entries)))
+
+            slot = self._free.pop()
+            self._matrix[slot] = vector
+            self._valid[slot] = True
+            self._expires[slot] = time.monotonic() + self.ttl_seconds
+            self._histories[slot] = history
+            self._entries[slot] = {"query": query, "response": response}
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._entries),
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+def history_key(messages: list) -> int:
+    """
+    Fingerprint of a chat history (LangChain messages, summary included) for
+    SemanticCache; 0 for an empty history
+    """
+    if not messages:
+        return 0
+    digest = hashlib.blake2b(digest_size=8)
+    for message in messages:
+        digest.update(f"{message.type}\0{message.content}\0".encode("utf-8"))
+    return int.from_bytes(digest.digest(), "big", signed=True)
+
+
+def normalize_text(text: str) -> str:
+    """Cache key normalization: trim, collapse whitespace, casefold"""
+    return " ".join(text.split()).casefold()
+
+
+class TTLLRUCache:
+    """
+    Thread-safe LRU cache with per-entry expiry.
+    Bounded by entry count and, when `sizeof` is given, by approximate bytes.
+    """
+    def __init__(self, max_entries: int, ttl_seconds: float, max_bytes: int = None, sizeof=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.hits = 0
+        self.misses = 0
+        self.bytes = 0
+        self._data = OrderedDict()  # key -> (value, expires_at, size)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            value, expires_at, size = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.bytes -= size
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl_seconds: float = None):
+        size = self.sizeof(value) if self.sizeof else 0
+        expires_at = time.monotonic() + (ttl_seconds if ttl_seconds is not None else self.ttl_seconds)
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.bytes -= old[2]
+            self._data[key] = (value, expires_at, size)
+            self.bytes += size
+            while self._data and (
+                len(self._data) > self.max_entries
+                or (self.max_bytes and self.bytes > self.max_bytes)
+            ):
+                _, (_, _, evicted_size) = self._data.popitem(last=False)
+                self.bytes -= evicted_size
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, None)
+            if item is None:
+                return default
+            self.bytes -= item[2]
+            return item[0]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._data),
+            "bytes": self.bytes,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+class MongoCacheStore:
+    """
+    Shared second-level cache in a Mongo collection so every uvicorn worker
+    benefits from what the others computed. Expiry uses a TTL index.
+    """
+    def __init__(self, collection):
+        self.collection = collection
+        self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    @staticmethod
+    def _id(key: str) -> str:
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        doc = self.collection.find_one({"_id": self._id(key)})
+        if doc is None or doc["expires_at"] < datetime.utcnow():
+            return None
+        return doc["value"]
+
+    def set(self, key: str, value, ttl_seconds: float):
+        self.collection.replace_one(
+            {"_id": self._id(key)},
+            {"value": value, "expires_at": datetime.utcnow() + timedelta(seconds=ttl_seconds)},
+            upsert=True,
+        )
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Query embedding cache: exact match on normalized text, in memory first,
+    then the optional shared Mongo store, then the wrapped embeddings.
+    """
+    def __init__(self, embeddings: Embeddings, cache: TTLLRUCache, namespace: str, store: MongoCacheStore = None):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.namespace = namespace
+        self.store = store
+
+    def _key(self, text: str) -> str:
+        return f"emb:{self.namespace}:{normalize_text(text)}"
+
+    def _remember(self, key: str, vector: list):
+        self.cache.set(key, np.asarray(vector, dtype=np.float32))
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self.embeddings.aembed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        key = self._key(text)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached.tolist()
+        vector = self.store.get(key) if self.store else None
+        if vector is None:
+            with stage_timer("embedding"):
+                vector = self.embeddings.embed_query(text)
+            if self.store:
+                self.store.set(key, vector, self.cache.ttl_seconds)
+        self._remember(key, vector)
+        return vector
+
+    async def aembed_query(self, text: str) -> List[float]:
+        key = self._key(text)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached.tolist()
+        vector = await asyncio.to_thread(self.store.get, key) if self.store else None
+        if vector is None:
+            with stage_timer("embedding"):
+                vector = await self.embeddings.aembed_query(text)
+            if self.store:
+                await asyncio.to_thread(self.store.set, key, vector, self.cache.ttl_seconds)
+        self._remember(key, vector)
+        return vector
+
+
+class CachedRetriever(BaseRetriever):
+    """
+    Retrieved-documents cache keyed by normalized query, k and index version,
+    so bumping the index version invalidates every cached result.
+    """
+    retriever: BaseRetriever
+    cache: Any
+    store: Any = None
+    k: int
+    index_version: str
+
+    def _key(self, query: str) -> str:
+        return f"docs:{self.index_version}:{self.k}:{normalize_text(query)}"
+
+    @staticmethod
+    def _dump(docs: List[Document]) -> list:
+        return [{"page_content": doc.page_content, "metadata": doc.metadata} for doc in docs]
+
+    @staticmethod
+    def _load(data: list) -> List[Document]:
+        return [Document(page_content=d["page_content"], metadata=d["metadata"]) for d in data]
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        key = self._key(query)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return list(cached)
+        data = self.store.get(key) if self.store else None
+        if data is not None:
+            docs = self._load(data)
+        else:
+            with stage_timer("vector_search"):
+                docs = self.retriever.invoke(query, config={"callbacks": run_manager.get_child()})
+            if self.store:
+                self.store.set(key, self._dump(docs), self.cache.ttl_seconds)
+        self.cache.set(key, docs)
+        return list(docs)
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        key = self._key(query)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return list(cached)
+        data = await asyncio.to_thread(self.store.get, key) if self.store else None
+        if data is not None:
+            docs = self._load(data)
+        else:
+            with stage_timer("vector_search"):
+                docs = await self.retriever.ainvoke(query, config={"callbacks": run_manager.get_child()})
+            if self.store:
+                await asyncio.to_thread(self.store.set, key, self._dump(docs), self.cache.ttl_seconds)
+        self.cache.set(key, docs)
+        return list(docs)
+
+
+def documents_size(docs: List[Document]) -> int:
+    """Approximate memory footprint of a list of documents"""
+    return sum(len(doc.page_content) + 64 * len(doc.metadata) + 100 for doc in docs)
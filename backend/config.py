@@ -14,11 +14,171 @@ class Settings(BaseSettings):
     pinecone_environment: str = "us-east-1-aws"
     pinecone_index_name: str = "ai-powered-chatbot-challenge"
     embedding_model: str = "llama-text-embed-v2"
+    # "pinecone" or "local" (NumPy index on disk, see local_vector_store.py)
+    vector_store_backend: str = "pinecone"
+    local_index_path: str = "data/local_index"
+    # Local index search: "flat" (exact) or "ivf" (approximate, build with
+    # `python local_vector_store.py build-ivf`); ivf_nprobe trades recall for speed
+    local_index_type: str = "flat"
+    ivf_nlist: int = 0
+    ivf_nprobe: int = 8
+    # "vector" or "hybrid" (vector + local BM25 fused with reciprocal-rank
+    # fusion; build with `python bm25_index.py build`)
+    retriever_mode: str = "vector"
+    bm25_index_path: str = "data/bm25_index"
+    hybrid_candidates_k: int = 10
+    rrf_k: int = 60
+    ingest_checkpoint_path: str = "data/ingest_checkpoint.json"
+
+    # Context packing: fetch context_fetch_k chunks, drop near-duplicates,
+    # rerank locally and keep up to retriever_k that fit the token budget
+    context_packing_enabled: bool = True
+    context_fetch_k: int = 8
+    context_token_budget: int = 1500
+    context_dedupe_threshold: float = 0.8
+
+    # Chat prompt: "local" (vendored copy in prompts.py, no network) or "hub"
+    # (pulled from the LangChain hub at startup)
+    prompt_source: str = "local"
+    # "eager" builds clients before serving (old behaviour), "background"
+    # starts serving and warms up in a task, "lazy" waits for the first
+    # request; /health/ready reports 503 until the services are built
+    startup_mode: str = "background"
+
+    # Prometheus metrics at /metrics and Server-Timing headers on chat responses
+    metrics_enabled: bool = True
     llm_model: str = "gemini-1.5-flash"
     llm_temperature: float = 0.7
     jwt_secret_key: str = "your-super-secret-jwt-key-change-in-production"
     jwt_algorithm: str = "HS256"
     jwt_expiration_hours: int = 24 * 7  # 7 days
+    # Verified JWT payloads and user profiles cached per worker for auth checks
+    auth_token_cache_ttl_seconds: float = 60
+    auth_token_cache_max_entries: int = 10000
+    user_profile_cache_ttl_seconds: float = 300
+    user_profile_cache_max_entries: int = 10000
+
+    # bcrypt runs on its own pool ("thread" or "process") of
+    # password_hash_workers, with up to password_hash_max_queue waiting
+    # (then 503). "thread" needs the bcrypt package (releases the GIL) and
+    # falls back to processes without it. Raising the work factor upgrades
+    # hashes on next login
+    password_bcrypt_rounds: int = 12
+    password_hash_workers: int = 2
+    password_hash_max_queue: int = 32
+    password_hash_executor: str = "thread"
+
+    # Max threads used to run blocking pymongo calls off the event loop
+    mongo_executor_workers: int = 16
+    # Connection pool per worker process: keep max >= mongo_executor_workers
+    # plus a few for background threads; the server sees web_workers times this
+    mongo_max_pool_size: int = 32
+    mongo_min_pool_size: int = 0
+
+    # Multi-worker mode (gunicorn -c gunicorn.conf.py main:app): number of
+    # worker processes, 0 for one per CPU core. Per-process state (admission
+    # limits, caches, write-behind buffers) is per worker
+    web_workers: int = 0
+
+    # Message layout: "document" (one per message) or "bucket" (up to
+    # message_bucket_size messages per document; migrate existing data with
+    # `python message_stores.py migrate` before switching)
+    message_storage: str = "document"
+    message_bucket_size: int = 50
+
+    # Write-behind for chat messages: turns are acknowledged once buffered and
+    # written in batches every interval. Drained on shutdown; a crash can lose
+    # at most one interval (or max_pending messages) of this worker's writes
+    message_write_behind_enabled: bool = False
+    message_write_behind_interval_ms: float = 50
+    message_write_behind_max_batch: int = 500
+    message_write_behind_max_pending: int = 5000
+
+    # In-process LRU cache of recent histories (session_cache_history_size
+    # newest messages), summaries and first pages of session lists, updated
+    # by this worker's writes. With several workers, set
+    # session_cache_invalidation="mongo" (change stream; needs a replica set),
+    # otherwise gunicorn.conf.py turns the cache off; "local" is an
+    # in-process bus for tests
+    session_cache_enabled: bool = True
+    session_cache_max_sessions: int = 10000
+    session_cache_max_users: int = 10000
+    session_cache_history_size: int = 50
+    session_cache_ttl_seconds: float = 300
+    session_cache_invalidation: str = "none"
+
+    # Background jobs (jobs.py): session purges and guest-to-account
+    # migrations run on jobs_workers tasks per process, persisted in the
+    # jobs collection and retried with backoff up to jobs_max_attempts
+    jobs_workers: int = 2
+    jobs_max_attempts: int = 5
+    jobs_retry_base_delay: float = 1
+    jobs_poll_seconds: float = 2
+    jobs_lease_seconds: float = 60
+    jobs_retention_days: float = 7
+    purge_batch_size: int = 1000
+
+    # Chat history sent to the LLM: most recent N messages, trimmed to a token budget
+    history_max_messages: int = 20
+    history_token_budget: int = 2000
+
+    # Rolling summary of older turns: once more than history_max_messages are
+    # unsummarized, everything but the newest summary_keep_recent_messages is
+    # folded into the session summary in the background
+    summary_enabled: bool = True
+    summary_keep_recent_messages: int = 10
+
+    # Semantic answer cache: reuse answers to near-identical questions asked
+    # after the same chat history (summary included), checked for turns with
+    # at most semantic_cache_max_history_messages of history. 0 (first turns
+    # only) because later turns almost never repeat a history exactly
+    semantic_cache_enabled: bool = True
+    semantic_cache_threshold: float = 0.95
+    semantic_cache_ttl_seconds: int = 3600
+    semantic_cache_max_entries: int = 1000
+    semantic_cache_max_history_messages: int = 0
+
+    # Query-embedding and retrieved-documents caches. Bump vector_index_version
+    # after re-indexing Pinecone to invalidate cached retrievals (the local
+    # index versions itself in meta.json on every write). cache_backend="mongo"
+    # adds a shared second level so all workers reuse each other's results.
+    retriever_k: int = 4
+    vector_index_version: str = "1"
+    cache_backend: str = "memory"
+    embedding_cache_max_entries: int = 10000
+    embedding_cache_max_mb: int = 64
+    embedding_cache_ttl_seconds: int = 24 * 3600
+    retrieval_cache_max_entries: int = 5000
+    retrieval_cache_max_mb: int = 64
+    retrieval_cache_ttl_seconds: int = 3600
+
+    # Coalesce concurrent query embeddings into one Pinecone inference call
+    embedding_batch_enabled: bool = True
+    embedding_batch_max_size: int = 32
+    embedding_batch_wait_ms: float = 5
+
+    # Admission control in front of the LLM: at most llm_max_in_flight calls,
+    # others wait in a per-user round-robin queue; beyond llm_queue_max (or
+    # llm_queue_max_per_user for one user) requests get 503 (429) + Retry-After
+    llm_max_in_flight: int = 8
+    llm_queue_max: int = 64
+    llm_queue_max_per_user: int = 2
+    llm_queue_timeout_seconds: float = 30
+
+    # Upstream resilience: per-stage deadlines (seconds), jittered retries for
+    # idempotent calls (embedding, vector search) and one circuit breaker per
+    # upstream. While the LLM is unavailable, answer from the semantic cache
+    # or with the retrieved passages instead of failing (llm_fallback_enabled)
+    embedding_timeout_seconds: float = 5
+    vector_search_timeout_seconds: float = 5
+    retrieval_timeout_seconds: float = 10
+    llm_timeout_seconds: float = 60
+    llm_first_token_timeout_seconds: float = 20
+    upstream_retries: int = 2
+    upstream_retry_base_delay: float = 0.2
+    circuit_failure_threshold: int = 5
+    circuit_reset_seconds: float = 30
+    llm_fallback_enabled: bool = True
 
     
     # Add this property:
@@ -0,0 +1,80 @@
+# context_packer.py
+# Post-retrieval stage: dedupe, rerank and trim chunks to a context token budget
+from typing import List
+
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from text_utils import estimate_tokens, tokenize
+
+
+def _shingles(tokens: list) -> set:
+    return set(zip(tokens, tokens[1:])) or set(tokens)
+
+
+def _jaccard(a: set, b: set) -> float:
+    return len(a & b) / len(a | b) if a and b else 0.0
+
+
+def pack_context(query: str, docs: List[Document], token_budget: int, max_docs: int, dedupe_threshold: float = 0.8) -> List[Document]:
+    """
+    Drop near-duplicate chunks (word-bigram Jaccard >= dedupe_threshold), score the
+    rest by query-term overlap blended with their retrieval rank, and keep the
+    best ones that fit in `token_budget`, in score order. If none fits, the
+    best one is truncated to the budget.
+    """
+    query_terms = set(tokenize(query))
+    kept_shingles = []
+    candidates = []
+    for rank, doc in enumerate(docs):
+        tokens = tokenize(doc.page_content)
+        shingles = _shingles(tokens)
+        if any(_jaccard(shingles, seen) >= dedupe_threshold for seen in kept_shingles):
+            continue
+        kept_shingles.append(shingles)
+        overlap = len(query_terms.intersection(tokens)) / len(query_terms) if query_terms else 0.0
+        score = 0.5 * overlap + 0.5 / (rank + 1)
+        candidates.append((score, rank, doc))
+
+    candidates.sort(key=lambda candidate: (-candidate[0], candidate[1]))
+    packed, used = [], 0
+    for _, _, doc in candidates:
+        cost = estimate_tokens(doc.page_content)
+        if used + cost > token_budget:
+            continue  # a smaller, lower-ranked chunk may still fit
+        packed.append(doc)
+        used += cost
+        if len(packed) >= max_docs:
+            break
+    if not packed and candidates and token_budget > 0 and max_docs > 0:
+        # Every chunk is over budget: answer from the start of the best one
+        # rather than with no context at all
+        best = candidates[0][2]
+        packed.append(Document(page_content=_truncate(best.page_content, token_budget), metadata=best.metadata))
+    return packed
+
+
+def _truncate(text: str, token_budget: int) -> str:
+    """Longest prefix of `text` (cut at a word boundary when possible) within token_budget"""
+    limit = (token_budget - 1) * 4
+    if len(text) <= limit:
+        return text
+    cut = text.rfind(" ", 0, limit + 1)
+    return text[:cut if cut > 0 else limit]
+
+
+class ContextPackingRetriever(BaseRetriever):
+    """Wraps a retriever that over-fetches candidates and packs the best of them"""
+    retriever: BaseRetriever
+    token_budget: int
+    max_docs: int
+    dedupe_threshold: float = 0.8
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        docs = self.retriever.invoke(query, config={"callbacks": run_manager.get_child()})
+        return pack_context(query, docs, self.token_budget, self.max_docs, self.dedupe_threshold)
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        docs = await self.retriever.ainvoke(query, config={"callbacks": run_manager.get_child()})
+        return pack_context(query, docs, self.token_budget, self.max_docs, self.dedupe_threshold)
@@ -0,0 +1,101 @@
+# embedding_batcher.py
+# Coalesces concurrent query embeddings into batched embed calls
+import asyncio
+from typing import Callable, List
+
+from langchain_core.embeddings import Embeddings
+
+
+class BatchingEmbeddings(Embeddings):
+    """
+    Micro-batcher for query embeddings.
+
+    Concurrent `aembed_query` calls arriving within `max_wait_ms` of each other
+    (or until `max_batch_size` is reached) are sent as a single request through
+    `embed_batch`, and each caller gets its own vector back. Document embedding
+    and sync calls go straight to the wrapped embeddings.
+    """
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        embed_batch: Callable[[List[str]], List[List[float]]],
+        max_batch_size: int = 32,
+        max_wait_ms: float = 5,
+    ):
+        self.embeddings = embeddings
+        self.embed_batch = embed_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.batches = 0
+        self.batched_queries = 0
+        self._loop = None
+        self._queue = None
+        self._worker = None
+        self._flushes = set()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self.embeddings.aembed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(text)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # (Re)bind to the running loop, e.g. the first request after startup
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._worker = loop.create_task(self._collect())
+        future = loop.create_future()
+        self._queue.put_nowait((text, future))
+        return await future
+
+    async def _collect(self):
+        """Group queued queries into batches and hand each batch off to be embedded"""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # Flush concurrently so the next batch can start forming right away
+            task = loop.create_task(self._flush(batch))
+            self._flushes.add(task)
+            task.add_done_callback(self._flushes.discard)
+
+    async def _flush(self, batch: list):
+        # Skip callers that gave up (cancelled) while waiting
+        pending = [(text, future) for text, future in batch if not future.done()]
+        if not pending:
+            return
+        texts = list(dict.fromkeys(text for text, _ in pending))
+        self.batches += 1
+        self.batched_queries += len(pending)
+        try:
+            vectors = await asyncio.to_thread(self.embed_batch, texts)
+        except Exception as e:
+            for _, future in pending:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        by_text = dict(zip(texts, vectors))
+        for text, future in pending:
+            if not future.done():
+                future.set_result(by_text[text])
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "queries": self.batched_queries,
+            "avg_batch_size": self.batched_queries / self.batches if self.batches else 0.0,
+        }
@@ -0,0 +1,49 @@
+# gunicorn.conf.py
+# Multi-worker mode: one uvicorn event loop per core, forked from a master
+# that already imported the app and loaded the read-only indexes
+#
+#   gunicorn -c gunicorn.conf.py main:app
+#   gunicorn -c gunicorn.conf.py --workers 4 main:app
+import multiprocessing
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from config import Settings, get_settings
+
+bind = os.environ.get("BIND", "0.0.0.0:8000")
+# A throwaway Settings: get_settings() is cached, and the app may still
+# adjust the environment when it is imported
+workers = Settings().web_workers or multiprocessing.cpu_count()
+worker_class = "uvicorn.workers.UvicornWorker"
+# Import main (langchain, numpy, the vendored prompt...) once, before forking.
+# Clients are only built after the fork, by each worker's warm-up
+preload_app = True
+timeout = 120
+graceful_timeout = 30
+keepalive = 5
+# Heartbeat files on tmpfs: a slow container disk can't get workers killed
+if os.path.isdir("/dev/shm"):
+    worker_tmp_dir = "/dev/shm"
+
+
+def on_starting(server):
+    # Each worker has its own session cache; without cross-worker
+    # invalidation they would serve each other's stale histories. The
+    # preloaded app shares this Settings object, and the workers build their
+    # session service after the fork, so turning it off here covers them all
+    settings = get_settings()
+    if (server.cfg.workers > 1 and settings.session_cache_enabled
+            and settings.session_cache_invalidation != "mongo"):
+        settings.session_cache_enabled = False
+        server.log.warning(
+            "Session cache disabled for %s workers; set SESSION_CACHE_INVALIDATION=mongo "
+            "(replica set) to keep it", server.cfg.workers
+        )
+
+
+def when_ready(server):
+    # Runs in the master before the first fork
+    from rag_services import preload_shared_data
+    preload_shared_data()
+    server.log.info("Preloaded shared indexes for %s workers", server.cfg.workers)
@@ -0,0 +1,299 @@
+# ingest.py
+# Incremental ingestion of a document directory into the configured vector store
+#
+#   python ingest.py docs/                  # ingest new/changed files
+#   python ingest.py docs/ --rebuild-bm25   # ...and refresh the local BM25 index
+import argparse
+import hashlib
+import json
+import os
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Iterator, List, Tuple
+
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from config import get_settings
+
+TEXT_SUFFIXES = {".txt", ".md", ".markdown"}
+JSONL_SUFFIXES = {".jsonl"}
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def file_fingerprint(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def iter_files(directory: Path) -> Iterator[Path]:
+    for path in sorted(directory.rglob("*")):
+        if path.is_file() and path.suffix.lower() in TEXT_SUFFIXES | JSONL_SUFFIXES:
+            yield path
+
+
+def iter_file_documents(path: Path, source: str) -> Iterator[Document]:
+    """Whole text/markdown files, or one document per JSONL line ("text" or "content" field)"""
+    if path.suffix.lower() in JSONL_SUFFIXES:
+        with open(path, encoding="utf-8") as f:
+            for line_number, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                row = json.loads(line)
+                text = row.pop("text", None) or row.pop("content", None)
+                if not text:
+                    continue
+                metadata = {k: v for k, v in row.items() if isinstance(v, (str, int, float, bool))}
+                metadata.update(source=source, line=line_number)
+                yield Document(page_content=text, metadata=metadata)
+    else:
+        yield Document(page_content=path.read_text(encoding="utf-8"), metadata={"source": source})
+
+
+def iter_chunks(documents: Iterator[Document], splitter) -> Iterator[Document]:
+    """Split lazily; each chunk's id is the hash of its text, so identical chunks collapse"""
+    for document in documents:
+        for chunk in splitter.split_documents([document]):
+            chunk.id = content_hash(chunk.page_content)
+            yield chunk
+
+
+class PineconeWriter:
+    def __init__(self, settings):
+        from pinecone import Pinecone
+        self.index = Pinecone(api_key=settings.pinecone_api_key).Index(settings.pinecone_index_name)
+
+    def upsert(self, chunks: List[Document], embeddings: List[List[float]]):
+        self.index.upsert(vectors=[
+            {"id": chunk.id, "values": values, "metadata": {**chunk.metadata, "text": chunk.page_content}}
+            for chunk, values in zip(chunks, embeddings)
+        ])
+
+    def delete(self, ids: List[str]):
+        for start in range(0, len(ids), 1000):
+            self.index.delete(ids=ids[start:start + 1000])
+
+
+class LocalWriter:
+    def __init__(self, settings):
+        from local_vector_store import LocalVectorStore
+        self.store = LocalVectorStore(settings.local_index_path, embedding=None)
+
+    def upsert(self, chunks: List[Document], embeddings: List[List[float]]):
+        self.store.add_embeddings(
+            [chunk.page_content for chunk in chunks],
+            embeddings,
+            [chunk.metadata for chunk in chunks],
+            [chunk.id for chunk in chunks],
+        )
+
+    def delete(self, ids: List[str]):
+        self.store.delete(ids)
+
+
+class Checkpoint:
+    """
+    Per-file fingerprint and chunk ids, saved after every completed file so an
+    interrupted run resumes where it stopped.
+    """
+    def __init__(self, path: Path):
+        self.path = path
+        self.files = json.loads(path.read_text())["files"] if path.exists() else {}
+        # How many files reference each chunk id (identical chunks are shared)
+        self.refs = Counter(chunk_id for state in self.files.values() for chunk_id in state["chunk_ids"])
+
+    def is_current(self, source: str, fingerprint: str) -> bool:
+        return self.files.get(source, {}).get("fingerprint") == fingerprint
+
+    def known_ids(self) -> set:
+        return set(self.refs)
+
+    def record(self, source: str, fingerprint: str, chunk_ids: List[str]) -> List[str]:
+        """Store a file's new chunk ids; returns ids no file references anymore"""
+        previous = self.files.get(source, {}).get("chunk_ids", [])
+        self.refs.update(chunk_ids)
+        self.refs.subtract(previous)
+        self.files[source] = {"fingerprint": fingerprint, "chunk_ids": chunk_ids}
+        self.save()
+        return self._orphans(previous)
+
+    def forget(self, source: str) -> List[str]:
+        previous = self.files.pop(source, {}).get("chunk_ids", [])
+        self.refs.subtract(previous)
+        self.save()
+        return self._orphans(previous)
+
+    def _orphans(self, chunk_ids: List[str]) -> List[str]:
+        orphans = sorted({chunk_id for chunk_id in chunk_ids if self.refs[chunk_id] <= 0})
+        for chunk_id in orphans:
+            del self.refs[chunk_id]
+        return orphans
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps({"files": self.files}))
+        os.replace(tmp_path, self.path)
+
+
+class Ingestor:
+    """
+    Streams files -> documents -> chunks, skips chunks whose content hash is
+    already indexed, and embeds + upserts the rest in batches on a thread pool
+    with at most `concurrency` batches in flight.
+    """
+    def __init__(self, embeddings, writer, checkpoint: Checkpoint, splitter, batch_size: int = 64, concurrency: int = 4):
+        self.embeddings = embeddings
+        self.writer = writer
+        self.checkpoint = checkpoint
+        self.splitter = splitter
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.stats = {"files": 0, "skipped_files": 0, "chunks": 0, "embedded": 0, "deleted": 0}
+
+    def _changed_files(self, directory: Path) -> Iterator[Tuple[str, str, List[Document]]]:
+        for path in iter_files(directory):
+            source = str(path.relative_to(directory))
+            fingerprint = file_fingerprint(path)
+            if self.checkpoint.is_current(source, fingerprint):
+                self.stats["skipped_files"] += 1
+                continue
+            chunks = list(iter_chunks(iter_file_documents(path, source), self.splitter))
+            yield source, fingerprint, chunks
+
+    def _write_batch(self, batch: List[Document]):
+        vectors = self.embeddings.embed_documents([chunk.page_content for chunk in batch])
+        self.writer.upsert(batch, vectors)
+
+    def run(self, directory: Path, remove_missing: bool = True):
+        known = self.checkpoint.known_ids()
+        pending = {}  # source -> [fingerprint, chunk ids, batches outstanding]
+        pending_refs = Counter()  # chunk ids of files not yet recorded
+        unwritten = {}  # chunk id -> sources of the batch that will write it
+        in_flight = {}  # future -> (sources, chunk ids) of that batch
+        batch, batch_sources = [], set()
+
+        def depend(source, sources):
+            # A file is recorded only once every batch holding its chunks is written
+            if source not in sources:
+                sources.add(source)
+                pending[source][2] += 1
+
+        def finish(source):
+            fingerprint, chunk_ids, _ = pending.pop(source)
+            pending_refs.subtract(chunk_ids)
+            # Keep chunks another in-progress file still points at
+            stale = [chunk_id for chunk_id in self.checkpoint.record(source, fingerprint, chunk_ids)
+                     if pending_refs[chunk_id] <= 0]
+            known.difference_update(stale)
+            if stale:
+                self.writer.delete(stale)
+                self.stats["deleted"] += len(stale)
+            self.stats["files"] += 1
+            print(f"Indexed {source} ({len(chunk_ids)} chunks)")
+
+        def collect(done):
+            for future in done:
+                sources, chunk_ids = in_flight.pop(future)
+                future.result()  # re-raise; the checkpoint keeps only fully written files
+                for chunk_id in chunk_ids:
+                    unwritten.pop(chunk_id, None)
+                for source in sources:
+                    pending[source][2] -= 1
+                    if pending[source][2] == 0:
+                        finish(source)
+
+        def submit(pool):
+            nonlocal batch, batch_sources
+            if len(in_flight) >= self.concurrency:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(done)
+            future = pool.submit(self._write_batch, batch)
+            in_flight[future] = (batch_sources, [chunk.id for chunk in batch])
+            batch, batch_sources = [], set()
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            for source, fingerprint, chunks in self._changed_files(directory):
+                chunk_ids = list(dict.fromkeys(chunk.id for chunk in chunks))
+                pending[source] = [fingerprint, chunk_ids, 0]
+                pending_refs.update(chunk_ids)
+                self.stats["chunks"] += len(chunk_ids)
+                for chunk in chunks:
+                    if chunk.id in unwritten:
+                        # Same text queued by an earlier file: wait for that batch instead
+                        depend(source, unwritten[chunk.id])
+                        continue
+                    if chunk.id in known:
+                        continue
+                    known.add(chunk.id)
+                    batch.append(chunk)
+                    unwritten[chunk.id] = batch_sources
+                    depend(source, batch_sources)
+                    self.stats["embedded"] += 1
+                    if len(batch) >= self.batch_size:
+                        submit(pool)
+                if pending[source][2] == 0:
+                    finish(source)
+            if batch:
+                submit(pool)
+            collect(wait(in_flight).done)
+
+        if remove_missing:
+            present = {str(path.relative_to(directory)) for path in iter_files(directory)}
+            for source in list(self.checkpoint.files):
+                if source not in present:
+                    stale = self.checkpoint.forget(source)
+                    if stale:
+                        self.writer.delete(stale)
+                        self.stats["deleted"] += len(stale)
+                    print(f"Removed {source}")
+        return self.stats
+
+
+def main():
+    settings = get_settings()
+    parser = argparse.ArgumentParser(description="Ingest a directory of txt/markdown/JSONL documents")
+    parser.add_argument("directory", type=Path)
+    parser.add_argument("--checkpoint", type=Path, default=Path(settings.ingest_checkpoint_path))
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--chunk-overlap", type=int, default=150)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--keep-missing", action="store_true", help="don't delete chunks of files that were removed")
+    parser.add_argument("--rebuild-bm25", action="store_true", help="rebuild the BM25 index from the local store")
+    args = parser.parse_args()
+
+    from langchain_pinecone import PineconeEmbeddings
+    embeddings = PineconeEmbeddings(model=settings.embedding_model, pinecone_api_key=settings.pinecone_api_key)
+    writer = LocalWriter(settings) if settings.vector_store_backend == "local" else PineconeWriter(settings)
+    splitter = RecursiveCharacterTextSplitter(chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap)
+
+    ingestor = Ingestor(embeddings, writer, Checkpoint(args.checkpoint), splitter, args.batch_size, args.concurrency)
+    stats = ingestor.run(args.directory, remove_missing=not args.keep_missing)
+    print(f"Done: {stats}")
+
+    if args.rebuild_bm25:
+        if settings.vector_store_backend != "local":
+            print("--rebuild-bm25 needs the local backend; snapshot the Pinecone index first")
+        else:
+            from bm25_index import BM25Index
+            store = writer.store
+            BM25Index.build(store.texts, store.metadatas, store.ids).save(settings.bm25_index_path)
+            print(f"Rebuilt BM25 index in {settings.bm25_index_path}")
+    if stats["embedded"] or stats["deleted"]:
+        if settings.vector_store_backend == "local":
+            # Cached retrievals are keyed by this; restart the app to pick it up
+            print(f"Local index is now version {writer.store.version}")
+        else:
+            print("Bump VECTOR_INDEX_VERSION to invalidate cached retrievals")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+# jobs.py
+# Background jobs for slow session maintenance (purges, migrations), persisted in Mongo
+import asyncio
+import logging
+import random
+import time
+import uuid
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from config import get_settings
+from metrics import Counter, Gauge, Histogram
+from session_services import get_async_session_service, get_session_service
+
+logger = logging.getLogger(__name__)
+
+JOBS = Counter("jobs_total", "Finished job attempts", ("kind", "outcome"))
+JOB_SECONDS = Histogram("job_seconds", "Time spent running a job attempt", ("kind",))
+JOBS_RUNNING = Gauge("jobs_running", "Jobs currently running in this worker")
+
+ACTIVE = ("pending", "running")
+# What GET /api/jobs/{job_id} shows: no params, results or errors, which
+# name users and sessions
+STATUS_PROJECTION = {
+    "_id": 0, "job_id": 1, "kind": 1, "status": 1, "attempts": 1, "max_attempts": 1,
+    "progress": 1, "created_at": 1, "updated_at": 1, "finished_at": 1,
+}
+
+
+class JobQueue:
+    """
+    Jobs are documents in `collection`; `workers` asyncio tasks claim them
+    atomically (so several processes can share the collection) and run the
+    registered handler on the Mongo thread pool.
+
+    A claim is a lease: a worker that dies mid-job leaves it `running` until
+    `lease_seconds` pass, then another worker picks it up. Handlers must
+    therefore be idempotent; progress reports renew the lease. Failed
+    attempts are retried with jittered exponential backoff up to
+    `max_attempts`, then the job is marked failed.
+    """
+    def __init__(self, collection, run, workers: int = 2, max_attempts: int = 5, base_delay: float = 1.0,
+                 max_delay: float = 300.0, poll_interval: float = 2.0, lease_seconds: float = 60.0,
+                 retention_days: float = 7):
+        self.collection = collection
+        self._run = run
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.handlers = {}
+        self._tasks = []
+        self._wake = None
+        self.collection.create_index([("status", ASCENDING), ("run_at", ASCENDING)])
+        # dedupe_key is unset when a job finishes, so this allows one active job per key
+        self.collection.create_index(
+            "dedupe_key", unique=True, name="active_dedupe_key",
+            partialFilterExpression={"dedupe_key": {"$type": "string"}},
+        )
+        # Finished jobs stay inspectable for a while, then expire
+        self.collection.create_index("finished_at", expireAfterSeconds=int(retention_days * 86400))
+
+    def register(self, kind: str, handler):
+        """`handler(params, progress)` -> result dict; `progress(dict)` records progress"""
+        self.handlers[kind] = handler
+
+    def _insert(self, kind: str, params: dict, dedupe_key: str = None) -> str:
+        now = datetime.utcnow()
+        job_id = str(uuid.uuid4())
+        doc = {
+            "_id": job_id,
+            "job_id": job_id,
+            "kind": kind,
+            "params": params,
+            "status": "pending",
+            "attempts": 0,
+            "max_attempts": self.max_attempts,
+            "progress": {},
+            "run_at": now,
+            "created_at": now,
+            "updated_at": now,
+        }
+        if dedupe_key is None:
+            self.collection.insert_one(doc)
+            return job_id
+        # One active job per key: enqueueing the same purge twice returns the first
+        doc["dedupe_key"] = dedupe_key
+        try:
+            existing = self.collection.find_one_and_update(
+                {"dedupe_key": dedupe_key, "status": {"$in": list(ACTIVE)}},
+                {"$setOnInsert": doc},
+                upsert=True,
+                return_document=ReturnDocument.BEFORE,
+                projection={"job_id": 1},
+            )
+        except DuplicateKeyError:
+            # A concurrent enqueue inserted the job between our lookup and insert
+            existing = self.collection.find_one({"dedupe_key": dedupe_key}, {"job_id": 1})
+            if existing is None:
+                # ...and it already finished; this one is a new job
+                return self._insert(kind, params, dedupe_key)
+        return existing["job_id"] if existing else job_id
+
+    async def enqueue(self, kind: str, params: dict, dedupe_key: str = None) -> str:
+        if kind not in self.handlers:
+            raise ValueError(f"No handler for job kind {kind!r}")
+        job_id = await self._run(self._insert, kind, params, dedupe_key)
+        if self._wake is not None:
+            self._wake.set()
+        return job_id
+
+    def get(self, job_id: str, projection: dict = None) -> dict:
+        return self.collection.find_one({"_id": job_id}, projection)
+
+    async def aget_status(self, job_id: str) -> dict:
+        return await self._run(self.get, job_id, STATUS_PROJECTION)
+
+    def _claim(self):
+        now = datetime.utcnow()
+        return self.collection.find_one_and_update(
+            {"$or": [
+                {"status": "pending", "run_at": {"$lte": now}},
+                {"status": "running", "lease_until": {"$lt": now}},
+            ], "kind": {"$in": list(self.handlers)}},
+            {
+                "$set": {"status": "running", "lease_until": now + timedelta(seconds=self.lease_seconds),
+                         "updated_at": now},
+                "$inc": {"attempts": 1},
+            },
+            sort=[("run_at", ASCENDING)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def _progress(self, job_id: str, attempt: int, progress: dict):
+        now = datetime.utcnow()
+        self.collection.update_one(
+            {"_id": job_id, "status": "running", "attempts": attempt},
+            {"$set": {"progress": progress, "updated_at": now,
+                      "lease_until": now + timedelta(seconds=self.lease_seconds)}},
+        )
+
+    def _execute(self, job: dict):
+        """Run the handler and record the outcome (on a worker thread)"""
+        handler = self.handlers[job["kind"]]
+        attempt = job["attempts"]
+        start = time.perf_counter()
+        try:
+            result = handler(job["params"], lambda progress: self._progress(job["_id"], attempt, progress))
+        except Exception as e:
+            JOB_SECONDS.observe(time.perf_counter() - start, kind=job["kind"])
+            self._failed(job, e)
+            return
+        JOB_SECONDS.observe(time.perf_counter() - start, kind=job["kind"])
+        JOBS.inc(kind=job["kind"], outcome="succeeded")
+        now = datetime.utcnow()
+        self.collection.update_one(
+            {"_id": job["_id"], "attempts": attempt},
+            {"$set": {"status": "succeeded", "result": result or {}, "error": None,
+                      "updated_at": now, "finished_at": now},
+             "$unset": {"lease_until": "", "dedupe_key": ""}},
+        )
+
+    def _failed(self, job: dict, error: Exception):
+        now = datetime.utcnow()
+        update = {"error": f"{type(error).__name__}: {error}", "updated_at": now}
+        unset = {"lease_until": ""}
+        if job["attempts"] >= job.get("max_attempts", self.max_attempts):
+            JOBS.inc(kind=job["kind"], outcome="failed")
+            update.update(status="failed", finished_at=now)
+            unset["dedupe_key"] = ""
+            logger.error(f"Job {job['_id']} ({job['kind']}) failed after {job['attempts']} attempts: {error}")
+        else:
+            JOBS.inc(kind=job["kind"], outcome="retried")
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (job["attempts"] - 1)))
+            update.update(status="pending", run_at=now + timedelta(seconds=delay))
+        self.collection.update_one({"_id": job["_id"], "attempts": job["attempts"]}, {"$set": update, "$unset": unset})
+
+    async def _work(self):
+        while True:
+            try:
+                job = await self._run(self._claim)
+            except Exception as e:
+                logger.warning(f"Error claiming a job, will retry: {e}")
+                job = None
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wake.clear()
+                continue
+            JOBS_RUNNING.inc()
+            try:
+                await self._run(self._execute, job)
+            except Exception as e:
+                # Recording the outcome failed; the lease expires and the job runs again
+                logger.error(f"Error finishing job {job['_id']}: {e}")
+            finally:
+                JOBS_RUNNING.dec()
+
+    def start(self):
+        """Start the workers on the running loop; jobs left by earlier processes are picked up too"""
+        if self._tasks:
+            return
+        self._wake = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """Stop claiming jobs; one interrupted mid-run is retried once its lease expires"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+@lru_cache()
+def get_job_queue() -> JobQueue:
+    """Singleton queue with the session maintenance handlers registered"""
+    settings = get_settings()
+    session_service = get_session_service()
+    queue = JobQueue(
+        session_service.db.jobs,
+        get_async_session_service().run,
+        workers=settings.jobs_workers,
+        max_attempts=settings.jobs_max_attempts,
+        base_delay=settings.jobs_retry_base_delay,
+        poll_interval=settings.jobs_poll_seconds,
+        lease_seconds=settings.jobs_lease_seconds,
+        retention_days=settings.jobs_retention_days,
+    )
+    register_session_jobs(queue, session_service)
+    return queue
+
+
+def register_session_jobs(queue: JobQueue, session_service):
+    batch_size = get_settings().purge_batch_size
+    queue.register("purge_session", lambda params, progress: session_service.purge_session(
+        params["session_id"], batch_size, progress
+    ))
+    queue.register("migrate_sessions", lambda params, progress: {
+        "sessions_moved": session_service.reassign_sessions(params["from_user_id"], params["to_user_id"])
+    })
@@ -0,0 +1,345 @@
+# local_vector_store.py
+# In-process vector store backed by a memory-mapped NumPy matrix
+import argparse
+import asyncio
+import json
+import logging
+import os
+import shutil
+import threading
+import uuid
+from pathlib import Path
+from typing import Any, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+from ivf_index import CENTROIDS_FILE, OFFSETS_FILE, ROWS_FILE, IVFIndex, recall_report
+
+logger = logging.getLogger(__name__)
+
+VECTORS_FILE = "vectors.f32"
+DOCS_FILE = "docs.jsonl"
+META_FILE = "meta.json"
+
+# Above this many rows a search is pushed to a thread instead of the event
+# loop. Measured at dim 1024: ~0.4 ms of matmul + argpartition at 2k rows
+# (2 ms at 10k, 18 ms at 50k) against ~0.07 ms for the thread hop
+ASYNC_THREAD_THRESHOLD = 2_000
+
+
+class LocalVectorStore(VectorStore):
+    """
+    Local alternative to PineconeVectorStore.
+
+    Layout of `path`:
+      vectors.f32  row-major float32 matrix of L2-normalized embeddings (memory-mapped)
+      docs.jsonl   one {"id", "text", "metadata"} line per matrix row
+      meta.json    {"dim", "count", "docs_bytes"}: the committed size of the two files above,
+                   plus "version", a new random token on every write (retrieval cache key)
+
+    Cosine top-k is a single matrix-vector product plus argpartition.
+    With index_type="ivf" and a built IVF index (ivf_*.npy) only the rows of
+    the `nprobe` nearest clusters are scored.
+    """
+    def __init__(self, path: str, embedding: Embeddings, index_type: str = "flat", nprobe: int = 8):
+        self.path = Path(path)
+        self._embedding = embedding
+        self.index_type = index_type
+        self.nprobe = nprobe
+        self._write_lock = threading.Lock()
+        self.load()
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embedding
+
+    @embeddings.setter
+    def embeddings(self, embedding: Embeddings):
+        # Set later when the store was preloaded before its embeddings existed
+        self._embedding = embedding
+
+    def load(self):
+        """(Re)open the index files"""
+        meta_path = self.path / META_FILE
+        meta = json.loads(meta_path.read_text()) if meta_path.exists() else {"dim": 0, "count": 0, "docs_bytes": 0}
+        self.dim = meta["dim"]
+        self.count = meta["count"]
+        self.docs_bytes = meta.get("docs_bytes", 0)
+        self.version = meta.get("version", "0")
+        self._open_vectors()
+
+        self.ids, self.texts, self.metadatas = [], [], []
+        docs_path = self.path / DOCS_FILE
+        if docs_path.exists():
+            with open(docs_path, encoding="utf-8") as f:
+                for line in f:
+                    row = json.loads(line)
+                    self.ids.append(row["id"])
+                    self.texts.append(row["text"])
+                    self.metadatas.append(row["metadata"])
+        # Ignore rows of an append that crashed before meta.json was updated
+        del self.ids[self.count:], self.texts[self.count:], self.metadatas[self.count:]
+        self.rows_by_id = {doc_id: row for row, doc_id in enumerate(self.ids)}
+
+        self.ann = None
+        if self.index_type == "ivf":
+            if IVFIndex.exists(self.path):
+                self.ann = IVFIndex.load(self.path)
+            else:
+                logger.warning(f"No IVF index in {self.path}, falling back to exact search")
+
+    def _open_vectors(self):
+        if self.count:
+            self.vectors = np.memmap(
+                self.path / VECTORS_FILE, dtype=np.float32, mode="r", shape=(self.count, self.dim)
+            )
+        else:
+            self.vectors = np.zeros((0, self.dim), dtype=np.float32)
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        norms[norms == 0] = 1
+        return vectors / norms
+
+    def add_embeddings(
+        self,
+        texts: List[str],
+        embeddings: List[List[float]],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+    ) -> List[str]:
+        """
+        Append pre-computed embeddings; the matrix file is extended in place.
+        Ids already in the store are skipped, which makes re-adding a batch safe.
+        """
+        if not texts:
+            return []
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [f"doc_{self.count + i}" for i in range(len(texts))]
+
+        with self._write_lock:
+            keep = [i for i, doc_id in enumerate(ids) if doc_id not in self.rows_by_id]
+            if not keep:
+                return list(ids)
+            matrix = self._normalize(np.asarray([embeddings[i] for i in keep], dtype=np.float32))
+            if self.dim and matrix.shape[1] != self.dim:
+                raise ValueError(f"Expected {self.dim}-dimensional embeddings, got {matrix.shape[1]}")
+            dim = matrix.shape[1]
+
+            # Writes start at the committed sizes, overwriting leftovers of a crashed append
+            self.path.mkdir(parents=True, exist_ok=True)
+            with open(self.path / VECTORS_FILE, "ab+") as f:
+                f.truncate(self.count * dim * 4)
+                f.write(np.ascontiguousarray(matrix).tobytes())
+            lines = "".join(
+                json.dumps({"id": ids[i], "text": texts[i], "metadata": metadatas[i]}) + "\n"
+                for i in keep
+            ).encode("utf-8")
+            with open(self.path / DOCS_FILE, "ab+") as f:
+                f.truncate(self.docs_bytes)
+                f.write(lines)
+            self._write_meta(dim, self.count + len(keep), self.docs_bytes + len(lines))
+
+            for i in keep:
+                self.rows_by_id[ids[i]] = len(self.ids)
+                self.ids.append(ids[i])
+                self.texts.append(texts[i])
+                self.metadatas.append(metadatas[i])
+            self.dim, self.count, self.docs_bytes = dim, len(self.ids), self.docs_bytes + len(lines)
+            self._open_vectors()
+        return list(ids)
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        """
+        Remove rows by id by rewriting the index without them.
+        Row numbers shift, so any IVF index is dropped and must be rebuilt.
+        """
+        with self._write_lock:
+            drop = {self.rows_by_id[doc_id] for doc_id in ids or [] if doc_id in self.rows_by_id}
+            if not drop:
+                return False
+            keep = np.asarray([row for row in range(self.count) if row not in drop], dtype=np.int64)
+            matrix = np.asarray(self.vectors[keep]) if len(keep) else np.zeros((0, self.dim), dtype=np.float32)
+            lines = "".join(
+                json.dumps({"id": self.ids[row], "text": self.texts[row], "metadata": self.metadatas[row]}) + "\n"
+                for row in keep
+            ).encode("utf-8")
+
+            tmp_vectors = self.path / (VECTORS_FILE + ".tmp")
+            tmp_docs = self.path / (DOCS_FILE + ".tmp")
+            tmp_vectors.write_bytes(np.ascontiguousarray(matrix).tobytes())
+            tmp_docs.write_bytes(lines)
+            self.vectors = None  # release the old mapping before replacing the file
+            os.replace(tmp_vectors, self.path / VECTORS_FILE)
+            os.replace(tmp_docs, self.path / DOCS_FILE)
+            self._write_meta(self.dim, len(keep), len(lines))
+            for name in (CENTROIDS_FILE, OFFSETS_FILE, ROWS_FILE):
+                (self.path / name).unlink(missing_ok=True)
+            self.load()
+        return True
+
+    def _write_meta(self, dim: int, count: int, docs_bytes: int):
+        # Written last and atomically, so a crash mid-append leaves the old count in place.
+        # Random rather than a counter: a rebuilt index must not reuse an old version
+        version = uuid.uuid4().hex[:12]
+        tmp_path = self.path / (META_FILE + ".tmp")
+        tmp_path.write_text(json.dumps({"dim": dim, "count": count, "docs_bytes": docs_bytes, "version": version}))
+        os.replace(tmp_path, self.path / META_FILE)
+        self.version = version
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> List[str]:
+        texts = list(texts)
+        return self.add_embeddings(texts, self._embedding.embed_documents(texts), metadatas, ids)
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: List[str],
+        embedding: Embeddings,
+        metadatas: Optional[List[dict]] = None,
+        path: str = "data/local_index",
+        **kwargs: Any,
+    ) -> "LocalVectorStore":
+        store = cls(path, embedding)
+        store.add_texts(texts, metadatas, kwargs.get("ids"))
+        return store
+
+    def search_by_vector(self, embedding: List[float], k: int = 4) -> List[Tuple[int, float]]:
+        """Cosine top-k (exact, or over IVF candidates): (row, score) pairs, best first"""
+        if not self.count:
+            return []
+        query = self._normalize(np.asarray(embedding, dtype=np.float32))
+        if self.ann is not None:
+            rows = self.ann.candidates(query, self.nprobe)
+            if self.ann.num_rows < self.count:
+                # Rows appended since the IVF build are not clustered yet
+                rows = np.concatenate([rows, np.arange(self.ann.num_rows, self.count)])
+            scores = self.vectors[rows] @ query
+        else:
+            rows = np.arange(self.count)
+            scores = self.vectors @ query
+        k = min(k, len(rows))
+        if not k:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k] if k < len(rows) else np.arange(len(rows))
+        top = top[np.argsort(-scores[top])]
+        return [(int(rows[i]), float(scores[i])) for i in top]
+
+    def _to_document(self, row: int) -> Document:
+        return Document(
+            id=self.ids[row],
+            page_content=self.texts[row],
+            metadata=dict(self.metadatas[row]),
+        )
+
+    def similarity_search_with_score_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        return [(self._to_document(row), score) for row, score in self.search_by_vector(embedding, k)]
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vector(self._embedding.embed_query(query), k)
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+
+    async def asimilarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        embedding = await self._embedding.aembed_query(query)
+        if self.count > ASYNC_THREAD_THRESHOLD:
+            return await asyncio.to_thread(self.similarity_search_with_score_by_vector, embedding, k)
+        return self.similarity_search_with_score_by_vector(embedding, k)
+
+    async def asimilarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in await self.asimilarity_search_with_score(query, k)]
+
+    def _select_relevance_score_fn(self):
+        # Scores are already cosine similarities
+        return lambda score: score
+
+
+def snapshot_pinecone_index(index, path: str, text_key: str = "text", namespace: str = "", batch_size: int = 100) -> int:
+    """
+    Copy every vector of a (serverless) Pinecone index into a fresh local store.
+    Vectors are paged with list() and pulled with fetch(), so the text and
+    embeddings are copied as-is without re-embedding anything.
+    """
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    store = LocalVectorStore(path, embedding=None)
+
+    total = 0
+    for ids in index.list(namespace=namespace, limit=batch_size):
+        fetched = index.fetch(ids=list(ids), namespace=namespace)
+        texts, embeddings, metadatas, vector_ids = [], [], [], []
+        for vector_id, vector in fetched.vectors.items():
+            metadata = dict(vector.metadata or {})
+            text = metadata.pop(text_key, None) or metadata.pop("content", None)
+            if text is None:
+                print(f"Warning: no text field in metadata of {vector_id}: {list(metadata.keys())}")
+                continue
+            texts.append(text)
+            embeddings.append(vector.values)
+            metadatas.append(metadata)
+            vector_ids.append(vector_id)
+        store.add_embeddings(texts, embeddings, metadatas, vector_ids)
+        total += len(texts)
+        print(f"Copied {total} vectors")
+    return total
+
+
+def main():
+    from config import get_settings
+    settings = get_settings()
+
+    parser = argparse.ArgumentParser(description="Manage the local vector index")
+    parser.add_argument("--path", default=settings.local_index_path)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("snapshot", help="Copy the configured Pinecone index to disk")
+    commands.add_parser("info", help="Show index size")
+    build = commands.add_parser("build-ivf", help="Cluster the vectors into an IVF index")
+    build.add_argument("--nlist", type=int, default=settings.ivf_nlist, help="number of clusters (0 = 4*sqrt(n))")
+    build.add_argument("--iterations", type=int, default=20)
+    recall = commands.add_parser("recall", help="recall@k and latency of IVF vs exact search")
+    recall.add_argument("--k", type=int, default=settings.retriever_k)
+    recall.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    recall.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    if args.command == "snapshot":
+        from pinecone import Pinecone
+        index = Pinecone(api_key=settings.pinecone_api_key).Index(settings.pinecone_index_name)
+        print("Index Stats:", index.describe_index_stats())
+        total = snapshot_pinecone_index(index, args.path)
+        print(f"Snapshot of {total} vectors written to {args.path}")
+    elif args.command == "info":
+        store = LocalVectorStore(args.path, embedding=None)
+        print(f"{store.count} vectors of dimension {store.dim} in {args.path} (version {store.version})")
+        if IVFIndex.exists(args.path):
+            ivf = IVFIndex.load(args.path)
+            print(f"IVF index: {ivf.nlist} lists covering {ivf.num_rows} vectors")
+    elif args.command == "build-ivf":
+        store = LocalVectorStore(args.path, embedding=None)
+        ivf = IVFIndex.build(store.vectors, nlist=args.nlist, iterations=args.iterations)
+        ivf.save(args.path)
+        print(f"Built IVF index with {ivf.nlist} lists over {ivf.num_rows} vectors")
+    elif args.command == "recall":
+        store = LocalVectorStore(args.path, embedding=None)
+        ivf = IVFIndex.load(args.path)
+        print(f"{'setting':<12} {'recall@' + str(args.k):>10} {'ms/query':>10}")
+        for setting, value, latency in recall_report(store.vectors, ivf, args.k, args.nprobe, args.queries):
+            print(f"{setting:<12} {value:>10.3f} {latency:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,26 @@
 # main.py
-from fastapi import FastAPI, HTTPException, Cookie, Response
+from fastapi import FastAPI, HTTPException, Cookie, Response, BackgroundTasks, Query
 from fastapi.middleware.cors import CORSMiddleware  # Add this import
-from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
 from rag_services import get_rag_service
-from session_services import get_session_service
-from auth_service import AuthService, UserCreate, UserLogin  # Add this
+from session_services import ChatSessionService, get_session_service, get_async_session_service
+from auth_service import UserCreate, UserLogin, get_auth_service  # Add this
 from config import get_settings  # Add this
+from metrics import COLLECTORS, MetricsMiddleware, render_metrics, render_stats
+from admission import AdmissionRejected, get_admission_controller
+from password_hashing import get_password_hasher
+from resilience import UpstreamUnavailable
+from pagination import encode_cursor
+from warmup import Warmup, WarmupMiddleware
+from jobs import get_job_queue
+import asyncio
+import json
+from datetime import datetime
 import logging
+import time
+import weakref
 
 #Finna gonna make an itty bitty change!
 # Configure logging
@@ -23,7 +36,19 @@ dummy_session_id = "0"
 
 
 
-# Add CORS middleware
+# Services are built off the event loop by the warm-up (see startup_mode);
+# requests other than health checks and metrics wait for it
+warmup = Warmup([
+    ("sessions", lambda: get_session_service()),
+    ("async_sessions", lambda: get_async_session_service()),
+    ("jobs", lambda: get_job_queue()),
+    ("auth", lambda: get_auth_service()),
+    ("rag", lambda: get_rag_service()),
+], on_ready=lambda: get_job_queue().start())
+app.add_middleware(WarmupMiddleware, warmup=warmup)
+
+# Add CORS middleware. Added after (so outside) the warm-up, so its 503s
+# carry CORS headers and the browser sees a retryable error
 app.add_middleware(
     CORSMiddleware,
     allow_origins=settings.cors_origins,  # Next.js default port
@@ -32,6 +57,31 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Per-request latency, in-flight gauge and Server-Timing on chat responses
+app.add_middleware(MetricsMiddleware)
+
+def rag_cache_metrics() -> list:
+    # Only report once the RAG service exists; scraping must not build it
+    if not get_rag_service.cache_info().currsize:
+        return []
+    return render_stats("rag_cache", "RAG cache and embedding batcher statistics", "cache", get_rag_service().cache_stats())
+
+COLLECTORS.append(rag_cache_metrics)
+
+def session_cache_metrics() -> list:
+    if not get_session_service.cache_info().currsize or get_session_service().cache is None:
+        return []
+    return render_stats("session_cache", "Session history and list cache statistics", "cache", get_session_service().cache.stats())
+
+COLLECTORS.append(session_cache_metrics)
+
+def auth_cache_metrics() -> list:
+    if not get_auth_service.cache_info().currsize:
+        return []
+    return render_stats("auth_cache", "Verified-token and user-profile cache statistics", "cache", get_auth_service().cache_stats())
+
+COLLECTORS.append(auth_cache_metrics)
+
 
 class UserPrompt(BaseModel):
     prompt: str 
@@ -43,53 +93,198 @@ class CreateSessionRequest(BaseModel):
 # Initialize service on startup
 @app.on_event("startup")
 async def startup_event():
-    try:
-        # This will initialize the RAG service
-        get_rag_service()
-        # This will initialize the Session service
-        get_session_service()
-        logger.info("RAG service initialized successfully")
-    except Exception as e:
-        logger.error(f"Failed to initialize RAG service: {e}")
-        raise
+    if settings.startup_mode == "eager":
+        try:
+            await warmup.ensure()
+            logger.info("RAG service initialized successfully")
+        except Exception as e:
+            logger.error(f"Failed to initialize RAG service: {e}")
+            raise
+    elif settings.startup_mode == "background":
+        warmup.start()
+    # "lazy": the first request that needs the services builds them
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    # Don't build services just to close them
+    if get_job_queue.cache_info().currsize:
+        await get_job_queue().stop()
+    if get_async_session_service.cache_info().currsize:
+        await get_async_session_service().aclose()
+    if get_password_hasher.cache_info().currsize:
+        get_password_hasher().shutdown()
+
+async def prepare_turn(request: UserPrompt, prompt_time: datetime) -> tuple:
+    """
+    Store the prompt and load the chat history for the LLM, concurrently.
+    The prompt is saved up front so it survives a failed answer; messages
+    already folded into the session summary are skipped. Returns the
+    history and the stored prompt (see add_answer).
+    """
+    session_service = get_async_session_service()
+    prompt_doc = ChatSessionService.build_message(request.session_id, "user", request.prompt, prompt_time)
+    # One extra message in case the read already sees the new prompt
+    state, raw_messages, _ = await asyncio.gather(
+        session_service.get_session_summary(request.session_id),
+        session_service.get_recent_messages(request.session_id, settings.history_max_messages + 1),
+        session_service.store_messages([prompt_doc]),
+    )
+    summary_until = state["summary_until"]
+    raw_messages = [
+        msg for msg in raw_messages
+        if msg["message_id"] != prompt_doc["message_id"]
+        and (summary_until is None or msg["timestamp"] > summary_until)
+    ][-settings.history_max_messages:]
+    return get_rag_service().build_chat_history(raw_messages, state["summary"]), prompt_doc
+
+async def active_session_owner(session_id: str) -> str:
+    """
+    Owner of the session a prompt goes to (also the fairness key for LLM
+    admission); 404 for unknown, deleted or replaced guest sessions
+    """
+    owner = await get_async_session_service().get_session_owner(session_id)
+    if owner is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return owner
+
+def admission_error(e: AdmissionRejected) -> HTTPException:
+    return HTTPException(
+        status_code=e.status_code, detail=e.detail, headers={"Retry-After": str(e.retry_after)}
+    )
+
+def sse_event(data: dict, event: str = None) -> str:
+    """Format a Server-Sent Events frame"""
+    frame = f"event: {event}\n" if event else ""
+    return frame + f"data: {json.dumps(data)}\n\n"
 
 @app.get("/")
 async def root():
     return {"message": "RAG Chatbot API", "status": "healthy"}
 
 @app.post("/api/chat/prompt")
-async def make_prompt(request: UserPrompt):
+async def make_prompt(request: UserPrompt, background_tasks: BackgroundTasks):
+    owner = await active_session_owner(request.session_id)
     try:
-        print("What is wrong here")
+        prompt_time = datetime.utcnow()
         rag_service = get_rag_service()
-        session_service = get_session_service()
-        session_service.add_message(request.session_id, "user", request.prompt)
-        
-        raw_messages = session_service.get_session_messages(request.session_id)
-        langchain_messages = []
-        for msg in raw_messages:
-            if msg["type"] == "user":
-                langchain_messages.append(HumanMessage(content=msg["content"]))
-            elif msg["type"] == "ai":
-                langchain_messages.append(AIMessage(content=msg["content"]))
-        response = rag_service.get_response(request.prompt, langchain_messages)
-        session_service.add_message(request.session_id, "ai", response["answer"])
-        # print("Messages in the database:", session_service.get_session_messages(dummy_session_id))
+        session_service = get_async_session_service()
+        async with get_admission_controller().slot(owner):
+            langchain_messages, prompt_doc = await prepare_turn(request, prompt_time)
+            response = await rag_service.aget_response(request.prompt, langchain_messages)
+        await session_service.add_answer(prompt_doc, response["answer"])
+        # Summarize older turns after the response has been sent
+        background_tasks.add_task(rag_service.acompact_session, request.session_id, session_service)
        
         return {
             "userPrompt": request.prompt,
             "llm_response": response["answer"]
         }
+    except AdmissionRejected as e:
+        raise admission_error(e)
+    except UpstreamUnavailable as e:
+        logger.warning(f"Upstream unavailable: {e}")
+        raise HTTPException(
+            status_code=503, detail="The assistant is temporarily unavailable",
+            headers={"Retry-After": str(e.retry_after)},
+        )
     except Exception as e:
         logger.error(f"Error processing prompt: {e}")
         raise HTTPException(status_code=500, detail="Error processing your request")
 
+@app.post("/api/chat/prompt/stream")
+async def stream_prompt(request: UserPrompt):
+    """
+    Same as /api/chat/prompt but streams the answer as Server-Sent Events:
+    one `data: {"token": ...}` frame per chunk, then an `event: done` frame
+    carrying the full answer (or `event: error`).
+    """
+    prompt_time = datetime.utcnow()
+    owner = await active_session_owner(request.session_id)
+    admission = get_admission_controller()
+    try:
+        await admission.acquire(owner)
+    except AdmissionRejected as e:
+        raise admission_error(e)
+    # The slot is held until the stream ends (or the client goes away)
+    slot_start = time.perf_counter()
+    released = False
+
+    def release_slot():
+        nonlocal released
+        if not released:
+            released = True
+            admission.release(time.perf_counter() - slot_start)
+
+    try:
+        rag_service = get_rag_service()
+        session_service = get_async_session_service()
+        langchain_messages, prompt_doc = await prepare_turn(request, prompt_time)
+    except Exception as e:
+        release_slot()
+        logger.error(f"Error preparing streamed prompt: {e}")
+        raise HTTPException(status_code=500, detail="Error processing your request")
+
+    saved = False
+
+    async def event_stream():
+        nonlocal saved
+        tokens = []
+        stream = rag_service.astream_response(request.prompt, langchain_messages)
+        try:
+            async for token in stream:
+                tokens.append(token)
+                yield sse_event({"token": token})
+
+            release_slot()
+            answer = "".join(tokens)
+            await session_service.add_answer(prompt_doc, answer)
+            saved = True
+            yield sse_event({"userPrompt": request.prompt, "llm_response": answer}, event="done")
+        except UpstreamUnavailable as e:
+            logger.warning(f"Upstream unavailable mid-stream: {e}")
+            yield sse_event(
+                {"detail": "The assistant is temporarily unavailable", "retry_after": e.retry_after}, event="error"
+            )
+        except Exception as e:
+            logger.error(f"Error streaming prompt: {e}")
+            yield sse_event({"detail": "Error processing your request"}, event="error")
+        finally:
+            # On client disconnect Starlette cancels this generator; closing the
+            # RAG stream here stops the Gemini request instead of leaking it
+            await stream.aclose()
+            release_slot()
+
+    async def compact_if_saved():
+        # Nothing new to fold after an error or a disconnect
+        if saved:
+            await rag_service.acompact_session(request.session_id, session_service)
+
+    body = event_stream()
+    # A client that disconnects before the body starts never runs the
+    # generator's finally; release the slot when the generator is dropped
+    weakref.finalize(body, release_slot)
+    return StreamingResponse(
+        body,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(compact_if_saved),
+    )
+
 @app.get("/api/chat/messages/{session_id}")
-async def get_session_messages(session_id: str, limit: int = 50):
-    """Get messages for a session with optional limit"""
+async def get_session_messages(session_id: str, limit: int = Query(50, ge=1, le=200), before: str = None, after: str = None, latest: bool = False):
+    """
+    Get a page of messages for a session, oldest first. Without cursors this
+    is the first page (or the last one with `latest`); pass `prev_cursor` as
+    `before` to load older messages, `next_cursor` as `after` for newer ones.
+    """
     try:
-        session_service = get_session_service()
-        messages = session_service.get_session_messages(session_id, limit)
+        session_service = get_async_session_service()
+        # One extra row tells whether another page exists in that direction
+        messages = await session_service.get_session_messages(session_id, limit + 1, before, after, latest)
+        backwards = latest or before is not None
+        has_more = len(messages) > limit
+        if has_more:
+            messages = messages[1:] if backwards else messages[:limit]
         
         # Convert LangChain messages back to JSON format for frontend
         message_data = [
@@ -100,26 +295,36 @@ async def get_session_messages(session_id: str, limit: int = 50):
             }
             for msg in messages
         ]
-        
-        print("Returning the following message_data: ", message_data)
         return {
             "session_id": session_id,
             "messages": message_data,
-            "count": len(message_data)
+            "count": len(message_data),
+            "has_more": has_more,
+            "prev_cursor": encode_cursor(messages[0]["timestamp"], messages[0]["message_id"]) if messages else None,
+            "next_cursor": encode_cursor(messages[-1]["timestamp"], messages[-1]["message_id"]) if messages else None,
         }
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error getting messages: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/users/{user_id}/sessions")
-async def get_user_sessions(user_id: str, limit: int = 10):
-    """Get all chat sessions for a user"""
-    print("Did I even make it here?")
+async def get_user_sessions(user_id: str, limit: int = Query(10, ge=1, le=200), before: str = None):
+    """Get a page of a user's chat sessions, newest first; pass `next_cursor` as `before` for the next page"""
     try:
-        session_service = get_session_service()
-        sessions = session_service.get_user_sessions(user_id, limit)
+        session_service = get_async_session_service()
+        sessions = await session_service.get_user_sessions(user_id, limit + 1, before)
+        has_more = len(sessions) > limit
+        sessions = sessions[:limit]
         
-        return {"sessions": sessions}
+        return {
+            "sessions": sessions,
+            "has_more": has_more,
+            "next_cursor": sessions[-1]["cursor"] if has_more else None,
+        }
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -127,8 +332,15 @@ async def get_user_sessions(user_id: str, limit: int = 10):
 async def create_new_session(request: CreateSessionRequest):
     """Create new session - smart logic for anonymous vs registered users"""
     try:
-        session_service = get_session_service()
-        session_id = session_service.create_session_smart(request.user_id)
+        session_service = get_async_session_service()
+        if request.user_id.startswith("anon_"):
+            # Guests keep one session: it moves to a fresh id in one update and
+            # the old id's messages are purged in the background
+            session_id, previous_id = await session_service.rotate_anonymous_session(request.user_id)
+            if previous_id:
+                await enqueue_purge(previous_id)
+        else:
+            session_id = await session_service.create_session(request.user_id)
         
         return {"session_id": session_id}
     except Exception as e:
@@ -136,31 +348,53 @@ async def create_new_session(request: CreateSessionRequest):
 
 @app.delete("/api/sessions/{session_id}")
 async def delete_session(session_id: str):
-    """Delete a chat session"""
+    """Delete a chat session: hidden at once, messages purged by a background job"""
     try:
-        session_service = get_session_service()
-        session_service.delete_session(session_id)
-        return {"message": "Session deleted"}
+        session_service = get_async_session_service()
+        job_id = None
+        if await session_service.deactivate_session(session_id):
+            job_id = await enqueue_purge(session_id)
+        return {"message": "Session deleted", "job_id": job_id}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+async def enqueue_purge(session_id: str) -> str:
+    return await get_job_queue().enqueue(
+        "purge_session", {"session_id": session_id}, dedupe_key=f"purge_session:{session_id}"
+    )
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Status, attempts and progress of a background job"""
+    job = await get_job_queue().aget_status(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
     
+@app.get("/metrics")
+async def metrics():
+    """Prometheus scrape endpoint"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
 @app.get("/health")
 async def health_check():
+    """Liveness: the process serves requests, whether or not services are built yet"""
     return {"status": "healthy", "message": "Service is running"}
 
+@app.get("/health/ready")
+async def readiness_check():
+    """Readiness: 200 once the services are built, 503 (with progress) until then"""
+    status = warmup.status()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
 
-## AUTHENTICATION SERVICES ##
 
-# Initialize auth service
-def get_auth_service():
-    session_service = get_session_service()
-    return AuthService(session_service, session_service.users)
+## AUTHENTICATION SERVICES ##
 
 @app.post("/api/auth/register")
 async def register(user_data: UserCreate, response: Response, anonymous_user_id: str = None):
     try:
         auth_service = get_auth_service()
-        result = auth_service.register_user(user_data, anonymous_user_id)
+        result = await auth_service.aregister_user(user_data, anonymous_user_id)
         
         # Set JWT in httpOnly cookie
         response.set_cookie(
@@ -180,12 +414,14 @@ async def register(user_data: UserCreate, response: Response, anonymous_user_id:
         }
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
+    except AdmissionRejected as e:
+        raise admission_error(e)
 
 @app.post("/api/auth/login")
 async def login(login_data: UserLogin, response: Response):
     try:
         auth_service = get_auth_service()
-        result = auth_service.login_user(login_data)
+        result = await auth_service.alogin_user(login_data)
         
         # Set JWT in httpOnly cookie
         response.set_cookie(
@@ -205,6 +441,8 @@ async def login(login_data: UserLogin, response: Response):
         }
     except ValueError as e:
         raise HTTPException(status_code=401, detail=str(e))
+    except AdmissionRejected as e:
+        raise admission_error(e)
 
 @app.post("/api/auth/logout")
 async def logout(response: Response):
@@ -222,7 +460,7 @@ async def get_current_user(auth_token: str = Cookie(None)):
     if not payload:
         raise HTTPException(status_code=401, detail="Invalid token")
     
-    user = auth_service.users.find_one({"user_id": payload["user_id"]})
+    user = await auth_service.aget_user_profile(payload["user_id"])
     if not user:
         raise HTTPException(status_code=401, detail="User not found")
     
@@ -0,0 +1,287 @@
+# message_stores.py
+# Storage layouts for chat messages, used by ChatSessionService
+#
+#   python message_stores.py migrate            # copy messages into buckets
+#   python message_stores.py migrate --verify   # ...and compare per-session counts
+import argparse
+
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from pagination import in_keyset_range, keyset_filter
+
+# Fields kept per embedded message (the bucket holds the session_id)
+MESSAGE_FIELDS = ("message_id", "type", "content", "timestamp")
+MESSAGE_PROJECTION = {"_id": 0, "message_id": 1, "type": 1, "content": 1, "timestamp": 1}
+DUPLICATE_KEY = 11000
+
+
+def _position(message: dict) -> tuple:
+    return message["timestamp"], message["message_id"]
+
+
+def _message(doc: dict) -> dict:
+    return {field: doc[field] for field in MESSAGE_FIELDS if field in doc}
+
+
+class DocumentMessageStore:
+    """One document per message in `messages` (the original layout)"""
+    def __init__(self, collection):
+        self.collection = collection
+
+    def create_indexes(self):
+        # message_id breaks timestamp ties, so keyset pages never skip or repeat rows
+        self.collection.create_index(
+            [("session_id", ASCENDING), ("timestamp", ASCENDING), ("message_id", ASCENDING)]
+        )
+
+    def insert(self, docs: list) -> list:
+        """
+        Insert messages; ones already stored (same _id) are skipped, so retries
+        are safe. Returns the docs that were actually inserted.
+        """
+        try:
+            self.collection.insert_many([{"_id": doc["message_id"], **doc} for doc in docs], ordered=False)
+        except BulkWriteError as e:
+            if any(error["code"] != DUPLICATE_KEY for error in e.details["writeErrors"]):
+                raise
+            skipped = {error["index"] for error in e.details["writeErrors"]}
+            return [doc for i, doc in enumerate(docs) if i not in skipped]
+        return docs
+
+    def page(self, session_id: str, limit: int, before: tuple = None, after: tuple = None, newest: bool = False) -> list:
+        """
+        Up to `limit` messages strictly between the (timestamp, message_id)
+        positions `after` and `before`, oldest first. With `before` or
+        `newest`, the page ends at the newest such message instead of
+        starting at the oldest. Walks the index; no skip.
+        """
+        query = {"session_id": session_id}
+        bounds = []
+        if after is not None:
+            bounds.append(keyset_filter("timestamp", "message_id", after, "$gt"))
+        if before is not None:
+            bounds.append(keyset_filter("timestamp", "message_id", before, "$lt"))
+        if bounds:
+            query["$and"] = bounds
+        direction = DESCENDING if newest or before is not None else ASCENDING
+        cursor = self.collection.find(query, MESSAGE_PROJECTION).sort(
+            [("timestamp", direction), ("message_id", direction)]
+        ).limit(limit)
+        messages = list(cursor)
+        if direction == DESCENDING:
+            messages.reverse()
+        return messages
+
+    def after(self, session_id: str, after, limit: int) -> list:
+        query = {"session_id": session_id}
+        if after is not None:
+            query["timestamp"] = {"$gt": after}
+        return list(self.collection.find(query, MESSAGE_PROJECTION).sort(
+            [("timestamp", ASCENDING), ("message_id", ASCENDING)]
+        ).limit(limit))
+
+    def delete_session(self, session_id: str) -> int:
+        return self.collection.delete_many({"session_id": session_id}).deleted_count
+
+    def delete_batch(self, session_id: str, limit: int) -> int:
+        """Delete up to `limit` of a session's messages; 0 once none are left"""
+        ids = [doc["_id"] for doc in self.collection.find({"session_id": session_id}, {"_id": 1}).limit(limit)]
+        if not ids:
+            return 0
+        return self.collection.delete_many({"_id": {"$in": ids}}).deleted_count
+
+    def iter_sessions(self):
+        """(session_id, messages oldest first) for every session, used by the migration"""
+        for session_id in self.collection.distinct("session_id"):
+            yield session_id, list(self.collection.find({"session_id": session_id}).sort(
+                [("timestamp", ASCENDING), ("message_id", ASCENDING)]
+            ))
+
+
+class BucketMessageStore:
+    """
+    Bucket pattern: each document in `message_buckets` holds up to
+    `bucket_size` consecutive messages of one session in an embedded array,
+    with the time range it covers. Recent history is the newest one or two
+    buckets instead of one document per message.
+
+    Appends go to the session's open (not full) bucket, or upsert a new one.
+    A unique index on the embedded message ids makes retried writes no-ops.
+    """
+    def __init__(self, collection, bucket_size: int = 50):
+        self.collection = collection
+        self.bucket_size = bucket_size
+
+    def create_indexes(self):
+        # Oldest-first pages walk start_ts, newest-first pages walk end_ts
+        self.collection.create_index([("session_id", ASCENDING), ("start_ts", DESCENDING)])
+        self.collection.create_index([("session_id", ASCENDING), ("end_ts", DESCENDING)])
+        self.collection.create_index("messages.message_id", unique=True, sparse=True)
+
+    def insert(self, docs: list) -> list:
+        """Same contract as DocumentMessageStore.insert"""
+        by_session = {}
+        for doc in docs:
+            by_session.setdefault(doc["session_id"], []).append(_message(doc))
+        inserted = set()
+        for session_id, messages in by_session.items():
+            for start in range(0, len(messages), self.bucket_size):
+                inserted.update(self._append(session_id, messages[start:start + self.bucket_size]))
+        return [doc for doc in docs if doc["message_id"] in inserted]
+
+    def _append(self, session_id: str, messages: list) -> list:
+        """Ids of the messages appended (none of those already stored)"""
+        ids = [message["message_id"] for message in messages]
+        try:
+            self.collection.update_one(
+                {
+                    "session_id": session_id,
+                    "count": {"$lte": self.bucket_size - len(messages)},
+                    "messages.message_id": {"$nin": ids},
+                },
+                {
+                    "$push": {"messages": {"$each": messages}},
+                    "$inc": {"count": len(messages)},
+                    "$min": {"start_ts": messages[0]["timestamp"]},
+                    "$max": {"end_ts": messages[-1]["timestamp"]},
+                },
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            # Some were written by an earlier attempt: append the rest one by one
+            if len(messages) == 1:
+                return []
+            return [message_id for message in messages for message_id in self._append(session_id, [message])]
+        return ids
+
+    def _read(self, query: dict, keep, limit: int, descending: bool) -> list:
+        """
+        The first (or with `descending`, last) `limit` messages passing `keep`
+        in buckets matching `query`, oldest first. Buckets can overlap in
+        time (an append that doesn't fit the open bucket starts a new one, and
+        the next may still land in the old one), so reading stops only when
+        the next bucket lies strictly past the page's boundary message.
+        """
+        messages = []
+        edge = "end_ts" if descending else "start_ts"
+        cursor = self.collection.find(
+            query, {"_id": 0, "messages": 1, "start_ts": 1, "end_ts": 1}
+        ).sort(edge, DESCENDING if descending else ASCENDING).batch_size(2)
+        for bucket in cursor:
+            if len(messages) >= limit:
+                messages.sort(key=_position)
+                messages = messages[-limit:] if descending else messages[:limit]
+                boundary = messages[0 if descending else -1]["timestamp"]
+                if (bucket[edge] < boundary) if descending else (bucket[edge] > boundary):
+                    break
+            messages.extend(message for message in bucket["messages"] if keep(message))
+        messages.sort(key=_position)
+        return messages[-limit:] if descending else messages[:limit]
+
+    def page(self, session_id: str, limit: int, before: tuple = None, after: tuple = None, newest: bool = False) -> list:
+        """Same contract as DocumentMessageStore.page"""
+        query = {"session_id": session_id}
+        if after is not None:
+            query["end_ts"] = {"$gte": after[0]}
+        if before is not None:
+            query["start_ts"] = {"$lte": before[0]}
+        return self._read(
+            query,
+            lambda message: in_keyset_range(message["timestamp"], message["message_id"], before, after),
+            limit,
+            descending=newest or before is not None,
+        )
+
+    def after(self, session_id: str, after, limit: int) -> list:
+        query = {"session_id": session_id}
+        if after is not None:
+            query["end_ts"] = {"$gt": after}
+        return self._read(
+            query, lambda message: after is None or message["timestamp"] > after, limit, descending=False
+        )
+
+    def count(self, session_id: str) -> int:
+        return sum(bucket["count"] for bucket in self.collection.find({"session_id": session_id}, {"count": 1}))
+
+    def delete_session(self, session_id: str) -> int:
+        deleted = self.count(session_id)
+        self.collection.delete_many({"session_id": session_id})
+        return deleted
+
+    def delete_batch(self, session_id: str, limit: int) -> int:
+        """Delete whole buckets holding up to about `limit` messages; 0 once none are left"""
+        buckets = list(self.collection.find({"session_id": session_id}, {"_id": 1, "count": 1}).limit(
+            max(1, limit // self.bucket_size)
+        ))
+        if not buckets:
+            return 0
+        self.collection.delete_many({"_id": {"$in": [bucket["_id"] for bucket in buckets]}})
+        return sum(bucket["count"] for bucket in buckets)
+
+    def replace_session(self, session_id: str, messages: list):
+        """Rewrite a session's buckets from its messages (oldest first); used by the migration"""
+        self.collection.delete_many({"session_id": session_id})
+        buckets = []
+        for start in range(0, len(messages), self.bucket_size):
+            chunk = [_message(message) for message in messages[start:start + self.bucket_size]]
+            buckets.append({
+                "session_id": session_id,
+                "count": len(chunk),
+                "start_ts": chunk[0]["timestamp"],
+                "end_ts": chunk[-1]["timestamp"],
+                "messages": chunk,
+            })
+        if buckets:
+            self.collection.insert_many(buckets)
+
+
+def make_message_store(db, layout: str, bucket_size: int = 50):
+    if layout == "bucket":
+        return BucketMessageStore(db.message_buckets, bucket_size)
+    return DocumentMessageStore(db.messages)
+
+
+def migrate(db, bucket_size: int, verify: bool = False) -> dict:
+    """
+    Copy every session from `messages` into `message_buckets`. Each session's
+    buckets are rebuilt from scratch, so the migration can be re-run; messages
+    written to the old layout meanwhile are picked up by the next run.
+    """
+    source = DocumentMessageStore(db.messages)
+    target = BucketMessageStore(db.message_buckets, bucket_size)
+    target.create_indexes()
+    stats = {"sessions": 0, "messages": 0, "mismatched": 0}
+    for session_id, messages in source.iter_sessions():
+        target.replace_session(session_id, messages)
+        stats["sessions"] += 1
+        stats["messages"] += len(messages)
+        if verify and target.count(session_id) != len(messages):
+            stats["mismatched"] += 1
+            print(f"Count mismatch for session {session_id}")
+    return stats
+
+
+def main():
+    from config import get_settings
+    from pymongo import MongoClient
+    settings = get_settings()
+
+    parser = argparse.ArgumentParser(description="Manage the chat message storage layout")
+    commands = parser.add_subparsers(dest="command", required=True)
+    migrate_parser = commands.add_parser("migrate", help="Copy messages into the bucket layout")
+    migrate_parser.add_argument("--bucket-size", type=int, default=settings.message_bucket_size)
+    migrate_parser.add_argument("--verify", action="store_true", help="compare message counts per session")
+    args = parser.parse_args()
+
+    db = MongoClient(settings.mongodb_uri).chatbot_db
+    if args.command == "migrate":
+        stats = migrate(db, args.bucket_size, args.verify)
+        print(f"Migrated {stats['messages']} messages of {stats['sessions']} sessions")
+        if stats["mismatched"]:
+            print(f"{stats['mismatched']} sessions did not verify")
+        print("Set MESSAGE_STORAGE=bucket and restart to read and write buckets")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+# pagination.py
+# Opaque keyset cursors over (timestamp, id) pairs
+import base64
+from datetime import datetime, timedelta
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def encode_cursor(timestamp: datetime, key: str) -> str:
+    """Cursor for a row; Mongo keeps milliseconds, so that's the precision encoded"""
+    millis = (timestamp - EPOCH) // timedelta(milliseconds=1)
+    return base64.urlsafe_b64encode(f"{millis}|{key}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """(timestamp, key) of a cursor; ValueError if it is malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        millis, key = raw.split("|", 1)
+        return EPOCH + timedelta(milliseconds=int(millis)), key
+    except Exception as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def keyset_filter(time_field: str, key_field: str, position: tuple, op: str) -> dict:
+    """Rows strictly after ("$gt") or before ("$lt") `position` in (time, key) order"""
+    timestamp, key = position
+    return {"$or": [
+        {time_field: {op: timestamp}},
+        {time_field: timestamp, key_field: {op: key}},
+    ]}
+
+
+def in_keyset_range(timestamp: datetime, key: str, before: tuple = None, after: tuple = None) -> bool:
+    """Same test as keyset_filter, for rows already in memory"""
+    position = (timestamp, key)
+    return (before is None or position < before) and (after is None or position > after)
@@ -0,0 +1,135 @@
+# password_hashing.py
+# bcrypt on its own bounded pool, so sign-in bursts don't stall the event loop or the Mongo threads
+import asyncio
+import contextvars
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache, partial
+
+from passlib.context import CryptContext
+from passlib.hash import bcrypt as bcrypt_handler
+
+from admission import AdmissionRejected
+from config import get_settings
+from metrics import Counter, Gauge, Histogram
+
+HASH_SECONDS = Histogram("password_hash_seconds", "Time spent in bcrypt", ("op",))
+HASH_QUEUE_WAIT_SECONDS = Histogram("password_hash_queue_wait_seconds", "Time password checks waited for a hashing worker")
+HASH_IN_FLIGHT = Gauge("password_hash_in_flight", "bcrypt operations currently running")
+HASH_QUEUE_DEPTH = Gauge("password_hash_queue_depth", "Password checks waiting for a hashing worker")
+HASH_REJECTED = Counter("password_hash_rejected_total", "Password checks rejected because the hashing queue was full")
+logger = logging.getLogger(__name__)
+
+REHASHED = Counter("password_rehashed_total", "Password hashes upgraded to the current work factor on login")
+
+
+@lru_cache()
+def crypt_context(rounds: int) -> CryptContext:
+    """bcrypt context with the given work factor; older hashes report needs_update"""
+    return CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=rounds)
+
+
+def bcrypt_releases_gil() -> bool:
+    """
+    True when passlib uses the `bcrypt` package, whose C code releases the
+    GIL. Its fallbacks (os_crypt, the pure-Python builtin) hold it, so hashing
+    on a thread would stall the event loop.
+    """
+    return bcrypt_handler.get_backend() == "bcrypt"
+
+
+# Module-level so they can run in a process pool
+def _hash(rounds: int, password: str) -> str:
+    return crypt_context(rounds).hash(password)
+
+
+def _verify_and_rehash(rounds: int, password: str, hashed: str) -> tuple:
+    """(matches, new hash if the stored one uses an outdated work factor, else None)"""
+    context = crypt_context(rounds)
+    if not context.verify(password, hashed):
+        return False, None
+    if context.needs_update(hashed):
+        return True, context.hash(password)
+    return True, None
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt on `workers` dedicated threads or processes. Threads need
+    the `bcrypt` backend, which releases the GIL; with any other backend the
+    thread executor falls back to processes. At most `workers` hashes run at
+    once; up to `max_queue` more wait, and beyond that callers get a 503
+    with Retry-After instead of piling up behind a login burst.
+    """
+    def __init__(self, rounds: int = 12, workers: int = 2, max_queue: int = 32, executor: str = "thread"):
+        self.rounds = rounds
+        self.workers = workers
+        self.max_queue = max_queue
+        if executor == "thread" and not bcrypt_releases_gil():
+            logger.warning(
+                f"bcrypt backend {bcrypt_handler.get_backend()!r} holds the GIL; hashing in processes instead. "
+                "Install the bcrypt package to hash on threads"
+            )
+            executor = "process"
+        self._processes = executor == "process"
+        executor_class = ProcessPoolExecutor if self._processes else ThreadPoolExecutor
+        self._executor = executor_class(max_workers=workers)
+        self._slots = None
+        self._queued = 0
+        self._avg_seconds = 0.25
+
+    async def _run(self, op: str, fn, *args):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.workers)
+        if self._slots.locked() and self._queued >= self.max_queue:
+            HASH_REJECTED.inc()
+            waves = (self._queued + 1) / self.workers
+            raise AdmissionRejected(503, "Too many sign-ins right now, please retry shortly",
+                                    max(1, round(waves * self._avg_seconds)))
+        self._queued += 1
+        HASH_QUEUE_DEPTH.set(self._queued)
+        start = time.perf_counter()
+        try:
+            await self._slots.acquire()
+        finally:
+            self._queued -= 1
+            HASH_QUEUE_DEPTH.set(self._queued)
+            HASH_QUEUE_WAIT_SECONDS.observe(time.perf_counter() - start)
+        HASH_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            call = partial(fn, self.rounds, *args)
+            if not self._processes:
+                # Keep the request's context (stage timings) on the hashing thread
+                call = partial(contextvars.copy_context().run, call)
+            return await asyncio.get_running_loop().run_in_executor(self._executor, call)
+        finally:
+            elapsed = time.perf_counter() - start
+            self._avg_seconds = 0.9 * self._avg_seconds + 0.1 * elapsed
+            HASH_SECONDS.observe(elapsed, op=op)
+            HASH_IN_FLIGHT.dec()
+            self._slots.release()
+
+    async def hash(self, password: str) -> str:
+        return await self._run("hash", _hash, password)
+
+    async def verify_and_rehash(self, password: str, hashed: str) -> tuple:
+        ok, new_hash = await self._run("verify", _verify_and_rehash, password, hashed)
+        if new_hash:
+            REHASHED.inc()
+        return ok, new_hash
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+@lru_cache()
+def get_password_hasher() -> PasswordHasher:
+    settings = get_settings()
+    return PasswordHasher(
+        settings.password_bcrypt_rounds,
+        settings.password_hash_workers,
+        settings.password_hash_max_queue,
+        settings.password_hash_executor,
+    )
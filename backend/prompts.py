@@ -0,0 +1,10 @@
+# prompts.py
+# Local copy of the "langchain-ai/retrieval-qa-chat" hub prompt, so the
+# chain can be built without a network call
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+
+RETRIEVAL_QA_CHAT_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", "Answer any use questions based solely on the context below:\n\n<context>\n{context}\n</context>"),
+    MessagesPlaceholder(variable_name="chat_history", optional=True),
+    ("human", "{input}"),
+])
@@ -1,15 +1,36 @@
 # services.py
+import asyncio
+import logging
+import time
 from functools import lru_cache
 from typing import List
-from pinecone import Pinecone
-from langchain_pinecone import PineconeVectorStore
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain.chains import create_retrieval_chain
+# Pinecone, Gemini and hub clients are imported where they're built: they
+# are slow to import and unused when injected or configured away
 from langchain.chains.combine_documents import create_stuff_documents_chain
-from langchain import hub
 from langchain_core.embeddings import Embeddings
-from langchain_pinecone import PineconeEmbeddings
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.output_parsers import StrOutputParser
 from config import get_settings
+from embedding_batcher import BatchingEmbeddings
+from local_vector_store import LocalVectorStore
+from bm25_index import BM25Index, HybridRetriever
+from context_packer import ContextPackingRetriever
+from metrics import Counter, record_stage, stage_timer
+from resilience import ResilientEmbeddings, ResilientRetriever, Upstream, UpstreamUnavailable, with_deadline
+from cache_services import (
+    CachedEmbeddings,
+    CachedRetriever,
+    MongoCacheStore,
+    SemanticCache,
+    TTLLRUCache,
+    documents_size,
+    history_key,
+)
+from text_utils import estimate_tokens
+from prompts import RETRIEVAL_QA_CHAT_PROMPT
+
+logger = logging.getLogger(__name__)
 
 
 # Custom Pinecone Embeddings class
@@ -35,58 +56,518 @@ from config import get_settings
 #         return response.data[0].values
 
 
+SUMMARY_PROMPT = ChatPromptTemplate.from_messages([
+    ("system",
+     "You maintain a running summary of a customer service conversation. "
+     "Update the summary with the new messages. Keep facts, user details, "
+     "open questions and answers already given. Reply with the summary only."),
+    ("human", "Current summary:\n{summary}\n\nNew messages:\n{transcript}"),
+])
+
+FALLBACKS = Counter("chat_fallback_total", "Degraded answers served while an upstream was unavailable", ("kind",))
+
+
+def retrieval_only_answer(context: list, max_passages: int = 3) -> str:
+    passages = "\n\n".join(f"- {doc.page_content.strip()[:500]}" for doc in context[:max_passages])
+    return (
+        "I can't generate a full answer right now. These passages from the "
+        f"knowledge base look relevant to your question:\n\n{passages}"
+    )
+
+
 class RAGService:
-    def __init__(self):
+    def __init__(self, llm=None, embeddings: Embeddings = None, prompt=None):
+        """
+        llm / embeddings / prompt replace Gemini, Pinecone inference and the
+        configured prompt when given (used by the offline benchmarks)
+        """
         self.settings = get_settings()
-        self._initialize_components()
+        self._compacting = set()
+        self._initialize_components(llm, embeddings, prompt)
         
-    def _initialize_components(self):
-        # Initialize Pinecone
-        self.pc = Pinecone(
-            api_key=self.settings.pinecone_api_key
+    def _initialize_components(self, llm=None, embeddings=None, prompt=None):
+        # One call policy (deadline, retries, circuit breaker) per upstream;
+        # the LLM isn't retried here, the Gemini client already retries
+        policy = dict(
+            base_delay=self.settings.upstream_retry_base_delay,
+            failure_threshold=self.settings.circuit_failure_threshold,
+            reset_timeout=self.settings.circuit_reset_seconds,
         )
+        self.upstreams = {
+            "embedding": Upstream("embedding", self.settings.embedding_timeout_seconds,
+                                  self.settings.upstream_retries, **policy),
+            "vector_search": Upstream("vector_search", self.settings.vector_search_timeout_seconds,
+                                      self.settings.upstream_retries, **policy),
+            "llm": Upstream("llm", self.settings.llm_timeout_seconds, 0, **policy),
+        }
+
+        # Initialize Pinecone
+        self.pc = None
+        if embeddings is None:
+            from pinecone import Pinecone
+            self.pc = Pinecone(
+                api_key=self.settings.pinecone_api_key
+            )
                 
-        # Initialize embeddings with custom PineconeEmbeddings
-        self.embeddings = PineconeEmbeddings(
-            model=self.settings.embedding_model,
-            pinecone_api_key=self.settings.pinecone_api_key
+        # Shared second-level cache for workers, if configured
+        self.cache_store = None
+        if self.settings.cache_backend == "mongo":
+            from session_services import get_session_service
+            self.cache_store = MongoCacheStore(get_session_service().db.rag_cache)
+
+        # Initialize embeddings with custom PineconeEmbeddings, behind the query embedding cache
+        self.embedding_cache = TTLLRUCache(
+            max_entries=self.settings.embedding_cache_max_entries,
+            ttl_seconds=self.settings.embedding_cache_ttl_seconds,
+            max_bytes=self.settings.embedding_cache_max_mb * 1024 * 1024,
+            sizeof=lambda vector: vector.nbytes,
+        )
+        base_embeddings = embeddings
+        if base_embeddings is None:
+            from langchain_pinecone import PineconeEmbeddings
+            base_embeddings = PineconeEmbeddings(
+                model=self.settings.embedding_model,
+                pinecone_api_key=self.settings.pinecone_api_key
+            )
+            # Same parameters PineconeEmbeddings uses for queries, so batched
+            # vectors match unbatched ones
+            self.query_embed_params = dict(base_embeddings.query_params)
+        self.raw_embeddings = base_embeddings
+        embedding_upstream = self.upstreams["embedding"]
+        base_embeddings = ResilientEmbeddings(base_embeddings, embedding_upstream)
+        if self.settings.embedding_batch_enabled:
+            base_embeddings = BatchingEmbeddings(
+                base_embeddings,
+                embed_batch=lambda texts: embedding_upstream.call_sync(self._embed_query_batch, texts),
+                max_batch_size=self.settings.embedding_batch_max_size,
+                max_wait_ms=self.settings.embedding_batch_wait_ms,
+            )
+        self.embeddings = CachedEmbeddings(
+            base_embeddings,
+            cache=self.embedding_cache,
+            namespace=self.settings.embedding_model,
+            store=self.cache_store,
         )
                 
         # Initialize vector store
-        self.docsearch = PineconeVectorStore(
-            embedding=self.embeddings,
-            index_name=self.settings.pinecone_index_name,
-            pinecone_api_key=self.settings.pinecone_api_key,
-            text_key="text"
-        )
+        if self.settings.vector_store_backend == "local":
+            self.docsearch = _preloaded.get("local_index")
+            if self.docsearch is None:
+                self.docsearch = LocalVectorStore(
+                    self.settings.local_index_path,
+                    embedding=self.embeddings,
+                    index_type=self.settings.local_index_type,
+                    nprobe=self.settings.ivf_nprobe,
+                )
+            else:
+                self.docsearch.embeddings = self.embeddings
+        else:
+            from langchain_pinecone import PineconeVectorStore
+            self.docsearch = PineconeVectorStore(
+                embedding=self.embeddings,
+                index_name=self.settings.pinecone_index_name,
+                pinecone_api_key=self.settings.pinecone_api_key,
+                text_key="text"
+            )
                 
-        # Initialize retriever
-        self.retriever = self.docsearch.as_retriever()
+        # Initialize retriever, behind the retrieved-documents cache
+        self.retrieval_cache = TTLLRUCache(
+            max_entries=self.settings.retrieval_cache_max_entries,
+            ttl_seconds=self.settings.retrieval_cache_ttl_seconds,
+            max_bytes=self.settings.retrieval_cache_max_mb * 1024 * 1024,
+            sizeof=documents_size,
+        )
+        # Over-fetch when the context packer gets to choose among the candidates
+        fetch_k = self.settings.retriever_k
+        if self.settings.context_packing_enabled:
+            fetch_k = max(self.settings.context_fetch_k, self.settings.retriever_k)
+        if self.settings.retriever_mode == "hybrid":
+            base_retriever = HybridRetriever(
+                vector_retriever=self.docsearch.as_retriever(
+                    search_kwargs={"k": self.settings.hybrid_candidates_k}
+                ),
+                bm25=_preloaded.get("bm25") or BM25Index.load(self.settings.bm25_index_path),
+                k=fetch_k,
+                candidates_k=self.settings.hybrid_candidates_k,
+                rrf_k=self.settings.rrf_k,
+            )
+        else:
+            base_retriever = self.docsearch.as_retriever(search_kwargs={"k": fetch_k})
+        # Retries only repeat the index query: the query embedding is cached by then
+        base_retriever = ResilientRetriever(retriever=base_retriever, upstream=self.upstreams["vector_search"])
+        if self.settings.context_packing_enabled:
+            base_retriever = ContextPackingRetriever(
+                retriever=base_retriever,
+                token_budget=self.settings.context_token_budget,
+                max_docs=self.settings.retriever_k,
+                dedupe_threshold=self.settings.context_dedupe_threshold,
+            )
+        # The local index records its own version on every write (ingest,
+        # snapshot); Pinecone re-indexing still needs VECTOR_INDEX_VERSION bumped
+        index_version = self.settings.vector_index_version
+        if isinstance(self.docsearch, LocalVectorStore):
+            index_version = f"{index_version}.{self.docsearch.version}"
+        self.retriever = CachedRetriever(
+            retriever=base_retriever,
+            cache=self.retrieval_cache,
+            store=self.cache_store,
+            k=self.settings.retriever_k,
+            index_version=(
+                f"{index_version}:{self.settings.retriever_mode}"
+                f":{self.settings.context_packing_enabled}"
+            ),
+        )
                 
         # Initialize LLM
-        self.llm = ChatGoogleGenerativeAI(
-            google_api_key=self.settings.google_api_key,
-            model=self.settings.llm_model,
-            temperature=self.settings.llm_temperature
-        )
+        self.llm = llm
+        if self.llm is None:
+            from langchain_google_genai import ChatGoogleGenerativeAI
+            self.llm = ChatGoogleGenerativeAI(
+                google_api_key=self.settings.google_api_key,
+                model=self.settings.llm_model,
+                temperature=self.settings.llm_temperature,
+                timeout=self.settings.llm_timeout_seconds,
+            )
                 
-        # Initialize chains
-        self.ret_qa_chat_prompt = hub.pull("langchain-ai/retrieval-qa-chat")
+        # Initialize chains; the prompt is the vendored copy unless prompt_source="hub"
+        self.ret_qa_chat_prompt = prompt
+        if self.ret_qa_chat_prompt is None:
+            if self.settings.prompt_source == "hub":
+                from langchain import hub
+                self.ret_qa_chat_prompt = hub.pull("langchain-ai/retrieval-qa-chat")
+            else:
+                self.ret_qa_chat_prompt = RETRIEVAL_QA_CHAT_PROMPT
         self.combined_chain = create_stuff_documents_chain(
             self.llm, self.ret_qa_chat_prompt
         )
-        self.retrieval_chain = create_retrieval_chain(
-            self.retriever, self.combined_chain
-        )
+        self.summary_chain = SUMMARY_PROMPT | self.llm | StrOutputParser()
+
+        # Semantic answer cache in front of retrieval and the LLM
+        self.answer_cache = None
+        if self.settings.semantic_cache_enabled:
+            self.answer_cache = SemanticCache(
+                max_entries=self.settings.semantic_cache_max_entries,
+                ttl_seconds=self.settings.semantic_cache_ttl_seconds,
+                threshold=self.settings.semantic_cache_threshold,
+            )
         
+    def _embed_query_batch(self, texts: List[str]) -> List[List[float]]:
+        """Embed several queries in one Pinecone inference call (query input type)"""
+        if self.pc is None:
+            # Injected embeddings: no batch query API, embed one by one
+            return [self.raw_embeddings.embed_query(text) for text in texts]
+        response = self.pc.inference.embed(
+            model=self.settings.embedding_model,
+            inputs=texts,
+            parameters=self.query_embed_params
+        )
+        return [item.values for item in response.data]
+
+    def build_chat_history(self, raw_messages: list, summary: str = None) -> list:
+        """
+        Turn stored messages (oldest first) into LangChain chat history,
+        keeping the newest ones that fit in the configured token budget.
+        A rolling summary of older turns, if any, goes first.
+        """
+        budget = self.settings.history_token_budget
+        if summary:
+            budget -= estimate_tokens(summary)
+        history = []
+        for msg in reversed(raw_messages[-self.settings.history_max_messages:]):
+            cost = estimate_tokens(msg["content"])
+            if cost > budget:
+                break
+            budget -= cost
+            if msg["type"] == "user":
+                history.append(HumanMessage(content=msg["content"]))
+            elif msg["type"] == "ai":
+                history.append(AIMessage(content=msg["content"]))
+        if summary:
+            history.append(SystemMessage(content=f"Summary of the earlier conversation:\n{summary}"))
+        history.reverse()
+        return history
+
+    async def asummarize(self, previous_summary: str, messages: list) -> str:
+        """Fold new messages into an existing summary"""
+        transcript = "\n".join(
+            f"{'User' if msg['type'] == 'user' else 'Assistant'}: {msg['content']}"
+            for msg in messages
+        )
+        return await self.upstreams["llm"].call(lambda: self.summary_chain.ainvoke({
+            "summary": previous_summary or "(none yet)",
+            "transcript": transcript,
+        }))
+
+    async def acompact_session(self, session_id: str, session_service) -> None:
+        """
+        Background compaction: once a session has more unsummarized messages
+        than fit in the history window, fold the older ones into the stored
+        summary so the prompt stays flat as the session grows.
+        Only the new messages are summarized, never the whole session.
+        """
+        if not self.settings.summary_enabled or session_id in self._compacting:
+            return
+        self._compacting.add(session_id)
+        try:
+            state = await session_service.get_session_summary(session_id)
+            pending = await session_service.get_messages_after(session_id, state["summary_until"])
+            if len(pending) <= self.settings.history_max_messages:
+                return
+
+            to_fold = pending[:len(pending) - self.settings.summary_keep_recent_messages]
+            with stage_timer("summary"):
+                summary = await self.asummarize(state["summary"], to_fold)
+            await session_service.update_session_summary(
+                session_id, summary, to_fold[-1]["timestamp"], state["summary_until"]
+            )
+        except Exception as e:
+            logger.error(f"Error compacting session {session_id}: {e}")
+        finally:
+            self._compacting.discard(session_id)
+
+    def _use_answer_cache(self, session_messages: list) -> bool:
+        """
+        Answers are only reused for the same history (see history_key); past
+        semantic_cache_max_history_messages an exact repeat is too unlikely
+        to be worth embedding the query for
+        """
+        return (
+            self.answer_cache is not None
+            and len(session_messages) <= self.settings.semantic_cache_max_history_messages
+        )
+
+    def cache_stats(self) -> dict:
+        stats = {
+            "answers": self.answer_cache.stats() if self.answer_cache else {},
+            "embeddings": self.embedding_cache.stats(),
+            "retrievals": self.retrieval_cache.stats(),
+        }
+        if isinstance(self.embeddings.embeddings, BatchingEmbeddings):
+            stats["embedding_batches"] = self.embeddings.embeddings.stats()
+        return stats
+
+    def _degraded_response(self, query_embedding, context: list, error: UpstreamUnavailable) -> dict:
+        """
+        Best-effort answer while the LLM (or retrieval) is unavailable: a cached
+        answer to a similar question, else the retrieved passages themselves
+        """
+        if not self.settings.llm_fallback_enabled:
+            raise error
+        if self.answer_cache is not None and query_embedding is not None:
+            # Best effort: a similar question asked with any history
+            cached = self.answer_cache.lookup(query_embedding, history=None)
+            if cached:
+                FALLBACKS.inc(kind="cached_answer")
+                return {**cached, "degraded": True}
+        if context:
+            FALLBACKS.inc(kind="retrieval_only")
+            return {"answer": retrieval_only_answer(context), "context": context, "degraded": True}
+        raise error
+
+    def _fallback(self, query: str, query_embedding, context: list, error: UpstreamUnavailable) -> dict:
+        if query_embedding is None and self.answer_cache is not None:
+            try:
+                # Usually an embedding-cache hit: retrieval embedded the same query
+                query_embedding = self.embeddings.embed_query(query)
+            except Exception:
+                pass
+        return self._degraded_response(query_embedding, context, error)
+
+    async def _afallback(self, query: str, query_embedding, context: list, error: UpstreamUnavailable) -> dict:
+        if query_embedding is None and self.answer_cache is not None:
+            try:
+                query_embedding = await with_deadline(
+                    self.embeddings.aembed_query(query), self.settings.embedding_timeout_seconds, "embedding"
+                )
+            except Exception:
+                pass
+        return self._degraded_response(query_embedding, context, error)
+
     def get_response(self, query: str, session_messages: list) -> dict:
         """Get response from RAG system"""
         try:
-            answer = self.retrieval_chain.invoke({"input": query, "chat_history": session_messages})
-            return {"answer": answer["answer"], "context": answer.get("context", [])}
+            query_embedding = None
+            use_cache = self._use_answer_cache(session_messages)
+            if use_cache:
+                with stage_timer("semantic_cache"):
+                    try:
+                        query_embedding = self.embeddings.embed_query(query)
+                    except UpstreamUnavailable:
+                        use_cache = False  # answer without the cache
+                    else:
+                        cached = self.answer_cache.lookup(query_embedding, history_key(session_messages))
+                        if cached:
+                            return cached
+
+            try:
+                with stage_timer("retrieval"):
+                    context = self.retriever.invoke(query)
+            except UpstreamUnavailable as e:
+                return self._fallback(query, query_embedding, [], e)
+            try:
+                with stage_timer("llm"):
+                    answer = self.upstreams["llm"].call_sync(
+                        self.combined_chain.invoke,
+                        {"input": query, "chat_history": session_messages, "context": context},
+                    )
+            except UpstreamUnavailable as e:
+                return self._fallback(query, query_embedding, context, e)
+            response = {"answer": answer, "context": context}
+            if use_cache:
+                self.answer_cache.store(query_embedding, query, response, history_key(session_messages))
+            return response
+        except UpstreamUnavailable:
+            raise
+        except Exception as e:
+            raise Exception(f"Error processing query: {str(e)}")
+
+    async def _alookup_answer_cache(self, query: str, session_messages: list):
+        """(query embedding, cached response); the embedding is None if it failed or timed out"""
+        with stage_timer("semantic_cache"):
+            try:
+                query_embedding = await with_deadline(
+                    self.embeddings.aembed_query(query), self.settings.embedding_timeout_seconds, "embedding"
+                )
+            except UpstreamUnavailable:
+                return None, None
+            return query_embedding, self.answer_cache.lookup(query_embedding, history_key(session_messages))
+
+    async def aget_response(self, query: str, session_messages: list) -> dict:
+        """Async variant of get_response, keeps the event loop free while Gemini answers"""
+        try:
+            query_embedding = None
+            use_cache = self._use_answer_cache(session_messages)
+            if use_cache:
+                query_embedding, cached = await self._alookup_answer_cache(query, session_messages)
+                if cached:
+                    return cached
+
+            # Retrieval, then the LLM, as separate steps so each stage is timed
+            try:
+                with stage_timer("retrieval"):
+                    context = await with_deadline(
+                        self.retriever.ainvoke(query), self.settings.retrieval_timeout_seconds, "retrieval"
+                    )
+            except UpstreamUnavailable as e:
+                return await self._afallback(query, query_embedding, [], e)
+            try:
+                with stage_timer("llm"):
+                    answer = await self.upstreams["llm"].call(lambda: self.combined_chain.ainvoke(
+                        {"input": query, "chat_history": session_messages, "context": context}
+                    ))
+            except UpstreamUnavailable as e:
+                return await self._afallback(query, query_embedding, context, e)
+            response = {"answer": answer, "context": context}
+            if use_cache and query_embedding is not None:
+                self.answer_cache.store(query_embedding, query, response, history_key(session_messages))
+            return response
+        except UpstreamUnavailable:
+            raise
         except Exception as e:
             raise Exception(f"Error processing query: {str(e)}")
 
+    async def astream_response(self, query: str, session_messages: list):
+        """
+        Yield answer tokens as Gemini produces them.
+        If the LLM fails before its first token, a degraded answer is yielded
+        instead; a failure mid-answer raises UpstreamUnavailable.
+        """
+        query_embedding = None
+        use_cache = self._use_answer_cache(session_messages)
+        if use_cache:
+            query_embedding, cached = await self._alookup_answer_cache(query, session_messages)
+            if cached:
+                yield cached["answer"]
+                return
+
+        try:
+            with stage_timer("retrieval"):
+                context = await with_deadline(
+                    self.retriever.ainvoke(query), self.settings.retrieval_timeout_seconds, "retrieval"
+                )
+        except UpstreamUnavailable as e:
+            yield (await self._afallback(query, query_embedding, [], e))["answer"]
+            return
+
+        breaker = self.upstreams["llm"].breaker
+        try:
+            breaker.before_call()
+        except UpstreamUnavailable as e:
+            yield (await self._afallback(query, query_embedding, context, e))["answer"]
+            return
+
+        tokens = []
+        failure = None
+        started = time.perf_counter()
+        deadline = started + self.settings.llm_timeout_seconds
+        stream = self.combined_chain.astream(
+            {"input": query, "chat_history": session_messages, "context": context}
+        )
+        try:
+            while True:
+                timeout = deadline - time.perf_counter()
+                if not tokens:
+                    timeout = min(timeout, self.settings.llm_first_token_timeout_seconds)
+                try:
+                    token = await asyncio.wait_for(stream.__anext__(), max(timeout, 0))
+                except StopAsyncIteration:
+                    break
+                if not token:
+                    continue
+                if not tokens:
+                    record_stage("llm_first_token", time.perf_counter() - started)
+                tokens.append(token)
+                yield token
+        except (asyncio.CancelledError, GeneratorExit):
+            breaker.abandon_call()
+            raise
+        except Exception as e:
+            breaker.record_failure()
+            detail = "timed out" if isinstance(e, asyncio.TimeoutError) else str(e)
+            failure = UpstreamUnavailable("llm", detail, breaker.retry_after())
+            if tokens:
+                raise failure from e
+        else:
+            breaker.record_success()
+        finally:
+            # Closing the chain stream cancels the upstream LLM call if the
+            # consumer goes away before the answer is complete
+            await stream.aclose()
+        record_stage("llm", time.perf_counter() - started)
+
+        if failure is not None:
+            # Nothing was sent yet, so a degraded answer can still replace it
+            yield (await self._afallback(query, query_embedding, context, failure))["answer"]
+            return
+        if use_cache and query_embedding is not None:
+            self.answer_cache.store(
+                query_embedding, query, {"answer": "".join(tokens), "context": context}, history_key(session_messages)
+            )
+
+# Read-only indexes loaded before forking workers (see preload_shared_data)
+_preloaded = {}
+
+
+def preload_shared_data():
+    """
+    Load the local vector and BM25 indexes in the gunicorn master, before it
+    forks: workers then share those pages copy-on-write (the vectors are
+    memory-mapped, so they share the page cache anyway) instead of each
+    reading the files. No clients or threads are created here; those are
+    not fork-safe and are built per worker by the warm-up.
+    """
+    settings = get_settings()
+    if settings.vector_store_backend == "local":
+        _preloaded["local_index"] = LocalVectorStore(
+            settings.local_index_path,
+            embedding=None,
+            index_type=settings.local_index_type,
+            nprobe=settings.ivf_nprobe,
+        )
+    if settings.retriever_mode == "hybrid":
+        _preloaded["bm25"] = BM25Index.load(settings.bm25_index_path)
+
+
 @lru_cache()
 def get_rag_service():
     """Singleton pattern for RAG service"""
@@ -0,0 +1,195 @@
+# resilience.py
+# Deadlines, jittered retries and circuit breakers for upstream calls (Pinecone, Gemini)
+import asyncio
+import random
+import threading
+import time
+from typing import Any, List
+
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+
+from metrics import Counter, Gauge
+
+CIRCUIT_OPEN = Gauge("upstream_circuit_open", "1 while an upstream's circuit breaker is open", ("upstream",))
+FAILURES = Counter("upstream_failures_total", "Failed upstream calls (including timeouts)", ("upstream",))
+RETRIES = Counter("upstream_retries_total", "Retried upstream calls", ("upstream",))
+
+
+class UpstreamUnavailable(Exception):
+    """An upstream failed, timed out or has its circuit open; retry after `retry_after` seconds"""
+    def __init__(self, upstream: str, detail: str, retry_after: int = 1):
+        super().__init__(f"{upstream}: {detail}")
+        self.upstream = upstream
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures and fails fast for
+    `reset_timeout` seconds; then lets a single trial call through (half-open)
+    and closes again if it succeeds.
+    """
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()  # also used from worker threads
+        CIRCUIT_OPEN.set(0, upstream=name)
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def retry_after(self) -> int:
+        if self._opened_at is None:
+            return 1
+        return max(1, int(self.reset_timeout - (time.monotonic() - self._opened_at)) + 1)
+
+    def before_call(self):
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return
+            if state == "half_open" and not self._trial_running:
+                self._trial_running = True
+                return
+        raise UpstreamUnavailable(self.name, "circuit open", self.retry_after())
+
+    def abandon_call(self):
+        with self._lock:
+            self._trial_running = False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+        CIRCUIT_OPEN.set(0, upstream=self.name)
+
+    def record_failure(self):
+        FAILURES.inc(upstream=self.name)
+        with self._lock:
+            self._failures += 1
+            self._trial_running = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                # A failed half-open trial restarts the cool-down
+                self._opened_at = time.monotonic()
+                opened = True
+            else:
+                opened = False
+        if opened:
+            CIRCUIT_OPEN.set(1, upstream=self.name)
+
+
+async def with_deadline(awaitable, timeout: float, name: str):
+    """Await with a stage deadline; a timeout becomes UpstreamUnavailable"""
+    try:
+        return await asyncio.wait_for(awaitable, timeout)
+    except asyncio.TimeoutError as e:
+        raise UpstreamUnavailable(name, "timed out") from e
+
+
+class Upstream:
+    """
+    Call policy for one dependency: circuit breaker, a per-attempt deadline
+    (async calls only; sync callers rely on client timeouts) and `retries`
+    extra attempts with full-jitter exponential backoff. Only use retries
+    for idempotent calls.
+    """
+    def __init__(self, name: str, timeout: float = None, retries: int = 0, base_delay: float = 0.2,
+                 max_delay: float = 2.0, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.name = name
+        self.timeout = timeout
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = CircuitBreaker(name, failure_threshold, reset_timeout)
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def call(self, factory, timeout: float = None):
+        """Await `factory()` (a coroutine factory, so each attempt gets a fresh coroutine)"""
+        timeout = timeout or self.timeout
+        for attempt in range(self.retries + 1):
+            self.breaker.before_call()
+            try:
+                result = await asyncio.wait_for(factory(), timeout)
+            except (asyncio.CancelledError, UpstreamUnavailable):
+                # The caller gave up, or a nested upstream failed: says nothing
+                # about this upstream's health
+                self.breaker.abandon_call()
+                raise
+            except Exception as e:
+                self.breaker.record_failure()
+                if attempt == self.retries:
+                    detail = "timed out" if isinstance(e, asyncio.TimeoutError) else str(e)
+                    raise UpstreamUnavailable(self.name, detail, self.breaker.retry_after()) from e
+                RETRIES.inc(upstream=self.name)
+                await asyncio.sleep(self._backoff(attempt))
+            else:
+                self.breaker.record_success()
+                return result
+
+    def call_sync(self, fn, *args, **kwargs):
+        for attempt in range(self.retries + 1):
+            self.breaker.before_call()
+            try:
+                result = fn(*args, **kwargs)
+            except UpstreamUnavailable:
+                self.breaker.abandon_call()
+                raise
+            except Exception as e:
+                self.breaker.record_failure()
+                if attempt == self.retries:
+                    raise UpstreamUnavailable(self.name, str(e), self.breaker.retry_after()) from e
+                RETRIES.inc(upstream=self.name)
+                time.sleep(self._backoff(attempt))
+            else:
+                self.breaker.record_success()
+                return result
+
+
+class ResilientRetriever(BaseRetriever):
+    """Runs a retriever through an Upstream policy (deadline, retries, circuit breaker)"""
+    retriever: BaseRetriever
+    upstream: Any
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        return self.upstream.call_sync(
+            self.retriever.invoke, query, config={"callbacks": run_manager.get_child()}
+        )
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        return await self.upstream.call(
+            lambda: self.retriever.ainvoke(query, config={"callbacks": run_manager.get_child()})
+        )
+
+
+class ResilientEmbeddings(Embeddings):
+    """Embeddings whose calls go through an Upstream policy"""
+    def __init__(self, embeddings: Embeddings, upstream: Upstream):
+        self.embeddings = embeddings
+        self.upstream = upstream
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.upstream.call_sync(self.embeddings.embed_documents, texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.upstream.call_sync(self.embeddings.embed_query, text)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self.upstream.call(lambda: self.embeddings.aembed_documents(texts))
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await self.upstream.call(lambda: self.embeddings.aembed_query(text))
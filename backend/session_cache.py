@@ -0,0 +1,291 @@
+# session_cache.py
+# In-process read-through cache for hot session data, with optional cross-worker invalidation
+import itertools
+import logging
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from cache_services import TTLLRUCache
+from message_stores import MESSAGE_FIELDS
+
+logger = logging.getLogger(__name__)
+
+
+class LocalInvalidationBus:
+    """
+    In-process pub/sub: every subscribed cache sees every event. Stands in
+    for MongoInvalidationBus in tests and single-process setups.
+    """
+    healthy = True
+
+    def __init__(self):
+        self._subscribers = []
+
+    def subscribe(self, callback):
+        self._subscribers.append(callback)
+
+    def publish(self, event: dict):
+        for callback in list(self._subscribers):
+            callback(event)
+
+
+class MongoInvalidationBus:
+    """
+    Cross-worker invalidation: events are inserted into `collection` and every
+    worker follows them with a change stream (needs a replica set or Atlas).
+    While the stream is down the bus reports unhealthy, so caches stop
+    serving entries other workers may have changed.
+    """
+    def __init__(self, collection, retry_seconds: float = 5):
+        self.collection = collection
+        self.retry_seconds = retry_seconds
+        self.healthy = False
+        self._subscribers = []
+        self._thread = None
+        self.collection.create_index("ts", expireAfterSeconds=3600)
+
+    def subscribe(self, callback):
+        self._subscribers.append(callback)
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._follow, name="cache-invalidation", daemon=True)
+            self._thread.start()
+
+    def publish(self, event: dict):
+        self.collection.insert_one({**event, "ts": datetime.utcnow()})
+
+    def _dispatch(self, event: dict):
+        for callback in list(self._subscribers):
+            callback(event)
+
+    def _follow(self):
+        pipeline = [{"$match": {"operationType": "insert"}}]
+        while True:
+            try:
+                with self.collection.watch(pipeline) as stream:
+                    # Anything cached before the stream was up may be stale
+                    self._dispatch({"kind": "reset"})
+                    self.healthy = True
+                    for change in stream:
+                        self._dispatch(change["fullDocument"])
+            except Exception as e:
+                logger.warning(f"Cache invalidation stream failed, retrying: {e}")
+            self.healthy = False
+            time.sleep(self.retry_seconds)
+
+
+class SessionCache:
+    """
+    Size-bounded LRU caches for the data every chat turn and sidebar refresh
+    reads: the newest `history_size` messages of a session, its rolling
+    summary, and the first page of each user's session list.
+
+    Writers update entries in place (write-through) and publish an event so
+    other workers drop theirs. Loads carry a version taken before the read,
+    so a read that raced with a write can't cache stale data.
+    """
+    def __init__(self, max_sessions: int, max_users: int, history_size: int, ttl_seconds: float, bus=None):
+        self.history_size = history_size
+        self.histories = TTLLRUCache(max_sessions, ttl_seconds)  # session_id -> {"messages", "complete"}
+        self.summaries = TTLLRUCache(max_sessions, ttl_seconds)  # session_id -> {"summary", "summary_until"}
+        self.session_lists = TTLLRUCache(max_users, ttl_seconds)  # user_id -> {"limit", "docs"}
+        self.owners = TTLLRUCache(max_sessions, ttl_seconds)  # session_id -> user_id
+        self._versions = TTLLRUCache(max_sessions + max_users, ttl_seconds)
+        self._counter = itertools.count(1)
+        self._lock = threading.Lock()
+        self.origin = uuid.uuid4().hex
+        self.bus = bus
+        if bus is not None:
+            bus.subscribe(self._on_event)
+
+    @property
+    def usable(self) -> bool:
+        return self.bus is None or self.bus.healthy
+
+    # Versions guard loads against concurrent writes. A load stamps the key
+    # if it has no version yet; if the stamp is evicted (or the cache reset)
+    # before the load finishes, the result isn't cached
+    def version(self, key: tuple):
+        with self._lock:
+            current = self._versions.get(key)
+            if current is None:
+                current = next(self._counter)
+                self._versions.set(key, current)
+            return current
+
+    def _bump(self, key: tuple):
+        self._versions.set(key, next(self._counter))
+
+    # Histories
+    def get_recent(self, session_id: str, limit: int):
+        entry = self.histories.get(session_id) if self.usable else None
+        if entry is None or (len(entry["messages"]) < limit and not entry["complete"]):
+            return None
+        return entry["messages"][-limit:]
+
+    def put_history(self, session_id: str, messages: list, complete: bool, version):
+        with self._lock:
+            if self._versions.get(("session", session_id)) == version:
+                self.histories.set(session_id, {
+                    "messages": [{field: msg[field] for field in MESSAGE_FIELDS} for msg in messages],
+                    "complete": complete,
+                })
+
+    def append_messages(self, docs: list, stored: bool = True):
+        """
+        Write-through for new messages: extend cached histories (idempotent by
+        message_id). Once `stored`, also count them in the owner's session
+        list and tell other workers; write-behind calls this first with
+        stored=False when the docs are buffered, then again after the flush.
+        """
+        by_session = {}
+        for doc in docs:
+            by_session.setdefault(doc["session_id"], []).append(doc)
+        with self._lock:
+            for session_id, new_docs in by_session.items():
+                self._bump(("session", session_id))
+                entry = self.histories.get(session_id)
+                if entry is not None:
+                    known = {msg["message_id"] for msg in entry["messages"]}
+                    messages = entry["messages"] + [
+                        {field: doc[field] for field in MESSAGE_FIELDS}
+                        for doc in new_docs if doc["message_id"] not in known
+                    ]
+                    messages.sort(key=lambda msg: (msg["timestamp"], msg["message_id"]))
+                    complete = entry["complete"] and len(messages) <= self.history_size
+                    self.histories.set(session_id, {"messages": messages[-self.history_size:], "complete": complete})
+                if stored:
+                    self._touch_session_list(session_id, new_docs)
+        if stored:
+            for session_id in by_session:
+                self._publish(session_id=session_id, user_id=self.owners.get(session_id))
+
+    def _touch_session_list(self, session_id: str, new_docs: list):
+        user_id = self.owners.get(session_id)
+        entry = self.session_lists.get(user_id) if user_id else None
+        if entry is None:
+            return
+        self._bump(("user", user_id))
+        docs = [dict(doc) for doc in entry["docs"]]
+        for doc in docs:
+            if doc["session_id"] == session_id:
+                doc["message_count"] = doc.get("message_count", 0) + len(new_docs)
+                latest = max(new_doc["timestamp"] for new_doc in new_docs)
+                if doc.get("updated_at") is None or latest > doc["updated_at"]:
+                    doc["updated_at"] = latest
+                break
+        else:
+            return
+        docs.sort(key=lambda doc: (doc.get("updated_at") or datetime.min, doc["session_id"]), reverse=True)
+        self.session_lists.set(user_id, {**entry, "docs": docs})
+
+    # Summaries
+    def get_summary(self, session_id: str):
+        return self.summaries.get(session_id) if self.usable else None
+
+    def put_summary(self, session_id: str, state: dict, version=None, publish: bool = False):
+        with self._lock:
+            if publish:
+                self._bump(("session", session_id))
+            elif self._versions.get(("session", session_id)) != version:
+                return
+            self.summaries.set(session_id, dict(state))
+        if publish:
+            self._publish(session_id=session_id)
+
+    # Session lists (first page only)
+    def get_sessions(self, user_id: str, limit: int):
+        entry = self.session_lists.get(user_id) if self.usable else None
+        if entry is None or (entry["limit"] < limit and len(entry["docs"]) >= entry["limit"]):
+            return None
+        return entry["docs"][:limit]
+
+    def put_sessions(self, user_id: str, limit: int, docs: list, version):
+        with self._lock:
+            if self._versions.get(("user", user_id)) != version:
+                return
+            self.session_lists.set(user_id, {"limit": limit, "docs": [dict(doc) for doc in docs]})
+            for doc in docs:
+                self.owners.set(doc["session_id"], user_id)
+
+    # Owners
+    def get_owner(self, session_id: str):
+        return self.owners.get(session_id) if self.usable else None
+
+    def set_owner(self, session_id: str, user_id: str):
+        self.owners.set(session_id, user_id)
+
+    # Invalidation
+    def new_session(self, session_id: str, user_id: str):
+        """A freshly created or rotated-in guest session: known empty history and no summary"""
+        with self._lock:
+            self._bump(("session", session_id))
+            self.owners.set(session_id, user_id)
+            self.histories.set(session_id, {"messages": [], "complete": True})
+            self.summaries.set(session_id, {"summary": None, "summary_until": None})
+        self.invalidate_user(user_id, publish=False)
+        self._publish(session_id=session_id, user_id=user_id)
+
+    def invalidate_session(self, session_id: str, user_id: str = None, publish: bool = True):
+        user_id = user_id or self.owners.get(session_id)
+        with self._lock:
+            self._bump(("session", session_id))
+            self.histories.pop(session_id)
+            self.summaries.pop(session_id)
+            self.owners.pop(session_id)
+        if user_id:
+            self.invalidate_user(user_id, publish=False)
+        if publish:
+            self._publish(session_id=session_id, user_id=user_id)
+
+    def invalidate_user(self, user_id: str, publish: bool = True):
+        with self._lock:
+            self._bump(("user", user_id))
+            self.session_lists.pop(user_id)
+        if publish:
+            self._publish(user_id=user_id)
+
+    def clear(self):
+        with self._lock:
+            for cache in (self.histories, self.summaries, self.session_lists, self.owners):
+                cache.clear()
+            self._versions.clear()
+
+    def _publish(self, session_id: str = None, user_id: str = None):
+        if self.bus is not None:
+            self.bus.publish({"kind": "invalidate", "origin": self.origin, "session_id": session_id, "user_id": user_id})
+
+    def _on_event(self, event: dict):
+        if event.get("kind") == "reset":
+            self.clear()
+        elif event.get("origin") != self.origin:
+            if event.get("session_id"):
+                self.invalidate_session(event["session_id"], event.get("user_id"), publish=False)
+            elif event.get("user_id"):
+                self.invalidate_user(event["user_id"], publish=False)
+
+    def stats(self) -> dict:
+        return {
+            "histories": self.histories.stats(),
+            "summaries": self.summaries.stats(),
+            "session_lists": self.session_lists.stats(),
+        }
+
+
+def make_session_cache(settings, db):
+    """SessionCache configured from settings, or None when disabled"""
+    if not settings.session_cache_enabled:
+        return None
+    bus = None
+    if settings.session_cache_invalidation == "local":
+        bus = LocalInvalidationBus()
+    elif settings.session_cache_invalidation == "mongo":
+        bus = MongoInvalidationBus(db.cache_invalidations)
+    return SessionCache(
+        settings.session_cache_max_sessions,
+        settings.session_cache_max_users,
+        settings.session_cache_history_size,
+        settings.session_cache_ttl_seconds,
+        bus,
+    )
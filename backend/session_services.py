@@ -1,20 +1,44 @@
-from functools import lru_cache
-from pymongo import MongoClient
-from datetime import datetime
+import asyncio
+import contextvars
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import OperationFailure
+from datetime import datetime, timedelta
 from config import get_settings
+from metrics import stage_timer
+from message_stores import make_message_store
+from pagination import decode_cursor, encode_cursor, in_keyset_range, keyset_filter
+from session_cache import make_session_cache
 import uuid
-import os
+
+logger = logging.getLogger(__name__)
+
+# Sessions written to; older documents may lack is_active
+ACTIVE = {"is_active": {"$ne": False}}
 
 class ChatSessionService:
-    def __init__(self):
+    def __init__(self, client=None):
         settings = get_settings()
-        self.client = MongoClient(settings.mongodb_uri)
+        # `client` lets benchmarks pass an in-memory stand-in such as mongomock
+        self.client = client or MongoClient(
+            settings.mongodb_uri,
+            maxPoolSize=settings.mongo_max_pool_size,
+            minPoolSize=settings.mongo_min_pool_size,
+        )
         self.db = self.client.chatbot_db
         
         # Your three collections
         self.users = self.db.users
         self.sessions = self.db.sessions  
         self.messages = self.db.messages
+        # "document" (one doc per message) or "bucket" (see message_stores.py)
+        self.message_store = make_message_store(
+            self.db, settings.message_storage, settings.message_bucket_size
+        )
+        # Recent histories, summaries and session lists (None when disabled)
+        self.cache = make_session_cache(settings, self.db)
         
         self._create_indexes()
     
@@ -47,34 +71,81 @@ class ChatSessionService:
             "is_active": True
         }
         self.sessions.insert_one(session_doc)
+        if self.cache:
+            self.cache.new_session(session_id, user_id)
         return session_id
     
-    def get_user_sessions(self, user_id: str, limit: int = 20):
-        """Get sessions with anonymous user logic"""
+    def get_session_owner(self, session_id: str):
+        """user_id owning an active session, or None if it doesn't exist or was deleted"""
+        owner = self.cache.get_owner(session_id) if self.cache else None
+        if owner is not None:
+            return owner
+        doc = self.sessions.find_one({"session_id": session_id, **ACTIVE}, {"_id": 0, "user_id": 1})
+        if doc and self.cache:
+            self.cache.set_owner(session_id, doc["user_id"])
+        return doc["user_id"] if doc else None
+
+    def get_user_sessions(self, user_id: str, limit: int = 20, before: str = None):
+        """
+        Get sessions with anonymous user logic. Registered users' sessions
+        come newest first; `before` is the cursor of the last session of the
+        previous page (keyset on updated_at, session_id).
+        """
+        # Only the first page is cached; it is what the sidebar refreshes
+        cacheable = self.cache is not None and before is None
+        if cacheable:
+            docs = self.cache.get_sessions(user_id, limit)
+            if docs is not None:
+                return [self._format_session(doc) for doc in docs]
+            version = self.cache.version(("user", user_id))
+
+        projection = {"_id": 0, "session_id": 1, "title": 1, "updated_at": 1, "message_count": 1}
         
         if user_id.startswith("anon_"):
             # For anonymous users: return only their single active session
             cursor = self.sessions.find({
                 "user_id": user_id, 
                 "is_active": True
-            }).limit(1)  # Only one session for anonymous users
+            }, projection).limit(1)  # Only one session for anonymous users
         else:
             # For registered users: return all active sessions
-            cursor = self.sessions.find({
-                "user_id": user_id, 
-                "is_active": True
-            }).sort("updated_at", -1).limit(limit)
-        
-        sessions = []
-        for doc in cursor:
-            sessions.append({
-                "session_id": doc["session_id"],
-                "title": doc.get("title", "New Chat"),
-                "updated_at": doc["updated_at"].isoformat() if doc.get("updated_at") else None,
-                "message_count": doc.get("message_count", 0),
-            })
+            query = {"user_id": user_id, "is_active": True}
+            if before:
+                query.update(keyset_filter("updated_at", "session_id", decode_cursor(before), "$lt"))
+            cursor = self.sessions.find(query, projection).sort(
+                [("updated_at", -1), ("session_id", -1)]
+            ).limit(limit)
         
-        return sessions
+        docs = list(cursor)
+        if cacheable:
+            # Anonymous users only ever see one session, whatever the limit
+            self.cache.put_sessions(user_id, 1 if user_id.startswith("anon_") else limit, docs, version)
+        return [self._format_session(doc) for doc in docs]
+
+    @staticmethod
+    def _format_session(doc: dict) -> dict:
+        return {
+            "session_id": doc["session_id"],
+            "title": doc.get("title", "New Chat"),
+            "updated_at": doc["updated_at"].isoformat() if doc.get("updated_at") else None,
+            "message_count": doc.get("message_count", 0),
+            "cursor": encode_cursor(doc["updated_at"], doc["session_id"]) if doc.get("updated_at") else None,
+        }
+
+    def reassign_sessions(self, from_user_id: str, to_user_id: str, active_only: bool = False) -> int:
+        """
+        Move every session of one user to another (anonymous -> registered);
+        with active_only, just the ones shown in the session list
+        """
+        query = {"user_id": from_user_id, "is_active": True} if active_only else {"user_id": from_user_id}
+        session_ids = [doc["session_id"] for doc in self.sessions.find(query, {"_id": 0, "session_id": 1})]
+        result = self.sessions.update_many(query, {"$set": {"user_id": to_user_id}})
+        if self.cache:
+            for session_id in session_ids:
+                self.cache.set_owner(session_id, to_user_id)
+            self.cache.invalidate_user(from_user_id)
+            self.cache.invalidate_user(to_user_id)
+        return result.modified_count
         
     # Message operations
     def add_message(self, session_id: str, message_type: str, content: str):
@@ -88,60 +159,283 @@ class ChatSessionService:
         }
         
         # Insert message
-        self.messages.insert_one(message_doc)
+        inserted = self.message_store.insert([message_doc])
         
         # Update session metadata
-        self.sessions.update_one(
-            {"session_id": session_id},
+        result = self.sessions.update_one(
+            {"session_id": session_id, **ACTIVE},
             {
                 "$set": {"updated_at": datetime.utcnow()},
-                "$inc": {"message_count": 1}
+                "$inc": {"message_count": len(inserted)}
             }
         )
+        if not result.matched_count:
+            self._drop_late_writes([session_id])
+            return message_id
+        if self.cache:
+            self.cache.append_messages([message_doc])
         
         return message_id
+
+    @staticmethod
+    def build_message(session_id: str, message_type: str, content: str, timestamp: datetime = None) -> dict:
+        """One message doc; _id is the message_id so re-inserts are no-ops"""
+        # Mongo keeps milliseconds: truncate so buffered docs match stored ones
+        timestamp = timestamp or datetime.utcnow()
+        message_id = str(uuid.uuid4())
+        return {
+            "_id": message_id,
+            "message_id": message_id,
+            "session_id": session_id,
+            "type": message_type,
+            "content": content,
+            "timestamp": timestamp.replace(microsecond=timestamp.microsecond // 1000 * 1000),
+        }
+
+    @classmethod
+    def build_answer(cls, prompt_doc: dict, content: str) -> dict:
+        """The AI message answering prompt_doc, strictly after it so they sort in order"""
+        doc = cls.build_message(prompt_doc["session_id"], "ai", content)
+        doc["timestamp"] = max(doc["timestamp"], prompt_doc["timestamp"] + timedelta(milliseconds=1))
+        return doc
+
+    @classmethod
+    def build_turn(cls, session_id: str, user_content: str, ai_content: str, user_timestamp: datetime = None) -> list:
+        """Message docs for one user prompt + AI answer"""
+        prompt_doc = cls.build_message(session_id, "user", user_content, user_timestamp)
+        return [prompt_doc, cls.build_answer(prompt_doc, ai_content)]
+
+    def write_messages(self, docs: list):
+        """
+        Insert message docs with one insert_many and bump each session's
+        metadata with one bulk update. Safe to retry: docs already written
+        are skipped as duplicate keys and not counted again.
+        """
+        inserted = self.message_store.insert(docs)
+
+        per_session = {}
+        for doc in inserted:
+            count, updated_at = per_session.get(doc["session_id"], (0, doc["timestamp"]))
+            per_session[doc["session_id"]] = (count + 1, max(updated_at, doc["timestamp"]))
+        if per_session:
+            result = self.sessions.bulk_write([
+                UpdateOne(
+                    {"session_id": session_id, **ACTIVE},
+                    {"$max": {"updated_at": updated_at}, "$inc": {"message_count": count}}
+                )
+                for session_id, (count, updated_at) in per_session.items()
+            ], ordered=False)
+            if result.matched_count < len(per_session):
+                live = {doc["session_id"] for doc in self.sessions.find(
+                    {"session_id": {"$in": list(per_session)}, **ACTIVE}, {"_id": 0, "session_id": 1}
+                )}
+                gone = [session_id for session_id in per_session if session_id not in live]
+                self._drop_late_writes(gone)
+                docs = [doc for doc in docs if doc["session_id"] not in gone]
+        if self.cache:
+            self.cache.append_messages(docs)
+
+    def _drop_late_writes(self, session_ids: list):
+        """
+        Messages that landed after their session was deleted or replaced (a
+        prompt still in flight): the purge may already be done, so delete
+        them here rather than leave orphans
+        """
+        for session_id in session_ids:
+            deleted = self.message_store.delete_session(session_id)
+            if self.cache:
+                self.cache.invalidate_session(session_id)
+            logger.info(f"Dropped {deleted} messages written to deleted session {session_id}")
+
+    def add_turn(self, session_id: str, user_content: str, ai_content: str, user_timestamp: datetime = None) -> list:
+        """Store a prompt and its answer in two round-trips; returns their message ids"""
+        docs = self.build_turn(session_id, user_content, ai_content, user_timestamp)
+        self.write_messages(docs)
+        return [doc["message_id"] for doc in docs]
+    
+    def get_session_messages(self, session_id: str, limit: int = 50, before: str = None, after: str = None, newest: bool = False):
+        """
+        A page of messages, oldest first. `after` / `before` are message
+        cursors (see pagination.encode_cursor): the page starts right after
+        `after`, or ends right before `before`. Without cursors it is the
+        first page of the session, or the last one with `newest`.
+        """
+        return self.message_store.page(
+            session_id,
+            limit,
+            before=decode_cursor(before) if before else None,
+            after=decode_cursor(after) if after else None,
+            newest=newest,
+        )
+    
+    def get_recent_messages(self, session_id: str, limit: int = 20):
+        """Most recent messages of a session, returned oldest first"""
+        if self.cache is None or not 0 < limit <= self.cache.history_size:
+            return self.message_store.page(session_id, limit, newest=True)
+        messages = self.cache.get_recent(session_id, limit)
+        if messages is None:
+            # Load a full cache entry so shorter and longer reads hit it too
+            version = self.cache.version(("session", session_id))
+            size = self.cache.history_size
+            messages = self.message_store.page(session_id, size, newest=True)
+            self.cache.put_history(session_id, messages, len(messages) < size, version)
+            messages = messages[-limit:]
+        return messages
+    
+    def get_messages_after(self, session_id: str, after=None, limit: int = 200):
+        """Messages newer than `after` (all if None), oldest first"""
+        return self.message_store.after(session_id, after, limit)
+    
+    # Summary operations
+    def get_session_summary(self, session_id: str) -> dict:
+        """Rolling summary of a session's older messages and the timestamp it covers up to"""
+        if self.cache:
+            state = self.cache.get_summary(session_id)
+            if state is not None:
+                return dict(state)
+            version = self.cache.version(("session", session_id))
+        doc = self.sessions.find_one(
+            {"session_id": session_id},
+            {"_id": 0, "summary": 1, "summary_until": 1}
+        ) or {}
+        state = {"summary": doc.get("summary"), "summary_until": doc.get("summary_until")}
+        if self.cache:
+            self.cache.put_summary(session_id, state, version)
+        return state
     
-    def get_session_messages(self, session_id: str, limit: int = 50):
-        return list(self.messages.find(
-            {"session_id": session_id}
-        ).sort("timestamp", 1).limit(limit))
+    def update_session_summary(self, session_id: str, summary: str, summary_until, previous_until=None) -> bool:
+        """
+        Store a new summary only if nobody else advanced it since `previous_until`
+        was read, so concurrent compactions can't overwrite each other
+        """
+        result = self.sessions.update_one(
+            {"session_id": session_id, "summary_until": previous_until},
+            {"$set": {"summary": summary, "summary_until": summary_until}}
+        )
+        if self.cache:
+            if result.modified_count:
+                self.cache.put_summary(session_id, {"summary": summary, "summary_until": summary_until}, publish=True)
+            else:
+                # Lost the race: whatever is cached is older than the winner's
+                self.cache.invalidate_session(session_id)
+        return result.modified_count > 0
     
     def _create_indexes(self):
         """Create database indexes for performance"""
         # Index for finding user's sessions
-        self.sessions.create_index([("user_id", 1), ("updated_at", -1)])
+        self.sessions.create_index([("user_id", 1), ("updated_at", -1), ("session_id", -1)])
         
         # Index for finding session messages
-        self.messages.create_index([("session_id", 1), ("timestamp", 1)])
+        self.message_store.create_indexes()
         
         # Index for session lookup
         self.sessions.create_index("session_id")
 
+        # Users are looked up by id on every auth check and by email on login
+        try:
+            self.users.create_index("user_id", unique=True)
+            self.users.create_index("email", unique=True, sparse=True)
+        except OperationFailure as e:
+            # Existing duplicate users: index the lookups anyway, without uniqueness
+            logger.warning(f"Could not create unique user indexes, deduplicate users first: {e}")
+            self.users.create_index("user_id")
+            self.users.create_index("email")
+
     def delete_session(self, session_id: str) -> bool:
         """
         Delete a session and all its associated messages
         Returns True if session was found and deleted, False otherwise
         """
         try:
+            owner = self.get_session_owner(session_id) if self.cache else None
             # First, delete all messages associated with this session
-            messages_result = self.messages.delete_many({"session_id": session_id})
+            deleted_messages = self.message_store.delete_session(session_id)
             
             # Then, delete the session itself
             session_result = self.sessions.delete_one({"session_id": session_id})
+            if self.cache:
+                self.cache.invalidate_session(session_id, owner)
             
             if session_result.deleted_count > 0:
-                print(f"Deleted session {session_id} and {messages_result.deleted_count} associated messages")
+                logger.info(f"Deleted session {session_id} and {deleted_messages} associated messages")
                 return True
             else:
-                print(f"Session {session_id} not found")
+                logger.info(f"Session {session_id} not found")
                 return False
                 
         except Exception as e:
-            print(f"Error deleting session {session_id}: {e}")
+            logger.error(f"Error deleting session {session_id}: {e}")
             return False
         
 
 
+    def deactivate_session(self, session_id: str) -> bool:
+        """
+        Hide a session from its owner right away; its messages are removed
+        later by purge_session (see jobs.py). False if it doesn't exist.
+        """
+        doc = self.sessions.find_one_and_update(
+            {"session_id": session_id},
+            {"$set": {"is_active": False, "deactivated_at": datetime.utcnow()}},
+            projection={"_id": 0, "user_id": 1},
+        )
+        if self.cache:
+            # The owner's cached session list must drop it too
+            self.cache.invalidate_session(session_id, doc["user_id"] if doc else None)
+        return doc is not None
+
+    def rotate_anonymous_session(self, user_id: str) -> tuple:
+        """
+        Start a guest over: their active session gets a fresh id and empty
+        metadata in one update, so they always have exactly one active
+        session. Returns (new session id, previous id or None); the previous
+        id's messages are left for purge_session.
+        """
+        session_id = str(uuid.uuid4())
+        now = datetime.utcnow()
+        previous = self.sessions.find_one_and_update(
+            {"user_id": user_id, "is_active": True},
+            {
+                "$set": {
+                    "session_id": session_id,
+                    "title": "New Chat",
+                    "created_at": now,
+                    "updated_at": now,
+                    "message_count": 0,
+                },
+                "$unset": {"summary": "", "summary_until": ""},
+            },
+            projection={"_id": 0, "session_id": 1},
+        )
+        if previous is None:
+            return self.create_session(user_id), None
+        if self.cache:
+            self.cache.invalidate_session(previous["session_id"], user_id)
+            self.cache.new_session(session_id, user_id)
+        return session_id, previous["session_id"]
+
+    def purge_session(self, session_id: str, batch_size: int = 1000, progress=None) -> dict:
+        """
+        Delete a deactivated (or rotated away) session's messages in batches,
+        then the session. Safe to re-run after a partial purge; refuses
+        active sessions.
+        """
+        doc = self.sessions.find_one({"session_id": session_id}, {"_id": 0, "is_active": 1})
+        if doc is not None and doc.get("is_active", True):
+            return {"skipped": "session is active"}
+        deleted = 0
+        while True:
+            removed = self.message_store.delete_batch(session_id, batch_size)
+            if not removed:
+                break
+            deleted += removed
+            if progress:
+                progress({"messages_deleted": deleted})
+        self.sessions.delete_one({"session_id": session_id, "is_active": False})
+        if self.cache:
+            self.cache.invalidate_session(session_id)
+        return {"messages_deleted": deleted}
+
     def get_or_create_anonymous_session(self, user_id: str) -> str:
         """
         For anonymous users: Get existing session or create new one
@@ -159,53 +453,260 @@ class ChatSessionService:
             # Create new session for first-time anonymous user
             return self.create_session(user_id)
 
-    def replace_anonymous_session_content(self, user_id: str) -> str:
-        """
-        For anonymous users starting a new chat:
-        Clear existing messages but keep the session
-        """
-        # Find the user's active session
-        existing_session = self.sessions.find_one({
-            "user_id": user_id,
-            "is_active": True
-        })
-        
-        if existing_session:
-            session_id = existing_session["session_id"]
-            
-            # Delete all messages in this session
-            self.messages.delete_many({"session_id": session_id})
-            
-            # Reset session metadata
-            self.sessions.update_one(
-                {"session_id": session_id},
-                {
-                    "$set": {
-                        "title": "New Chat",
-                        "updated_at": datetime.utcnow(),
-                        "message_count": 0
-                    }
-                }
+
+class MessageWriteBuffer:
+    """
+    Write-behind buffer for chat messages. `add` returns as soon as the docs
+    are queued; a background task writes them every `flush_interval` seconds
+    (sooner once `max_batch` are waiting) with ChatSessionService.write_messages.
+    Failed writes stay queued and are retried. `add` waits for a flush when
+    `max_pending` docs are queued, so the buffer (and what a crash can lose)
+    stays bounded; `close` stops the background task (letting a write in
+    progress finish) and drains it on shutdown.
+    """
+    def __init__(self, run, write_messages, flush_interval: float = 0.05, max_batch: int = 500, max_pending: int = 5000):
+        self._run = run
+        self._write_messages = write_messages
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        self._pending = []
+        self._by_session = {}  # session_id -> pending docs, oldest first
+        self._loop = None
+        self._wake = None
+        self._lock = None
+        self._worker = None
+        self._closing = False
+
+    def _bind(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._wake = asyncio.Event()
+            self._lock = asyncio.Lock()
+            self._worker = loop.create_task(self._flush_periodically())
+
+    async def add(self, docs: list):
+        self._bind()
+        if len(self._pending) >= self.max_pending:
+            await self.flush()
+        self._pending.extend(docs)
+        for doc in docs:
+            self._by_session.setdefault(doc["session_id"], []).append(doc)
+        if len(self._pending) >= self.max_batch:
+            self._wake.set()
+
+    def pending_for(self, session_id: str) -> list:
+        return list(self._by_session.get(session_id, ()))
+
+    async def _flush_periodically(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.warning(f"Error flushing buffered messages, will retry: {e}")
+                await asyncio.sleep(min(1.0, self.flush_interval * 10))
+
+    async def flush(self):
+        """Write everything queued so far"""
+        if self._lock is None:
+            return
+        async with self._lock:
+            while self._pending:
+                batch = self._pending[:self.max_batch]
+                await self._run(self._write_messages, batch)
+                del self._pending[:len(batch)]
+                for doc in batch:
+                    session_docs = self._by_session[doc["session_id"]]
+                    session_docs.remove(doc)
+                    if not session_docs:
+                        del self._by_session[doc["session_id"]]
+
+    async def close(self):
+        # Cancelling mid-write would leave the batch queued although its
+        # thread still writes it; let the worker finish its pass instead
+        self._closing = True
+        if self._worker is not None:
+            self._wake.set()
+            await self._worker
+        await self.flush()
+
+
+class AsyncChatSessionService:
+    """
+    Async facade over ChatSessionService.
+    pymongo is blocking, so every call runs on a bounded thread pool
+    instead of stalling the event loop. With `write_behind`, turns are
+    buffered and written in batches; reads merge in the buffered messages
+    of the session so this worker always sees its own writes. Reads that
+    hit the session cache are answered on the event loop without a thread hop.
+    """
+    def __init__(self, session_service: ChatSessionService, max_workers: int, write_behind: bool = False,
+                 flush_interval: float = 0.05, max_batch: int = 500, max_pending: int = 5000):
+        self.sync = session_service
+        self.users = session_service.users
+        self.sessions = session_service.sessions
+        self.messages = session_service.messages
+        self.cache = session_service.cache
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="mongo"
+        )
+        self.write_buffer = None
+        if write_behind:
+            self.write_buffer = MessageWriteBuffer(
+                self.run, session_service.write_messages, flush_interval, max_batch, max_pending
             )
-            
-            return session_id
-        else:
-            # No existing session, create new one
-            return self.create_session(user_id)
 
-    def create_session_smart(self, user_id: str) -> str:
+    def _with_pending(self, session_id: str, messages: list) -> list:
+        """Stored messages followed by this session's buffered ones (oldest first)"""
+        if self.write_buffer is None:
+            return messages
+        pending = self.write_buffer.pending_for(session_id)
+        if not pending:
+            return messages
+        # A flush may have landed between the read and now
+        stored = {msg["message_id"] for msg in messages}
+        return messages + [doc for doc in pending if doc["message_id"] not in stored]
+
+    async def run(self, fn, *args, **kwargs):
         """
-        Smart session creation based on user type
+        Run any blocking callable on the Mongo thread pool, in a copy of the
+        caller's context so stages it records land in the request's timings
         """
-        if user_id.startswith("anon_"):
-            # For anonymous users: replace existing session content
-            return self.replace_anonymous_session_content(user_id)
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        with stage_timer(f"mongo_{getattr(fn, '__name__', 'call')}"):
+            return await loop.run_in_executor(self._executor, partial(context.run, fn, *args, **kwargs))
+
+    async def create_session(self, user_id: str) -> str:
+        return await self.run(self.sync.create_session, user_id)
+
+    async def get_session_owner(self, session_id: str):
+        owner = self.cache.get_owner(session_id) if self.cache else None
+        if owner is not None:
+            return owner
+        return await self.run(self.sync.get_session_owner, session_id)
+
+    async def get_user_sessions(self, user_id: str, limit: int = 20, before: str = None):
+        docs = self.cache.get_sessions(user_id, limit) if self.cache and before is None else None
+        if docs is not None:
+            return [self.sync._format_session(doc) for doc in docs]
+        return await self.run(self.sync.get_user_sessions, user_id, limit, before)
+
+    async def add_message(self, session_id: str, message_type: str, content: str):
+        return await self.run(self.sync.add_message, session_id, message_type, content)
+
+    async def store_messages(self, docs: list):
+        """Write message docs through the write-behind buffer when enabled"""
+        if self.write_buffer is not None:
+            if self.cache:
+                self.cache.append_messages(docs, stored=False)
+            await self.write_buffer.add(docs)
         else:
-            # For registered users: create new session normally
-            return self.create_session(user_id)
-    
+            await self.run(self.sync.write_messages, docs)
+
+    async def add_answer(self, prompt_doc: dict, content: str) -> str:
+        """Store the answer to a prompt already stored with store_messages"""
+        doc = self.sync.build_answer(prompt_doc, content)
+        await self.store_messages([doc])
+        return doc["message_id"]
+
+    async def add_turn(self, session_id: str, user_content: str, ai_content: str, user_timestamp: datetime = None) -> list:
+        docs = self.sync.build_turn(session_id, user_content, ai_content, user_timestamp)
+        await self.store_messages(docs)
+        return [doc["message_id"] for doc in docs]
+
+    async def get_session_messages(self, session_id: str, limit: int = 50, before: str = None, after: str = None, newest: bool = False):
+        messages = await self.run(self.sync.get_session_messages, session_id, limit, before, after, newest)
+        if self.write_buffer is None or not self.write_buffer.pending_for(session_id):
+            return messages
+        # Buffered messages are newer than stored ones; keep those inside the cursor range
+        bounds = (decode_cursor(before) if before else None, decode_cursor(after) if after else None)
+        merged = [
+            msg for msg in self._with_pending(session_id, messages)
+            if in_keyset_range(msg["timestamp"], msg["message_id"], *bounds)
+        ]
+        merged.sort(key=lambda msg: (msg["timestamp"], msg["message_id"]))
+        return merged[-limit:] if newest or before else merged[:limit]
+
+    async def get_recent_messages(self, session_id: str, limit: int = 20):
+        messages = None
+        if self.cache and 0 < limit <= self.cache.history_size:
+            messages = self.cache.get_recent(session_id, limit)
+        if messages is None:
+            messages = await self.run(self.sync.get_recent_messages, session_id, limit)
+        return self._with_pending(session_id, messages)[-limit:]
+
+    async def get_messages_after(self, session_id: str, after=None, limit: int = 200):
+        messages = await self.run(self.sync.get_messages_after, session_id, after, limit)
+        if len(messages) == limit:
+            return messages  # buffered messages are newer than all of these
+        pending = [doc for doc in self._with_pending(session_id, messages)[len(messages):]
+                   if after is None or doc["timestamp"] > after]
+        return (messages + pending)[:limit]
+
+    async def flush(self):
+        """Make buffered messages durable (before deletes/rewrites of their session)"""
+        if self.write_buffer is not None:
+            await self.write_buffer.flush()
+
+    async def get_session_summary(self, session_id: str) -> dict:
+        state = self.cache.get_summary(session_id) if self.cache else None
+        if state is not None:
+            return dict(state)
+        return await self.run(self.sync.get_session_summary, session_id)
+
+    async def update_session_summary(self, session_id: str, summary: str, summary_until, previous_until=None) -> bool:
+        return await self.run(
+            self.sync.update_session_summary, session_id, summary, summary_until, previous_until
+        )
+
+    async def delete_session(self, session_id: str) -> bool:
+        await self.flush()
+        return await self.run(self.sync.delete_session, session_id)
+
+    async def deactivate_session(self, session_id: str) -> bool:
+        # Buffered messages must land before the purge job deletes the session's messages
+        await self.flush()
+        return await self.run(self.sync.deactivate_session, session_id)
+
+    async def rotate_anonymous_session(self, user_id: str) -> tuple:
+        # Buffered messages must land before the purge job deletes the old session's messages
+        await self.flush()
+        return await self.run(self.sync.rotate_anonymous_session, user_id)
+
+    async def get_or_create_anonymous_session(self, user_id: str) -> str:
+        return await self.run(self.sync.get_or_create_anonymous_session, user_id)
+
+    async def aclose(self):
+        """Drain the write-behind buffer, then stop the Mongo pool"""
+        if self.write_buffer is not None:
+            await self.write_buffer.close()
+        self.shutdown()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
 
 @lru_cache()
 def get_session_service():
     """Singleton pattern for Session service"""
-    return ChatSessionService()
\ No newline at end of file
+    return ChatSessionService()
+
+@lru_cache()
+def get_async_session_service():
+    """Singleton async wrapper sharing the sync service's Mongo client"""
+    settings = get_settings()
+    return AsyncChatSessionService(
+        get_session_service(),
+        settings.mongo_executor_workers,
+        write_behind=settings.message_write_behind_enabled,
+        flush_interval=settings.message_write_behind_interval_ms / 1000,
+        max_batch=settings.message_write_behind_max_batch,
+        max_pending=settings.message_write_behind_max_pending,
+    )
\ No newline at end of file
@@ -0,0 +1,10 @@
+# conftest.py
+# Backend modules import each other as top-level modules (run from backend/)
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Required settings; nothing in the tests talks to these services
+os.environ.setdefault("GOOGLE_API_KEY", "test")
+os.environ.setdefault("PINECONE_API_KEY", "test")
+os.environ.setdefault("MONGODB_URI", "mongodb://localhost")
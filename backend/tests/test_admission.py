@@ -0,0 +1,39 @@
+# test_admission.py
+import asyncio
+
+import pytest
+
+from admission import AdmissionController, AdmissionRejected
+
+
+def test_waiters_are_served_round_robin_across_users():
+    async def scenario():
+        controller = AdmissionController(max_in_flight=1, max_queue=10, max_queue_per_user=5, queue_timeout=5)
+        order = []
+        await controller.acquire("holder")
+
+        async def request(user: str):
+            async with controller.slot(user):
+                order.append(user)
+
+        tasks = [asyncio.ensure_future(request(user)) for user in ("a", "a", "a", "b")]
+        await asyncio.sleep(0)
+        controller.release()
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(scenario()) == ["a", "b", "a", "a"]
+
+
+def test_full_per_user_queue_is_rejected_with_429():
+    async def scenario():
+        controller = AdmissionController(max_in_flight=1, max_queue=10, max_queue_per_user=1, queue_timeout=5)
+        await controller.acquire("holder")
+        waiting = asyncio.ensure_future(controller.acquire("a"))
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected) as rejected:
+            await controller.acquire("a")
+        waiting.cancel()
+        return rejected.value
+
+    assert asyncio.run(scenario()).status_code == 429
@@ -0,0 +1,62 @@
+# test_auth_service.py
+import asyncio
+import time
+
+import mongomock
+import pytest
+from jose import jwt
+
+import auth_service
+from auth_service import AuthService, settings
+
+
+class CountingRun:
+    """AsyncChatSessionService.run stand-in that counts Mongo calls"""
+    def __init__(self):
+        self.calls = 0
+
+    async def __call__(self, fn, *args):
+        self.calls += 1
+        return fn(*args)
+
+
+@pytest.fixture
+def auth():
+    users = mongomock.MongoClient().db.users
+    return AuthService(session_service=None, user_collection=users, hasher=object(), run=CountingRun())
+
+
+def test_verified_tokens_skip_the_signature_check(auth, monkeypatch):
+    token = auth.create_jwt_token("u1", "a@b.c")
+    decodes = []
+    real_decode = jwt.decode
+    monkeypatch.setattr(auth_service.jwt, "decode", lambda *a, **kw: decodes.append(1) or real_decode(*a, **kw))
+
+    assert auth.verify_token(token)["user_id"] == "u1"
+    assert auth.verify_token(token)["user_id"] == "u1"
+    assert len(decodes) == 1
+
+    assert auth.verify_token(token[:-2] + "xx") is None
+    assert auth.verify_token(token[:-2] + "xx") is None
+    assert len(decodes) == 3  # rejected tokens aren't cached
+
+
+def test_a_cached_token_does_not_outlive_its_expiry(auth):
+    token = jwt.encode(
+        {"user_id": "u1", "email": "a@b.c", "exp": int(time.time()) + 1},
+        settings.jwt_secret_key, algorithm=settings.jwt_algorithm,
+    )
+    assert auth.verify_token(token) is not None
+    time.sleep(2.1)  # jose compares whole seconds
+    assert auth.verify_token(token) is None
+
+
+def test_profiles_are_cached_and_unknown_users_are_not(auth):
+    assert asyncio.run(auth.aget_user_profile("u1")) is None
+    auth.users.insert_one({"user_id": "u1", "email": "a@b.c", "name": "A", "password_hash": "x"})
+
+    profile = asyncio.run(auth.aget_user_profile("u1"))
+    assert profile == {"user_id": "u1", "email": "a@b.c", "name": "A"}
+    assert asyncio.run(auth.aget_user_profile("u1")) == profile
+    assert auth.run.calls == 2
+    assert auth.cache_stats()["profiles"]["hits"] == 1
@@ -0,0 +1,95 @@
+# test_bm25_index.py
+import asyncio
+import math
+from collections import Counter
+from typing import List
+
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from bm25_index import BM25Index, HybridRetriever, reciprocal_rank_fusion
+from text_utils import tokenize
+
+TEXTS = [
+    "Error E-1042 means the payment token expired",
+    "Reset your password from the account settings page",
+    "The payment page accepts cards and bank transfers",
+    "Contact support if the error persists after a retry",
+]
+
+
+def reference_bm25(query: str, texts: List[str], k1: float = 1.2, b: float = 0.75) -> List[float]:
+    docs = [tokenize(text) for text in texts]
+    avg_length = sum(len(doc) for doc in docs) / len(docs)
+    scores = []
+    for doc in docs:
+        freqs = Counter(doc)
+        score = 0.0
+        for term in set(tokenize(query)):
+            df = sum(term in other for other in docs)
+            if not freqs[term]:
+                continue
+            idf = math.log(1 + (len(docs) - df + 0.5) / (df + 0.5))
+            score += idf * freqs[term] * (k1 + 1) / (freqs[term] + k1 * (1 - b + b * len(doc) / avg_length))
+        scores.append(score)
+    return scores
+
+
+def test_scores_match_the_bm25_formula():
+    index = BM25Index.build(TEXTS)
+    query = "payment error page"
+    expected = reference_bm25(query, TEXTS)
+    results = index.search(query, k=10)
+    assert [row for row, _ in results] == sorted(range(len(TEXTS)), key=lambda row: -expected[row])
+    for row, score in results:
+        assert math.isclose(score, expected[row], rel_tol=1e-5)
+
+
+def test_codes_match_as_one_token_and_unknown_terms_match_nothing():
+    index = BM25Index.build(TEXTS, ids=["a", "b", "c", "d"])
+    assert [doc.id for doc in index.search_documents("what is e-1042?", k=3)] == ["a"]
+    assert index.search("kubernetes") == []
+
+
+def test_save_and_load_round_trip(tmp_path):
+    index = BM25Index.build(TEXTS, [{"n": i} for i in range(4)], ["a", "b", "c", "d"])
+    index.save(tmp_path)
+    loaded = BM25Index.load(tmp_path)
+    assert loaded.search("payment page") == index.search("payment page")
+    assert loaded.search_documents("password", k=1)[0].metadata == {"n": 1}
+
+
+def doc(doc_id: str) -> Document:
+    return Document(id=doc_id, page_content=f"text of {doc_id}")
+
+
+def test_rrf_favours_documents_ranked_by_both_lists():
+    vector = [doc("a"), doc("b"), doc("c")]
+    keyword = [doc("c"), doc("d"), doc("a")]
+    fused = reciprocal_rank_fusion([vector, keyword], k=3, rrf_k=60)
+    # a: 1/61 + 1/63, c: 1/63 + 1/61 tie above b and d; ties keep first-seen order
+    assert [d.id for d in fused] == ["a", "c", "b"]
+
+
+def test_rrf_matches_documents_without_ids_by_text():
+    first = [Document(page_content="same"), Document(page_content="only here")]
+    second = [Document(page_content="same")]
+    fused = reciprocal_rank_fusion([first, second], k=5)
+    assert [d.page_content for d in fused] == ["same", "only here"]
+
+
+class ListRetriever(BaseRetriever):
+    docs: List[Document]
+
+    def _get_relevant_documents(self, query, *, run_manager):
+        return self.docs
+
+
+def test_hybrid_retriever_fuses_vector_and_keyword_results():
+    index = BM25Index.build(TEXTS, ids=["a", "b", "c", "d"])
+    retriever = HybridRetriever(
+        vector_retriever=ListRetriever(docs=[doc("b"), doc("a")]), bm25=index, k=2, candidates_k=4
+    )
+    expected = [d.id for d in retriever.invoke("error e-1042")]
+    assert expected[0] == "a"
+    assert [d.id for d in asyncio.run(retriever.ainvoke("error e-1042"))] == expected
@@ -0,0 +1,39 @@
+# test_cache_services.py
+import time
+
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+from cache_services import SemanticCache, history_key
+
+
+def test_expired_best_match_does_not_hide_a_fresh_one():
+    cache = SemanticCache(max_entries=8, ttl_seconds=0.05, threshold=0.9)
+    cache.store([1.0, 0.0], "exact", {"answer": "stale"})
+    time.sleep(0.1)
+    cache.ttl_seconds = 60
+    cache.store([0.99, 0.1], "close", {"answer": "fresh"})
+
+    assert cache.lookup([1.0, 0.0]) == {"answer": "fresh"}
+    assert cache.stats()["size"] == 1
+
+
+def test_miss_below_threshold():
+    cache = SemanticCache(max_entries=8, ttl_seconds=60, threshold=0.9)
+    cache.store([1.0, 0.0], "q", {"answer": "a"})
+    assert cache.lookup([0.0, 1.0]) is None
+    assert cache.stats()["misses"] == 1
+
+
+def test_answers_are_only_reused_after_the_same_history():
+    first_turn = history_key([])
+    with_summary = history_key([SystemMessage(content="Summary: asked about refunds")])
+    follow_up = history_key([HumanMessage(content="hi"), AIMessage(content="hello")])
+    assert len({first_turn, with_summary, follow_up}) == 3
+    assert follow_up == history_key([HumanMessage(content="hi"), AIMessage(content="hello")])
+
+    cache = SemanticCache(max_entries=8, ttl_seconds=60, threshold=0.9)
+    cache.store([1.0, 0.0], "q", {"answer": "after summary"}, with_summary)
+    assert cache.lookup([1.0, 0.0], first_turn) is None
+    assert cache.lookup([1.0, 0.0], with_summary) == {"answer": "after summary"}
+    # The degraded-mode fallback takes any history
+    assert cache.lookup([1.0, 0.0], history=None) == {"answer": "after summary"}
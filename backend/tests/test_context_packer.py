@@ -0,0 +1,34 @@
+# test_context_packer.py
+from langchain_core.documents import Document
+
+from context_packer import pack_context
+from text_utils import estimate_tokens
+
+
+def doc(text: str, source: str = "") -> Document:
+    return Document(page_content=text, metadata={"source": source})
+
+
+def test_near_duplicates_are_dropped_and_query_matches_rank_first():
+    docs = [
+        doc("the weather today is sunny and warm", "a"),
+        doc("the weather today is sunny and warm again", "b"),
+        doc("reset your password from the account settings page", "c"),
+    ]
+    packed = pack_context("reset password", docs, token_budget=100, max_docs=3)
+    assert [d.metadata["source"] for d in packed] == ["c", "a"]
+
+
+def test_chunks_over_budget_are_skipped_for_smaller_ones():
+    docs = [doc("word " * 200, "big"), doc("small chunk", "small")]
+    packed = pack_context("word", docs, token_budget=20, max_docs=2)
+    assert [d.metadata["source"] for d in packed] == ["small"]
+
+
+def test_the_top_chunk_is_truncated_when_nothing_fits():
+    docs = [doc("refund policy " * 100, "best"), doc("refund " * 300, "second")]
+    packed = pack_context("refund policy", docs, token_budget=30, max_docs=2)
+    assert [d.metadata["source"] for d in packed] == ["best"]
+    assert estimate_tokens(packed[0].page_content) <= 30
+    assert packed[0].page_content.startswith("refund policy refund policy")
+    assert not packed[0].page_content.endswith(" ")
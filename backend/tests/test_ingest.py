@@ -0,0 +1,91 @@
+# test_ingest.py
+import pytest
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from ingest import Checkpoint, Ingestor
+
+
+class CountingEmbeddings:
+    def __init__(self):
+        self.embedded = []
+
+    def embed_documents(self, texts):
+        self.embedded.extend(texts)
+        return [[float(len(text)), 1.0] for text in texts]
+
+
+class MemoryWriter:
+    """Stands in for the vector store; can fail once after `fail_after` upserts"""
+    def __init__(self, fail_after: int = None):
+        self.chunks = {}
+        self.upserts = 0
+        self.fail_after = fail_after
+
+    def upsert(self, chunks, embeddings):
+        if self.fail_after is not None and self.upserts >= self.fail_after:
+            self.fail_after = None
+            raise ConnectionError("upsert failed")
+        self.upserts += 1
+        for chunk in chunks:
+            self.chunks[chunk.id] = chunk.page_content
+
+    def delete(self, ids):
+        for chunk_id in ids:
+            self.chunks.pop(chunk_id, None)
+
+
+def ingestor(tmp_path, writer, embeddings=None, batch_size=2):
+    splitter = RecursiveCharacterTextSplitter(chunk_size=12, chunk_overlap=0, separators=["\n"], keep_separator=False)
+    checkpoint = Checkpoint(tmp_path / "checkpoint.json")
+    return Ingestor(embeddings or CountingEmbeddings(), writer, checkpoint, splitter, batch_size, concurrency=1)
+
+
+@pytest.fixture
+def docs(tmp_path):
+    directory = tmp_path / "docs"
+    directory.mkdir()
+    (directory / "a.txt").write_text("alpha one\nalpha two\nshared line")
+    (directory / "b.md").write_text("beta one\nshared line")
+    (directory / "c.jsonl").write_text('{"text": "gamma one", "lang": "en"}\n\n{"content": "gamma two"}\n')
+    return directory
+
+
+def test_unchanged_files_are_skipped_on_the_next_run(tmp_path, docs):
+    writer = MemoryWriter()
+    first = ingestor(tmp_path, writer).run(docs)
+    assert first["files"] == 3
+    assert sorted(writer.chunks.values()) == sorted(
+        ["alpha one", "alpha two", "shared line", "beta one", "gamma one", "gamma two"]
+    )
+
+    embeddings = CountingEmbeddings()
+    second = ingestor(tmp_path, writer, embeddings).run(docs)
+    assert second["skipped_files"] == 3
+    assert embeddings.embedded == []
+
+
+def test_an_interrupted_run_resumes_without_re_embedding_finished_files(tmp_path, docs):
+    writer = MemoryWriter(fail_after=1)
+    with pytest.raises(ConnectionError):
+        ingestor(tmp_path, writer, batch_size=3).run(docs)
+    # Only files whose batches were all written made it into the checkpoint
+    recorded = set(Checkpoint(tmp_path / "checkpoint.json").files)
+    assert recorded == {"a.txt"}
+
+    embeddings = CountingEmbeddings()
+    stats = ingestor(tmp_path, writer, embeddings, batch_size=3).run(docs)
+    assert stats["skipped_files"] == 1
+    assert "alpha one" not in embeddings.embedded
+    assert len(writer.chunks) == 6
+
+
+def test_changed_and_removed_files_drop_only_unshared_chunks(tmp_path, docs):
+    writer = MemoryWriter()
+    ingestor(tmp_path, writer).run(docs)
+
+    (docs / "a.txt").write_text("alpha three\nshared line")
+    (docs / "c.jsonl").unlink()
+    stats = ingestor(tmp_path, writer).run(docs)
+
+    assert sorted(writer.chunks.values()) == ["alpha three", "beta one", "shared line"]
+    assert stats["deleted"] == 4
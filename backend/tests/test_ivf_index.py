@@ -0,0 +1,71 @@
+# test_ivf_index.py
+import numpy as np
+
+from ivf_index import IVFIndex, recall_report
+
+
+def unit_vectors(count: int, dim: int = 16, seed: int = 0) -> np.ndarray:
+    vectors = np.random.default_rng(seed).normal(size=(count, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def test_probing_every_list_matches_exact_search():
+    vectors = unit_vectors(500)
+    index = IVFIndex.build(vectors, nlist=10)
+    assert index.num_rows == 500
+    assert sorted(index.rows.tolist()) == list(range(500))
+
+    report = dict((setting, recall) for setting, recall, _ in recall_report(vectors, index, 5, [1, 10], num_queries=50))
+    assert report["nprobe=10"] == 1.0
+    assert report["nprobe=1"] <= 1.0
+
+
+def test_save_and_load_round_trip(tmp_path):
+    vectors = unit_vectors(200)
+    index = IVFIndex.build(vectors, nlist=8)
+    index.save(tmp_path)
+    assert IVFIndex.exists(tmp_path)
+    loaded = IVFIndex.load(tmp_path)
+    query = vectors[3]
+    assert loaded.candidates(query, 2).tolist() == index.candidates(query, 2).tolist()
+
+
+def test_recall_with_empty_probes_and_a_corpus_smaller_than_k():
+    # Three rows all pointing roughly along the first axis
+    vectors = unit_vectors(3) * 0.1
+    vectors[:, 0] = 1
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    axis = np.eye(16, dtype=np.float32)[0]
+    centroids = np.stack([axis, -axis])
+    index = IVFIndex(centroids, np.array([0, 3, 3]), np.arange(3))
+
+    report = dict((setting, recall) for setting, recall, _ in recall_report(vectors, index, 10, [2], noise=0))
+    # k=10 but only 3 rows exist: finding all of them is full recall
+    assert report["nprobe=2"] == 1.0
+
+    # Now the list every query probes first is empty
+    empty = IVFIndex(centroids, np.array([0, 0, 3]), np.arange(3))
+    assert empty.candidates(vectors[0], 1).tolist() == []
+    report = dict((setting, recall) for setting, recall, _ in recall_report(vectors, empty, 10, [1], noise=0))
+    assert report["nprobe=1"] == 0.0
+
+
+def test_store_scans_rows_added_after_the_ivf_build(tmp_path):
+    from local_vector_store import LocalVectorStore
+
+    vectors = unit_vectors(100)
+    store = LocalVectorStore(tmp_path, embedding=None)
+    store.add_embeddings([str(i) for i in range(100)], vectors.tolist(), ids=[str(i) for i in range(100)])
+    IVFIndex.build(store.vectors, nlist=4).save(tmp_path)
+
+    ivf_store = LocalVectorStore(tmp_path, embedding=None, index_type="ivf", nprobe=1)
+    assert ivf_store.ann is not None
+    query = unit_vectors(1, seed=9)[0]
+    ivf_store.add_embeddings(["new"], [query.tolist()], ids=["new"])
+    # Not in any IVF list, but found by the exact scan of the tail
+    assert ivf_store.search_by_vector(query.tolist(), k=1)[0][0] == 100
+
+    # Deleting rows shifts them, so the IVF index is dropped
+    ivf_store.delete(["0"])
+    assert not IVFIndex.exists(tmp_path)
+    assert ivf_store.ann is None
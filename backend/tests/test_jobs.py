@@ -0,0 +1,91 @@
+# test_jobs.py
+import asyncio
+
+import mongomock
+import pytest
+from pymongo.errors import DuplicateKeyError
+
+from jobs import JobQueue
+
+
+async def run_inline(fn, *args):
+    return fn(*args)
+
+
+@pytest.fixture
+def queue():
+    queue = JobQueue(mongomock.MongoClient().db.jobs, run_inline, base_delay=0, max_attempts=2)
+    queue.register("noop", lambda params, progress: {"done": params["n"]})
+    return queue
+
+
+def test_enqueue_with_the_same_key_returns_the_active_job(queue):
+    first = asyncio.run(queue.enqueue("noop", {"n": 1}, dedupe_key="k"))
+    second = asyncio.run(queue.enqueue("noop", {"n": 2}, dedupe_key="k"))
+    assert first == second
+    assert queue.collection.count_documents({}) == 1
+
+
+def test_only_one_active_job_per_key(queue):
+    asyncio.run(queue.enqueue("noop", {"n": 1}, dedupe_key="k"))
+    with pytest.raises(DuplicateKeyError):
+        queue.collection.insert_one({"_id": "other", "status": "pending", "dedupe_key": "k"})
+
+
+def test_enqueue_losing_the_insert_race_returns_the_winner(queue):
+    collection = queue.collection
+    find_one_and_update = collection.find_one_and_update
+
+    def concurrent_insert(*args, **kwargs):
+        # Another process inserts the job after our lookup found nothing
+        collection.insert_one({"_id": "winner", "job_id": "winner", "status": "pending", "dedupe_key": "k"})
+        raise DuplicateKeyError("E11000 duplicate key error")
+
+    collection.find_one_and_update = concurrent_insert
+    try:
+        job_id = asyncio.run(queue.enqueue("noop", {"n": 1}, dedupe_key="k"))
+    finally:
+        collection.find_one_and_update = find_one_and_update
+    assert job_id == "winner"
+
+
+def test_a_finished_job_frees_its_key(queue):
+    first = asyncio.run(queue.enqueue("noop", {"n": 1}, dedupe_key="k"))
+    queue._execute(queue._claim())
+    assert queue.get(first)["status"] == "succeeded"
+    second = asyncio.run(queue.enqueue("noop", {"n": 2}, dedupe_key="k"))
+    assert second != first
+
+
+def test_failed_attempts_are_retried_then_marked_failed(queue):
+    queue.register("boom", lambda params, progress: 1 / 0)
+    job_id = asyncio.run(queue.enqueue("boom", {}))
+    queue._execute(queue._claim())
+    assert queue.get(job_id)["status"] == "pending"
+    queue._execute(queue._claim())
+    job = queue.get(job_id)
+    assert job["status"] == "failed" and job["attempts"] == 2
+
+
+def test_job_endpoint_hides_params_and_results(queue, monkeypatch):
+    import httpx
+
+    import main
+
+    queue.register("purge_session", lambda params, progress: {"messages_deleted": 3, "user_id": "u1"})
+    job_id = asyncio.run(queue.enqueue("purge_session", {"session_id": "s1", "user_id": "u1"}))
+    queue._execute(queue._claim())
+    monkeypatch.setattr(main, "get_job_queue", lambda: queue)
+    monkeypatch.setattr(main.warmup, "ready", True)
+
+    async def request(path: str):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.get(path)
+
+    response = asyncio.run(request(f"/api/jobs/{job_id}"))
+    assert response.status_code == 200
+    body = response.json()
+    assert body["status"] == "succeeded"
+    assert not {"params", "result", "error"} & body.keys()
+    assert asyncio.run(request("/api/jobs/unknown")).status_code == 404
@@ -0,0 +1,83 @@
+# test_local_vector_store.py
+import numpy as np
+
+from local_vector_store import LocalVectorStore
+
+
+def embeddings(count: int, dim: int = 8, seed: int = 0) -> list:
+    return np.random.default_rng(seed).normal(size=(count, dim)).tolist()
+
+
+def test_every_write_records_a_new_index_version(tmp_path):
+    store = LocalVectorStore(tmp_path, embedding=None)
+    versions = [store.version]
+    store.add_embeddings(["a", "b"], embeddings(2), ids=["a", "b"])
+    versions.append(store.version)
+    store.delete(["a"])
+    versions.append(store.version)
+    assert len(set(versions)) == 3
+
+    # Re-adding known ids writes nothing, so the version stays
+    store.add_embeddings(["b"], embeddings(1), ids=["b"])
+    assert store.version == versions[-1]
+    # Another process (the app) reads the version from meta.json
+    assert LocalVectorStore(tmp_path, embedding=None).version == versions[-1]
+
+
+class FixedEmbeddings:
+    """Embeds every query as the same vector"""
+    def __init__(self, vector):
+        self.vector = list(vector)
+
+    def embed_query(self, text):
+        return self.vector
+
+    async def aembed_query(self, text):
+        return self.vector
+
+
+def test_search_matches_brute_force_cosine(tmp_path):
+    vectors = embeddings(50, seed=1)
+    store = LocalVectorStore(tmp_path, embedding=None)
+    store.add_embeddings([f"t{i}" for i in range(50)], vectors, [{"i": i} for i in range(50)])
+
+    query = np.random.default_rng(2).normal(size=8)
+    matrix = np.asarray(vectors)
+    cosine = matrix @ query / np.linalg.norm(matrix, axis=1) / np.linalg.norm(query)
+    expected = np.argsort(-cosine)[:5].tolist()
+
+    results = store.search_by_vector(query.tolist(), k=5)
+    assert [row for row, _ in results] == expected
+    assert np.allclose([score for _, score in results], cosine[expected], atol=1e-5)
+    assert store.search_by_vector(query.tolist(), k=100)[0][0] == expected[0]
+
+
+def test_async_search_on_a_thread_matches_the_inline_one(tmp_path, monkeypatch):
+    import asyncio
+
+    import local_vector_store
+
+    query = embeddings(1, seed=3)[0]
+    store = LocalVectorStore(tmp_path, embedding=FixedEmbeddings(query))
+    store.add_embeddings([f"t{i}" for i in range(20)], embeddings(20), ids=[f"d{i}" for i in range(20)])
+
+    inline = asyncio.run(store.asimilarity_search("q", k=3))
+    monkeypatch.setattr(local_vector_store, "ASYNC_THREAD_THRESHOLD", 0)
+    threaded = asyncio.run(store.asimilarity_search("q", k=3))
+    assert [doc.id for doc in inline] == [doc.id for doc in threaded] == [doc.id for doc in store.similarity_search("q", k=3)]
+
+
+def test_an_append_that_crashed_before_meta_json_is_ignored_and_overwritten(tmp_path):
+    store = LocalVectorStore(tmp_path, embedding=None)
+    store.add_embeddings(["a"], embeddings(1), ids=["a"])
+    # Leftovers of an append that died after writing the data files
+    with open(tmp_path / "vectors.f32", "ab") as f:
+        f.write(b"\0" * 32)
+    with open(tmp_path / "docs.jsonl", "a") as f:
+        f.write('{"id": "ghost", "text": "x", "metadata": {}}\n')
+
+    reopened = LocalVectorStore(tmp_path, embedding=None)
+    assert reopened.ids == ["a"]
+    reopened.add_embeddings(["b"], embeddings(1, seed=5), ids=["b"])
+    assert LocalVectorStore(tmp_path, embedding=None).ids == ["a", "b"]
+    assert (tmp_path / "vectors.f32").stat().st_size == 2 * 8 * 4
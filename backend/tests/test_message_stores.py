@@ -0,0 +1,94 @@
+# test_message_stores.py
+import random
+import uuid
+from datetime import datetime, timedelta
+
+import mongomock
+import pytest
+
+from message_stores import BucketMessageStore, DocumentMessageStore, _position
+
+
+def make_messages(count: int, session_id: str = "s1") -> list:
+    """Messages in pairs sharing a millisecond, as build_turn writes them, with random ids"""
+    start = datetime(2025, 1, 1)
+    return [
+        {
+            "message_id": str(uuid.uuid4()),
+            "session_id": session_id,
+            "type": "human" if i % 2 == 0 else "ai",
+            "content": f"message {i}",
+            "timestamp": start + timedelta(milliseconds=i // 2),
+        }
+        for i in range(count)
+    ]
+
+
+def insert_in_batches(store, messages: list, seed: int = 0):
+    # Uneven batches leave buckets with overlapping time ranges
+    rng = random.Random(seed)
+    i = 0
+    while i < len(messages):
+        size = rng.choice((1, 2, 3))
+        store.insert(messages[i:i + size])
+        i += size
+
+
+@pytest.fixture(params=["document", "bucket"])
+def store(request):
+    db = mongomock.MongoClient().db
+    if request.param == "bucket":
+        store = BucketMessageStore(db.message_buckets, bucket_size=4)
+    else:
+        store = DocumentMessageStore(db.messages)
+    store.create_indexes()
+    return store
+
+
+def ids(messages: list) -> list:
+    return [message["message_id"] for message in messages]
+
+
+def test_forward_paging_returns_every_message_in_order(store):
+    messages = make_messages(46)
+    insert_in_batches(store, messages)
+    expected = ids(sorted(messages, key=_position))
+
+    seen, after = [], None
+    while True:
+        page = store.page("s1", 5, after=after)
+        if not page:
+            break
+        seen.extend(ids(page))
+        after = _position(page[-1])
+    assert seen == expected
+
+
+def test_backward_paging_returns_every_message_in_order(store):
+    messages = make_messages(46)
+    insert_in_batches(store, messages, seed=1)
+    expected = ids(sorted(messages, key=_position))
+
+    page = store.page("s1", 5, newest=True)
+    seen = ids(page)
+    while page:
+        page = store.page("s1", 5, before=_position(page[0]))
+        seen = ids(page) + seen
+    assert seen == expected
+
+
+def test_after_returns_messages_past_a_timestamp(store):
+    messages = make_messages(46)
+    insert_in_batches(store, messages, seed=2)
+    cutoff = messages[20]["timestamp"]
+    expected = ids(sorted((m for m in messages if m["timestamp"] > cutoff), key=_position))[:7]
+    assert ids(store.after("s1", cutoff, 7)) == expected
+
+
+def test_retried_insert_is_a_no_op(store):
+    if isinstance(store, BucketMessageStore):
+        pytest.skip("mongomock doesn't enforce the unique index on embedded message ids")
+    messages = make_messages(6)
+    store.insert(messages)
+    store.insert(messages[2:5])
+    assert ids(store.page("s1", 100)) == ids(sorted(messages, key=_position))
@@ -0,0 +1,72 @@
+# test_metrics.py
+import asyncio
+
+import mongomock
+
+from metrics import _request_timings, record_stage
+from session_services import AsyncChatSessionService, ChatSessionService
+
+
+def test_stages_recorded_on_the_mongo_pool_reach_the_request():
+    service = AsyncChatSessionService(ChatSessionService(client=mongomock.MongoClient()), max_workers=2)
+
+    def timed_call():
+        record_stage("inner", 0.001)
+        return "ok"
+
+    async def request():
+        timings = []
+        _request_timings.set(timings)
+        assert await service.run(timed_call) == "ok"
+        return timings
+
+    timings = asyncio.run(request())
+    service.shutdown()
+    assert [stage for stage, _ in timings] == ["inner", "mongo_timed_call"]
+
+
+def test_chat_requests_get_server_timing_and_stage_histograms():
+    import httpx
+    from fastapi import FastAPI
+
+    from metrics import REGISTRY, Histogram, MetricsMiddleware, render_metrics, stage_timer
+
+    app = FastAPI()
+    app.add_middleware(MetricsMiddleware)
+
+    @app.get("/api/chat/probe/{item}")
+    async def probe(item: str):
+        with stage_timer("probe_stage"):
+            pass
+        with stage_timer("probe_stage"):
+            pass
+        return {"item": item}
+
+    @app.get("/other")
+    async def other():
+        with stage_timer("probe_stage"):
+            pass
+        return {}
+
+    async def requests():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.get("/api/chat/probe/1"), await client.get("/other")
+
+    chat, other = asyncio.run(requests())
+    # Repeated stages are summed into one entry; only chat routes get the header
+    assert chat.headers["server-timing"].startswith("probe_stage;dur=")
+    assert "," not in chat.headers["server-timing"]
+    assert "server-timing" not in other.headers
+
+    rendered = render_metrics()
+    assert 'chat_stage_seconds_count{stage="probe_stage"} 3' in rendered
+    assert 'chat_stage_seconds_bucket{stage="probe_stage",le="+Inf"} 3' in rendered
+    assert 'http_request_duration_seconds_count{method="GET",route="/api/chat/probe/{item}",status="200"} 1' in rendered
+
+    histogram = Histogram("test_seconds", "Test histogram", buckets=(0.1, 1.0))
+    REGISTRY.remove(histogram)
+    histogram.observe(0.5)
+    assert histogram.render()[2:5] == [
+        'test_seconds_bucket{le="0.1"} 0', 'test_seconds_bucket{le="1.0"} 1', 'test_seconds_bucket{le="+Inf"} 1',
+    ]
@@ -0,0 +1,89 @@
+# test_pagination.py
+import asyncio
+from datetime import datetime, timedelta
+
+import httpx
+import mongomock
+import pytest
+
+import main
+from pagination import decode_cursor, encode_cursor
+from session_services import AsyncChatSessionService, ChatSessionService
+
+
+def test_cursor_round_trip_keeps_milliseconds():
+    timestamp = datetime(2024, 5, 1, 12, 30, 45, 123456)
+    assert decode_cursor(encode_cursor(timestamp, "id|with|bars")) == (timestamp.replace(microsecond=123000), "id|with|bars")
+
+
+def test_malformed_cursor_is_a_value_error():
+    with pytest.raises(ValueError):
+        decode_cursor("not a cursor")
+
+
+@pytest.fixture
+def client(monkeypatch):
+    service = ChatSessionService(client=mongomock.MongoClient())
+    async_service = AsyncChatSessionService(service, max_workers=1)
+    monkeypatch.setattr(main, "get_async_session_service", lambda: async_service)
+    monkeypatch.setattr(main.warmup, "ready", True)
+
+    def get(path: str, **params):
+        async def request():
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                return await client.get(path, params=params)
+        return asyncio.run(request())
+
+    yield service, get
+    async_service.shutdown()
+
+
+def test_walking_messages_backwards_visits_each_once(client):
+    service, get = client
+    session_id = service.create_session("u1")
+    start = datetime(2024, 1, 1)
+    # Pairs share a timestamp, so pages must break ties on the message id
+    docs = [
+        service.build_message(session_id, "user", f"m{i}", start + timedelta(seconds=i // 2))
+        for i in range(11)
+    ]
+    service.write_messages(docs)
+
+    seen, page = [], get(f"/api/chat/messages/{session_id}", limit=4, latest=True).json()
+    while True:
+        seen = [message["content"] for message in page["messages"]] + seen
+        if not page["has_more"]:
+            break
+        page = get(f"/api/chat/messages/{session_id}", limit=4, before=page["prev_cursor"]).json()
+    assert sorted(seen) == sorted(doc["content"] for doc in docs)
+    assert len(seen) == len(set(seen))
+
+    forward = get(f"/api/chat/messages/{session_id}", limit=4).json()
+    after = get(f"/api/chat/messages/{session_id}", limit=4, after=forward["next_cursor"]).json()
+    assert not {m["id"] for m in forward["messages"]} & {m["id"] for m in after["messages"]}
+
+
+def test_session_pages_follow_next_cursor(client):
+    service, get = client
+    created = {service.create_session("u1") for _ in range(5)}
+
+    seen, page = [], get("/api/users/u1/sessions", limit=2).json()
+    while True:
+        seen += [session["session_id"] for session in page["sessions"]]
+        if not page["has_more"]:
+            break
+        page = get("/api/users/u1/sessions", limit=2, before=page["next_cursor"]).json()
+    assert sorted(seen) == sorted(created)
+
+
+@pytest.mark.parametrize("limit", [0, -1, 201])
+def test_out_of_range_limits_are_rejected(client, limit):
+    service, get = client
+    assert get("/api/chat/messages/s1", limit=limit).status_code == 422
+    assert get("/api/users/u1/sessions", limit=limit).status_code == 422
+
+
+def test_bad_cursor_is_a_400(client):
+    service, get = client
+    assert get("/api/chat/messages/s1", before="%%%").status_code == 400
@@ -0,0 +1,78 @@
+# test_password_hashing.py
+import asyncio
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+import password_hashing
+from admission import AdmissionRejected
+from password_hashing import PasswordHasher, crypt_context
+
+
+async def max_loop_lag(work, interval: float = 0.005) -> float:
+    """Largest delay of a periodic tick on the event loop while `work` runs"""
+    lags = []
+
+    async def tick():
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(interval)
+            lags.append(time.perf_counter() - start - interval)
+
+    ticker = asyncio.ensure_future(tick())
+    await asyncio.sleep(interval * 2)
+    await work
+    ticker.cancel()
+    return max(lags)
+
+
+def test_hashing_does_not_stall_the_event_loop():
+    hasher = PasswordHasher(rounds=10, workers=2)
+
+    async def scenario():
+        hashes = asyncio.gather(*(hasher.hash(f"password{i}") for i in range(4)))
+        return await max_loop_lag(hashes)
+
+    try:
+        lag = asyncio.run(scenario())
+    finally:
+        hasher.shutdown()
+    # One bcrypt at 10 rounds takes ~60 ms; held on the loop, the lag would be at least that
+    assert lag < 0.03
+
+
+def test_gil_holding_backend_falls_back_to_processes(monkeypatch):
+    monkeypatch.setattr(password_hashing, "bcrypt_releases_gil", lambda: False)
+    hasher = PasswordHasher(rounds=4, workers=1, executor="thread")
+    try:
+        assert isinstance(hasher._executor, ProcessPoolExecutor)
+        assert crypt_context(4).verify("pw", asyncio.run(hasher.hash("pw")))
+    finally:
+        hasher.shutdown()
+
+
+def test_full_queue_is_rejected_with_503():
+    hasher = PasswordHasher(rounds=8, workers=1, max_queue=1)
+
+    async def scenario():
+        return await asyncio.gather(*(hasher.hash("pw") for _ in range(3)), return_exceptions=True)
+
+    try:
+        results = asyncio.run(scenario())
+    finally:
+        hasher.shutdown()
+    rejected = [result for result in results if isinstance(result, AdmissionRejected)]
+    assert len(rejected) == 1 and rejected[0].status_code == 503 and rejected[0].retry_after >= 1
+
+
+def test_login_upgrades_an_outdated_hash():
+    hasher = PasswordHasher(rounds=5, workers=1)
+    old_hash = crypt_context(4).hash("pw")
+    try:
+        ok, new_hash = asyncio.run(hasher.verify_and_rehash("pw", old_hash))
+        assert ok and new_hash.startswith("$2b$05$")
+        assert asyncio.run(hasher.verify_and_rehash("pw", new_hash)) == (True, None)
+        assert asyncio.run(hasher.verify_and_rehash("wrong", new_hash)) == (False, None)
+    finally:
+        hasher.shutdown()
@@ -0,0 +1,36 @@
+# test_resilience.py
+import time
+
+import pytest
+
+from resilience import CircuitBreaker, Upstream, UpstreamUnavailable
+
+
+def test_breaker_opens_after_consecutive_failures_and_recovers():
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=0.05)
+    breaker.record_failure()
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    with pytest.raises(UpstreamUnavailable):
+        breaker.before_call()
+
+    time.sleep(0.06)
+    breaker.before_call()  # the single half-open trial
+    with pytest.raises(UpstreamUnavailable):
+        breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+
+def test_sync_call_retries_then_gives_up():
+    upstream = Upstream("flaky", retries=2, base_delay=0, failure_threshold=10)
+    calls = []
+
+    def fail():
+        calls.append(1)
+        raise ConnectionError("down")
+
+    with pytest.raises(UpstreamUnavailable):
+        upstream.call_sync(fail)
+    assert len(calls) == 3
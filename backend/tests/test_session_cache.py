@@ -0,0 +1,27 @@
+# test_session_cache.py
+from datetime import datetime
+
+from session_cache import SessionCache
+
+
+def message(session_id: str, message_id: str) -> dict:
+    return {"message_id": message_id, "session_id": session_id, "type": "user", "content": message_id, "timestamp": datetime.utcnow()}
+
+
+def test_a_load_is_cached_when_nothing_wrote_meanwhile():
+    cache = SessionCache(max_sessions=10, max_users=10, history_size=5, ttl_seconds=60)
+    version = cache.version(("session", "s1"))
+    cache.put_history("s1", [message("s1", "m1")], True, version)
+    assert [msg["message_id"] for msg in cache.get_recent("s1", 5)] == ["m1"]
+
+
+def test_a_slow_load_is_not_cached_after_its_version_was_evicted():
+    cache = SessionCache(max_sessions=1, max_users=1, history_size=5, ttl_seconds=60)
+    version = cache.version(("session", "s1"))
+    # A write lands while the load is in flight, then other sessions push
+    # s1's version out of the bounded map
+    cache.append_messages([message("s1", "m2")])
+    cache.append_messages([message("s2", "x"), message("s3", "y")])
+
+    cache.put_history("s1", [message("s1", "m1")], True, version)
+    assert cache.get_recent("s1", 5) is None
@@ -0,0 +1,219 @@
+# test_session_services.py
+import asyncio
+import threading
+
+import mongomock
+import pytest
+
+from session_services import AsyncChatSessionService, ChatSessionService, MessageWriteBuffer
+
+
+@pytest.fixture
+def service():
+    return ChatSessionService(client=mongomock.MongoClient())
+
+
+def message_count(service, session_id: str) -> int:
+    return service.sessions.find_one({"session_id": session_id})["message_count"]
+
+
+def test_retried_write_counts_messages_once(service):
+    session_id = service.create_session("u1")
+    docs = service.build_turn(session_id, "hi", "hello")
+    service.write_messages(docs)
+    service.write_messages(docs)
+    service.write_messages(docs[1:])
+    assert message_count(service, session_id) == 2
+    assert service.messages.count_documents({"session_id": session_id}) == 2
+
+
+def test_buffer_retry_after_a_failed_write_counts_once(service):
+    session_id = service.create_session("u1")
+    calls = []
+
+    def write_then_fail_once(docs):
+        # The write lands but the caller sees an error (e.g. a lost ack)
+        service.write_messages(docs)
+        calls.append(len(docs))
+        if len(calls) == 1:
+            raise ConnectionError("connection reset")
+
+    async def scenario():
+        async_service = AsyncChatSessionService(service, max_workers=2)
+        buffer = MessageWriteBuffer(async_service.run, write_then_fail_once, flush_interval=0.01)
+        await buffer.add(service.build_turn(session_id, "hi", "hello"))
+        await asyncio.sleep(0.3)
+        await buffer.close()
+        async_service.shutdown()
+
+    asyncio.run(scenario())
+    assert len(calls) == 2
+    assert message_count(service, session_id) == 2
+
+
+def test_close_lets_an_in_flight_write_finish(service):
+    session_id = service.create_session("u1")
+    writing = threading.Event()
+    release = threading.Event()
+    writes = []
+
+    def slow_write(docs):
+        writing.set()
+        release.wait(5)
+        writes.append(len(docs))
+        service.write_messages(docs)
+
+    async def scenario():
+        async_service = AsyncChatSessionService(service, max_workers=2)
+        buffer = MessageWriteBuffer(async_service.run, slow_write, flush_interval=0.01)
+        await buffer.add(service.build_turn(session_id, "hi", "hello"))
+        await asyncio.get_running_loop().run_in_executor(None, writing.wait, 5)
+        closing = asyncio.ensure_future(buffer.close())
+        await asyncio.sleep(0.05)
+        release.set()
+        await closing
+        async_service.shutdown()
+
+    asyncio.run(scenario())
+    assert writes == [2]
+    assert message_count(service, session_id) == 2
+
+
+def test_rotating_a_guest_session_keeps_one_active_session(service):
+    first = service.create_session("anon_1")
+    service.write_messages(service.build_turn(first, "hi", "hello"))
+
+    second, previous = service.rotate_anonymous_session("anon_1")
+    third, previous_again = service.rotate_anonymous_session("anon_1")
+
+    assert (previous, previous_again) == (first, second)
+    active = list(service.sessions.find({"user_id": "anon_1", "is_active": True}))
+    assert [doc["session_id"] for doc in active] == [third]
+    assert active[0]["message_count"] == 0
+
+    assert service.purge_session(first) == {"messages_deleted": 2}
+    assert service.messages.count_documents({}) == 0
+
+
+def test_rotating_without_a_session_creates_one(service):
+    session_id, previous = service.rotate_anonymous_session("anon_2")
+    assert previous is None
+    assert service.get_session_owner(session_id) == "anon_2"
+
+
+def test_late_writes_to_deleted_or_replaced_sessions_are_dropped(service):
+    live = service.create_session("u1")
+    deleted = service.create_session("u1")
+    rotated = service.create_session("anon_1")
+    service.deactivate_session(deleted)
+    service.rotate_anonymous_session("anon_1")
+    assert service.get_session_owner(deleted) is None
+    assert service.get_session_owner(rotated) is None
+
+    # Turns of prompts that were in flight when the sessions went away
+    service.write_messages(
+        service.build_turn(live, "a", "b") + service.build_turn(deleted, "c", "d") + service.build_turn(rotated, "e", "f")
+    )
+    service.add_message(deleted, "user", "late")
+
+    assert service.messages.distinct("session_id") == [live]
+    assert message_count(service, live) == 2
+
+
+def test_prompts_to_deleted_sessions_are_rejected(service, monkeypatch):
+    import httpx
+
+    import main
+
+    session_id = service.create_session("u1")
+    service.deactivate_session(session_id)
+    async_service = AsyncChatSessionService(service, max_workers=1)
+    monkeypatch.setattr(main, "get_async_session_service", lambda: async_service)
+    monkeypatch.setattr(main.warmup, "ready", True)
+
+    async def prompt(path: str):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post(path, json={"prompt": "hi", "session_id": session_id})
+
+    try:
+        for path in ("/api/chat/prompt", "/api/chat/prompt/stream"):
+            assert asyncio.run(prompt(path)).status_code == 404
+    finally:
+        async_service.shutdown()
+
+
+def test_guest_sessions_are_listed_right_after_sign_up(service):
+    from auth_service import AuthService, UserCreate
+    from jobs import JobQueue
+    from password_hashing import PasswordHasher
+
+    guest_session = service.create_session("anon_1")
+    old_session = service.create_session("anon_1")
+    service.deactivate_session(old_session)
+    async_service = AsyncChatSessionService(service, max_workers=1)
+    # The queue is never started: only what sign-up does inline has happened
+    jobs = JobQueue(service.db.jobs, async_service.run)
+    jobs.register("migrate_sessions", lambda params, progress: None)
+    hasher = PasswordHasher(rounds=4, workers=1)
+    auth = AuthService(service, service.users, hasher=hasher, run=async_service.run, jobs=jobs)
+
+    try:
+        user = asyncio.run(auth.aregister_user(UserCreate(email="a@b.c", password="pw", name="A"), "anon_1"))
+    finally:
+        hasher.shutdown()
+        async_service.shutdown()
+
+    user_id = user["user_id"]
+    assert [s["session_id"] for s in service.get_user_sessions(user_id)] == [guest_session]
+    assert service.get_session_owner(guest_session) == user_id
+    # The replaced session moves with the queued job
+    assert jobs.collection.count_documents({"kind": "migrate_sessions"}) == 1
+
+
+def test_streamed_prompt_compacts_only_after_the_turn_is_saved(service, monkeypatch):
+    import httpx
+
+    import main
+    from resilience import UpstreamUnavailable
+
+    compacted = []
+
+    class FakeRag:
+        def __init__(self, fail: bool):
+            self.fail = fail
+
+        def build_chat_history(self, messages, summary):
+            return []
+
+        async def astream_response(self, prompt, history):
+            yield "partial"
+            if self.fail:
+                raise UpstreamUnavailable("llm", "circuit open")
+
+        async def acompact_session(self, session_id, session_service):
+            compacted.append(session_id)
+
+    session_id = service.create_session("u1")
+    async_service = AsyncChatSessionService(service, max_workers=1)
+    monkeypatch.setattr(main, "get_async_session_service", lambda: async_service)
+    monkeypatch.setattr(main.warmup, "ready", True)
+
+    async def stream():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post("/api/chat/prompt/stream", json={"prompt": "hi", "session_id": session_id})
+
+    try:
+        monkeypatch.setattr(main, "get_rag_service", lambda: FakeRag(fail=True))
+        assert "event: error" in asyncio.run(stream()).text
+        assert compacted == []
+        # The prompt is kept even though no answer came back
+        assert [m["type"] for m in service.get_recent_messages(session_id)] == ["user"]
+
+        monkeypatch.setattr(main, "get_rag_service", lambda: FakeRag(fail=False))
+        assert "event: done" in asyncio.run(stream()).text
+        assert compacted == [session_id]
+        assert [m["type"] for m in service.get_recent_messages(session_id)] == ["user", "user", "ai"]
+    finally:
+        async_service.shutdown()
@@ -0,0 +1,31 @@
+# test_warmup.py
+import asyncio
+
+import httpx
+import pytest
+
+import main
+
+
+def failing_step():
+    raise ConnectionError("mongo unreachable")
+
+
+@pytest.fixture
+def failing_warmup(monkeypatch):
+    monkeypatch.setattr(main.warmup, "steps", [("sessions", failing_step)])
+    monkeypatch.setattr(main.warmup, "_task", None)
+
+
+def test_warmup_failure_is_a_503_with_cors_headers(failing_warmup):
+    origin = main.settings.cors_origins[0]
+
+    async def request():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.get("/api/users/u1/sessions", headers={"Origin": origin})
+
+    response = asyncio.run(request())
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "5"
+    assert response.headers["access-control-allow-origin"] == origin
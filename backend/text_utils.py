@@ -0,0 +1,22 @@
+# text_utils.py
+# Small text helpers shared by the RAG and session services
+import re
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap token estimate (~4 characters per token for English text).
+    Good enough for budgeting prompt size without a tokenizer round-trip.
+    """
+    if not text:
+        return 0
+    return len(text) // 4 + 1
+
+
+# Words plus codes like "E-1042", "v2.3" or "account_id" kept as single tokens
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-_.][a-z0-9]+)*")
+
+
+def tokenize(text: str) -> list:
+    """Lowercased lexical tokens for keyword scoring"""
+    return TOKEN_PATTERN.findall(text.lower())
@@ -0,0 +1,87 @@
+# warmup.py
+# Deferred service construction with readiness tracking, so the server starts before its clients do
+import asyncio
+import time
+
+
+class Warmup:
+    """
+    Builds the app's services (`steps`: (name, blocking callable) pairs, run
+    in order on a worker thread) once, shared by every caller. start()
+    kicks it off in the background; ensure() waits for it and starts it
+    again if the last attempt failed. `on_ready` runs on the event loop once
+    everything is built (e.g. to start background workers).
+    """
+    def __init__(self, steps: list, on_ready=None):
+        self.steps = steps
+        self.on_ready = on_ready
+        self.ready = False
+        self.error = None
+        self.completed = []
+        self.started_at = None
+        self.seconds = None
+        self._task = None
+
+    def start(self) -> asyncio.Task:
+        if self._task is None or (self._task.done() and not self.ready):
+            self._task = asyncio.get_running_loop().create_task(self._run())
+            # Failures are reported by status() and retried by ensure()
+            self._task.add_done_callback(lambda task: task.cancelled() or task.exception())
+        return self._task
+
+    async def ensure(self):
+        if not self.ready:
+            # Shielded: a client disconnecting mustn't cancel everyone's warm-up
+            await asyncio.shield(self.start())
+
+    async def _run(self):
+        self.error = None
+        if self.started_at is None:
+            self.started_at = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        try:
+            for name, step in self.steps:
+                if name not in self.completed:
+                    await loop.run_in_executor(None, step)
+                    self.completed.append(name)
+        except Exception as e:
+            self.error = f"{name}: {e}"
+            raise
+        if self.on_ready is not None:
+            self.on_ready()
+        self.seconds = time.perf_counter() - self.started_at
+        self.ready = True
+
+    def status(self) -> dict:
+        return {
+            "ready": self.ready,
+            "completed": list(self.completed),
+            "error": self.error,
+            "warmup_seconds": self.seconds,
+        }
+
+
+class WarmupMiddleware:
+    """
+    ASGI middleware holding requests until the warm-up finished, so handlers
+    never build services on the event loop. Paths in `exempt_paths`
+    (health checks, metrics) are served immediately.
+    """
+    def __init__(self, app, warmup: Warmup, exempt_paths: tuple = ("/health", "/metrics")):
+        self.app = app
+        self.warmup = warmup
+        self.exempt_paths = exempt_paths
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and not self.warmup.ready and not scope["path"].startswith(self.exempt_paths):
+            try:
+                await self.warmup.ensure()
+            except Exception:
+                await send({
+                    "type": "http.response.start",
+                    "status": 503,
+                    "headers": [(b"content-type", b"application/json"), (b"retry-after", b"5")],
+                })
+                await send({"type": "http.response.body", "body": b'{"detail": "Service is starting up"}'})
+                return
+        await self.app(scope, receive, send)
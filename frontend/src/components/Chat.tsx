@@ -20,6 +20,9 @@ const Chat: React.FC<ChatProps> = ({
   const [messages, setMessages] = useState<Message[]>([]);
   const [inputValue, setInputValue] = useState('');
   const [isLoading, setIsLoading] = useState(false);
+  // Cursor of the oldest loaded message while older ones exist
+  const [olderCursor, setOlderCursor] = useState<string | null>(null);
+  const keepScroll = useRef(false);
   
   // Ref for auto-scrolling
   const messagesEndRef = useRef<HTMLDivElement>(null);
@@ -30,21 +33,39 @@ const Chat: React.FC<ChatProps> = ({
     messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' });
   };
 
-  // Scroll to bottom when messages change
+  // Scroll to bottom when messages change (but not when older ones are prepended)
   useEffect(() => {
+    if (keepScroll.current) {
+      keepScroll.current = false;
+      return;
+    }
     scrollToBottom();
   }, [messages]);
   
+  // Newest page first; older pages are loaded on demand
   const loadChatHistory = async (sessionId: string) => {
     try {
       const response = await apiService.getChatHistory(sessionId, 50);
       
       setMessages(response.messages);
+      setOlderCursor(response.has_more ? response.prev_cursor : null);
     } catch (error) {
       console.error('Error loading chat history:', error);
     }
   };
 
+  const loadOlderMessages = async () => {
+    if (!currentSessionId || !olderCursor) return;
+    try {
+      const response = await apiService.getChatHistory(currentSessionId, 50, olderCursor);
+      keepScroll.current = true;
+      setMessages(prev => [...response.messages, ...prev]);
+      setOlderCursor(response.has_more ? response.prev_cursor : null);
+    } catch (error) {
+      console.error('Error loading older messages:', error);
+    }
+  };
+
   useEffect(() => {
     if (initialMessage && initialMessage.trim()) {
         setInputValue(initialMessage);
@@ -134,6 +155,16 @@ const Chat: React.FC<ChatProps> = ({
             ref={messagesContainerRef}
             className='flex-1 overflow-y-auto space-y-4 px-4'
         >
+                {olderCursor && (
+                    <div className='flex justify-center'>
+                        <button
+                            onClick={loadOlderMessages}
+                            className='text-xs text-purple-600 hover:underline'
+                        >
+                            Load older messages
+                        </button>
+                    </div>
+                )}
                 {messages.length === 0 ? (
                     <div className='flex items-center justify-center h-64 text-gray-500'>
                         <p>Start a conversation...</p>
@@ -28,6 +28,7 @@ const Sidebar: React.FC<SidebarProps> = ({
   const { user, userId, isAnonymous, logout } = useAuth();
   const [sessions, setSessions] = useState<ChatSession[]>([]);
   const [isLoading, setIsLoading] = useState(false);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
   const [showAuthModal, setShowAuthModal] = useState(false);
   const [showUserMenu, setShowUserMenu] = useState(false);
 
@@ -38,7 +39,8 @@ const Sidebar: React.FC<SidebarProps> = ({
     setIsLoading(true);
     try {
       const response = await apiService.getUserSessions(userId);
-      setSessions(response.sessions.slice(0, 10));
+      setSessions(response.sessions);
+      setNextCursor(response.next_cursor);
     } catch (error) {
       console.error('Error loading sessions:', error);
     } finally {
@@ -46,6 +48,19 @@ const Sidebar: React.FC<SidebarProps> = ({
     }
   };
 
+  // Older sessions, one page at a time
+  const loadMoreSessions = async () => {
+    if (!userId || !nextCursor) return;
+
+    try {
+      const response = await apiService.getUserSessions(userId, 10, nextCursor);
+      setSessions(prev => [...prev, ...response.sessions]);
+      setNextCursor(response.next_cursor);
+    } catch (error) {
+      console.error('Error loading more sessions:', error);
+    }
+  };
+
   useEffect(() => {
     loadSessions();
   }, [refreshTrigger, userId]);
@@ -151,6 +166,14 @@ const Sidebar: React.FC<SidebarProps> = ({
                 </div>
               </button>
             ))}
+            {nextCursor && (
+              <button
+                onClick={loadMoreSessions}
+                className="w-full text-center px-3 py-2 text-xs text-purple-600 hover:bg-gray-100 rounded-lg"
+              >
+                Load more
+              </button>
+            )}
           </div>
         )}
       </div>
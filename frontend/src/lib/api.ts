@@ -48,14 +48,17 @@ export const apiService = {
         return response.data;
     },
 
-    // Get chat history 
-    async getChatHistory(sessionId: string, limit: number = 50): Promise<any> {
-        const response = await api.get(`/api/chat/messages/${sessionId}?limit=${limit}`);
+    // Get chat history: the newest page, or the page before `before` (a prev_cursor)
+    async getChatHistory(sessionId: string, limit: number = 50, before?: string): Promise<any> {
+        const params = before ? { limit, before } : { limit, latest: true };
+        const response = await api.get(`/api/chat/messages/${sessionId}`, { params });
         return response.data;
     },
 
-    async getUserSessions(userId: string = "default_user"): Promise<any> {
-    const response = await api.get(`/api/users/${userId}/sessions`);
+    // Sessions newest first; pass the previous page's next_cursor as `before`
+    async getUserSessions(userId: string = "default_user", limit: number = 10, before?: string): Promise<any> {
+    const params = before ? { limit, before } : { limit };
+    const response = await api.get(`/api/users/${userId}/sessions`, { params });
     return response.data;
   },
 